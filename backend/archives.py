@@ -0,0 +1,81 @@
+"""
+Helpers for multi-image uploads.
+Expands zip/tar archives of scans into (filename, bytes) pairs.
+"""
+
+import io
+import os
+import tarfile
+import zipfile
+from typing import List, Tuple
+
+IMAGE_EXTENSIONS = {".jpg", ".jpeg", ".png", ".bmp", ".tif", ".tiff", ".webp"}
+
+
+class ArchiveError(ValueError):
+    """Raised when an uploaded archive is unreadable or exceeds the limits."""
+
+
+def is_image_name(name: str) -> bool:
+    base = os.path.basename(name)
+    if not base or base.startswith(".") or "__MACOSX" in name:
+        return False
+    return os.path.splitext(base)[1].lower() in IMAGE_EXTENSIONS
+
+
+def is_archive(filename: str, contents: bytes) -> bool:
+    """Check whether an uploaded file is a zip or tar archive."""
+    if zipfile.is_zipfile(io.BytesIO(contents)):
+        return True
+    name = (filename or "").lower()
+    if name.endswith((".tar", ".tar.gz", ".tgz", ".tar.bz2", ".tar.xz")):
+        return True
+    try:
+        return tarfile.is_tarfile(io.BytesIO(contents))
+    except Exception:
+        return False
+
+
+def expand_archive(contents: bytes, max_files: int, max_bytes: int) -> List[Tuple[str, bytes]]:
+    """
+    Extract the image members of a zip or tar archive.
+
+    Args:
+        contents: Raw archive bytes
+        max_files: Maximum number of images accepted from the archive
+        max_bytes: Maximum total uncompressed size of the extracted images
+
+    Returns:
+        (member name, file bytes) pairs in archive order
+    """
+    buffer = io.BytesIO(contents)
+    members = []
+    total = 0
+
+    def add(name: str, size: int, read):
+        nonlocal total
+        if len(members) >= max_files:
+            raise ArchiveError(f"Archive contains more than {max_files} images")
+        total += size
+        if total > max_bytes:
+            raise ArchiveError(f"Archive expands to more than {max_bytes} bytes")
+        members.append((name, read()))
+
+    try:
+        if zipfile.is_zipfile(buffer):
+            with zipfile.ZipFile(buffer) as archive:
+                for info in archive.infolist():
+                    if info.is_dir() or not is_image_name(info.filename):
+                        continue
+                    add(info.filename, info.file_size, lambda info=info: archive.read(info))
+        else:
+            buffer.seek(0)
+            with tarfile.open(fileobj=buffer, mode="r:*") as archive:
+                for info in archive:
+                    if not info.isfile() or not is_image_name(info.name):
+                        continue
+                    add(info.name, info.size, lambda info=info: archive.extractfile(info).read())
+    except (zipfile.BadZipFile, tarfile.TarError) as e:
+        raise ArchiveError(f"Unreadable archive: {e}")
+
+    return members
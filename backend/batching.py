@@ -0,0 +1,253 @@
+"""
+Dynamic micro-batching for model inference.
+Coalesces concurrent prediction requests into a single batched model call.
+"""
+
+import asyncio
+import time
+from collections import deque
+from concurrent.futures import Executor
+from typing import Callable, Dict, List, Optional
+
+import numpy as np
+
+# Upper bounds (inclusive) of the batch size histogram buckets
+BATCH_SIZE_BUCKETS = [1, 2, 4, 8, 16, 32, 64, 128]
+
+
+class LatencyTracker:
+    """Keeps a rolling window of latency samples (in milliseconds)."""
+
+    def __init__(self, window: int = 1000):
+        self.samples = deque(maxlen=window)
+        self.count = 0
+        self.total_ms = 0.0
+
+    def record(self, seconds: float):
+        ms = seconds * 1000.0
+        self.samples.append(ms)
+        self.count += 1
+        self.total_ms += ms
+
+    def summary(self) -> Dict:
+        if not self.samples:
+            return {"count": self.count, "mean_ms": 0.0, "p50_ms": 0.0, "p95_ms": 0.0, "p99_ms": 0.0}
+        window = np.fromiter(self.samples, dtype=np.float64)
+        p50, p95, p99 = np.percentile(window, [50, 95, 99])
+        return {
+            "count": self.count,
+            "mean_ms": round(self.total_ms / self.count, 3),
+            "p50_ms": round(float(p50), 3),
+            "p95_ms": round(float(p95), 3),
+            "p99_ms": round(float(p99), 3),
+        }
+
+
+class _PendingItem:
+    __slots__ = ("image", "future", "enqueued_at")
+
+    def __init__(self, image: np.ndarray, future: asyncio.Future):
+        self.image = image
+        self.future = future
+        self.enqueued_at = time.perf_counter()
+
+
+class MicroBatcher:
+    """
+    Queues single-image prediction requests and runs them through the model
+    in batches of up to `max_batch_size`, waiting at most `max_wait_ms` after
+    the first queued request before dispatching a partial batch.
+    """
+
+    def __init__(
+        self,
+        predict_fn: Callable[[np.ndarray], np.ndarray],
+        max_batch_size: int = 32,
+        max_wait_ms: float = 10.0,
+        executor: Optional[Executor] = None,
+        max_concurrent_batches: int = 1,
+        buffers=None
+    ):
+        """
+        Args:
+            predict_fn: Blocking function mapping an (N, H, W, C) batch to (N, classes) scores
+            max_batch_size: Maximum number of images per model call
+            max_wait_ms: Maximum time to hold the first request while filling a batch
+            executor: Pool that runs `predict_fn` (the loop's default executor if None)
+            max_concurrent_batches: Number of batches allowed in the executor at once
+            buffers: Optional preprocessing.BatchBuffers to assemble batches into
+        """
+        self.predict_fn = predict_fn
+        self.max_batch_size = max(1, int(max_batch_size))
+        self.max_wait = max(0.0, float(max_wait_ms)) / 1000.0
+        self.executor = executor
+        self.max_concurrent_batches = max(1, int(max_concurrent_batches))
+        self.buffers = buffers
+
+        self._queue: Optional[asyncio.Queue] = None
+        self._worker: Optional[asyncio.Task] = None
+        self._slots: Optional[asyncio.Semaphore] = None
+        self._in_flight = set()
+
+        self.total_requests = 0
+        self.total_batches = 0
+        self.batched_requests = 0
+        self.failed_batches = 0
+        self.batch_size_histogram = {bucket: 0 for bucket in BATCH_SIZE_BUCKETS}
+        self.queue_wait = LatencyTracker()
+        self.inference = LatencyTracker()
+        self.end_to_end = LatencyTracker()
+
+    def _ensure_worker(self):
+        if self._queue is None:
+            self._queue = asyncio.Queue()
+            self._slots = asyncio.Semaphore(self.max_concurrent_batches)
+        if self._worker is None or self._worker.done():
+            self._worker = asyncio.ensure_future(self._run())
+
+    async def predict(self, image: np.ndarray) -> np.ndarray:
+        """
+        Queue a single preprocessed image and wait for its scores.
+
+        Args:
+            image: Preprocessed image of shape (H, W, C)
+
+        Returns:
+            The model's score vector for this image
+        """
+        self._ensure_worker()
+        future = asyncio.get_running_loop().create_future()
+        item = _PendingItem(image, future)
+        self.total_requests += 1
+        await self._queue.put(item)
+        try:
+            return await future
+        finally:
+            self.end_to_end.record(time.perf_counter() - item.enqueued_at)
+
+    async def _collect_batch(self) -> List[_PendingItem]:
+        batch = [await self._queue.get()]
+        deadline = time.perf_counter() + self.max_wait
+
+        while len(batch) < self.max_batch_size:
+            # Take whatever is already queued without yielding
+            try:
+                batch.append(self._queue.get_nowait())
+                continue
+            except asyncio.QueueEmpty:
+                pass
+
+            remaining = deadline - time.perf_counter()
+            if remaining <= 0:
+                break
+            try:
+                batch.append(await asyncio.wait_for(self._queue.get(), timeout=remaining))
+            except asyncio.TimeoutError:
+                break
+
+        return batch
+
+    async def _run(self):
+        while True:
+            # Only start filling a batch once the executor has room for it
+            await self._slots.acquire()
+            try:
+                batch = await self._collect_batch()
+            except BaseException:
+                self._slots.release()
+                raise
+
+            batch = [item for item in batch if not item.future.cancelled()]
+            if not batch:
+                self._slots.release()
+                continue
+
+            task = asyncio.ensure_future(self._dispatch(batch))
+            self._in_flight.add(task)
+            task.add_done_callback(self._in_flight.discard)
+
+    async def _dispatch(self, batch: List[_PendingItem]):
+        loop = asyncio.get_running_loop()
+        dispatched_at = time.perf_counter()
+        for item in batch:
+            self.queue_wait.record(dispatched_at - item.enqueued_at)
+
+        buffer = self.buffers.acquire() if self.buffers is not None else None
+        try:
+            if buffer is not None:
+                inputs = np.stack([item.image for item in batch], out=buffer[:len(batch)])
+            else:
+                inputs = np.stack([item.image for item in batch])
+            scores = await loop.run_in_executor(self.executor, self.predict_fn, inputs)
+        except Exception as e:
+            self.failed_batches += 1
+            for item in batch:
+                if not item.future.done():
+                    item.future.set_exception(e)
+            return
+        except asyncio.CancelledError:
+            for item in batch:
+                item.future.cancel()
+            # The model thread may still be reading the buffer: drop it rather than reuse it
+            buffer = None
+            raise
+        finally:
+            if buffer is not None:
+                self.buffers.release(buffer)
+            self._slots.release()
+            self.inference.record(time.perf_counter() - dispatched_at)
+            self._record_batch_size(len(batch))
+
+        for item, row in zip(batch, scores):
+            if not item.future.done():
+                item.future.set_result(row)
+
+    def _record_batch_size(self, size: int):
+        self.total_batches += 1
+        self.batched_requests += size
+        for bucket in BATCH_SIZE_BUCKETS:
+            if size <= bucket:
+                self.batch_size_histogram[bucket] += 1
+                return
+        self.batch_size_histogram[BATCH_SIZE_BUCKETS[-1]] += 1
+
+    async def stop(self):
+        """Stop the batching worker and fail any requests still queued."""
+        if self._worker is not None:
+            self._worker.cancel()
+            try:
+                await self._worker
+            except asyncio.CancelledError:
+                pass
+            self._worker = None
+
+        for task in list(self._in_flight):
+            task.cancel()
+
+        if self._queue is not None:
+            while not self._queue.empty():
+                item = self._queue.get_nowait()
+                if not item.future.done():
+                    item.future.set_exception(RuntimeError("Inference batcher stopped"))
+
+    def get_stats(self) -> Dict:
+        """Return queue depth, batch size histogram and per-stage latency."""
+        return {
+            "config": {
+                "max_batch_size": self.max_batch_size,
+                "max_wait_ms": self.max_wait * 1000.0,
+                "max_concurrent_batches": self.max_concurrent_batches,
+            },
+            "queue_depth": self._queue.qsize() if self._queue is not None else 0,
+            "batches_in_flight": len(self._in_flight),
+            "total_requests": self.total_requests,
+            "total_batches": self.total_batches,
+            "failed_batches": self.failed_batches,
+            "avg_batch_size": round(self.batched_requests / self.total_batches, 2) if self.total_batches else 0.0,
+            "batch_size_histogram": {f"<={bucket}": count for bucket, count in self.batch_size_histogram.items()},
+            "latency": {
+                "queue_wait": self.queue_wait.summary(),
+                "inference": self.inference.summary(),
+                "end_to_end": self.end_to_end.summary(),
+            },
+        }
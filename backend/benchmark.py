@@ -0,0 +1,307 @@
+"""
+Benchmark the prediction path and check for regressions.
+
+Usage:
+    python benchmark.py --images-dir /archive/Testing --output bench.json
+    python benchmark.py --baseline bench_baseline.json --max-regression 0.15
+    python benchmark.py --output bench_baseline.json   # record a baseline
+
+Each model backend whose artifact exists (tensorflow, onnx, tflite and its
+float16/int8 variants) is measured in its own subprocess so peak RSS is per
+backend:
+    - decode / resize / inference latency percentiles on the raw runtime
+    - raw runtime throughput (images/sec) per batch size
+    - Grad-CAM overhead (tensorflow only): images/sec with ?explain=gradcam's
+      forward + backward pass per batch size, relative to plain prediction
+    - /predict latency and throughput per client concurrency, driving the
+      FastAPI app in-process through TestClient
+
+With --baseline, exits non-zero when a tracked metric regresses by more than
+--max-regression (latencies growing, throughputs shrinking).
+"""
+
+import argparse
+import json
+import os
+import resource
+import subprocess
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, List, Tuple
+
+import cv2
+import numpy as np
+
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+from archives import IMAGE_EXTENSIONS
+from batching import LatencyTracker
+from gradcam import to_heatmaps
+from preprocessing import decode_image, preprocess_array
+from runtimes import default_runtime_path
+
+IMAGE_SIZE = 150
+DEFAULT_MODEL_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "models", "braintumourN.h5")
+
+# target name -> (MODEL_BACKEND, MODEL_VARIANT)
+TARGETS = {
+    "tensorflow": ("tensorflow", None),
+    "onnx": ("onnx", None),
+    "tflite": ("tflite", None),
+    "tflite-float16": ("tflite", "float16"),
+    "tflite-int8": ("tflite", "int8"),
+}
+
+
+def synthetic_images(count: int, seed: int = 0) -> List[bytes]:
+    """JPEG-encoded noise images at typical MRI export resolutions."""
+    rng = np.random.default_rng(seed)
+    sizes = [(512, 512), (256, 256), (630, 630), (1024, 1024)]
+    images = []
+    for i in range(count):
+        height, width = sizes[i % len(sizes)]
+        img = cv2.GaussianBlur(rng.integers(0, 256, (height, width), dtype=np.uint8), (7, 7), 0)
+        images.append(cv2.imencode(".jpg", img)[1].tobytes())
+    return images
+
+
+def sample_images(directory: str, count: int) -> List[bytes]:
+    images = []
+    for root, _, filenames in sorted(os.walk(directory)):
+        for filename in sorted(filenames):
+            if os.path.splitext(filename)[1].lower() in IMAGE_EXTENSIONS:
+                with open(os.path.join(root, filename), "rb") as f:
+                    images.append(f.read())
+                if len(images) >= count:
+                    return images
+    return images
+
+
+def peak_rss_mb() -> float:
+    # ru_maxrss is in kilobytes on Linux
+    return round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 1)
+
+
+def bench_stages(runtime, images: List[bytes]) -> Dict:
+    """Per-image decode and resize latency, and single-image inference latency."""
+    decode, resize, inference = LatencyTracker(len(images)), LatencyTracker(len(images)), LatencyTracker(len(images))
+    buffer = np.empty((1, IMAGE_SIZE, IMAGE_SIZE, 3), dtype=np.uint8)
+    for contents in images:
+        start = time.perf_counter()
+        img = decode_image(contents, IMAGE_SIZE)
+        decoded = time.perf_counter()
+        preprocess_array(img, IMAGE_SIZE, out=buffer[0])
+        resized = time.perf_counter()
+        runtime.predict_on_batch(buffer)
+        done = time.perf_counter()
+        decode.record(decoded - start)
+        resize.record(resized - decoded)
+        inference.record(done - resized)
+    return {"decode": decode.summary(), "resize": resize.summary(), "inference": inference.summary()}
+
+
+def bench_batch_sizes(runtime, batch: np.ndarray, batch_sizes: List[int], repeats: int) -> Dict:
+    results = {}
+    for batch_size in batch_sizes:
+        inputs = np.resize(batch, (batch_size,) + batch.shape[1:])
+        runtime.predict_on_batch(inputs)
+        start = time.perf_counter()
+        for _ in range(repeats):
+            runtime.predict_on_batch(inputs)
+        results[str(batch_size)] = round(batch_size * repeats / (time.perf_counter() - start), 1)
+    return results
+
+
+def bench_gradcam(runtime, batch: np.ndarray, batch_sizes: List[int], repeats: int, plain: Dict) -> Dict:
+    """Grad-CAM throughput (scores + heatmaps) per batch size and its cost relative to plain prediction."""
+    results = {}
+    for batch_size in batch_sizes:
+        inputs = np.resize(batch, (batch_size,) + batch.shape[1:])
+        runtime.gradcam_on_batch(inputs)
+        start = time.perf_counter()
+        for _ in range(repeats):
+            _, cams = runtime.gradcam_on_batch(inputs)
+            to_heatmaps(cams, IMAGE_SIZE)
+        images_per_sec = batch_size * repeats / (time.perf_counter() - start)
+        results[str(batch_size)] = {
+            "images_per_sec": round(images_per_sec, 1),
+            # Time per image with Grad-CAM / time per image without it
+            "overhead": round(plain[str(batch_size)] / images_per_sec, 2),
+        }
+    return results
+
+
+def bench_app(images: List[bytes], concurrency_levels: List[int], requests_per_level: int) -> Dict:
+    """Drive /predict through the FastAPI app at each client concurrency."""
+    from fastapi.testclient import TestClient
+    import main
+
+    results = {}
+    with TestClient(main.app) as client:
+        def post(i: int) -> float:
+            start = time.perf_counter()
+            response = client.post("/predict", files={"file": (f"scan{i}.jpg", images[i % len(images)], "image/jpeg")})
+            response.raise_for_status()
+            return time.perf_counter() - start
+
+        post(0)
+        for concurrency in concurrency_levels:
+            latency = LatencyTracker(requests_per_level)
+            start = time.perf_counter()
+            with ThreadPoolExecutor(max_workers=concurrency) as pool:
+                for seconds in pool.map(post, range(requests_per_level)):
+                    latency.record(seconds)
+            elapsed = time.perf_counter() - start
+            results[str(concurrency)] = {
+                "requests_per_sec": round(requests_per_level / elapsed, 1),
+                "latency": latency.summary(),
+            }
+    return results
+
+
+def run_target(args) -> Dict:
+    """Benchmark one backend in this process (called in a subprocess)."""
+    from runtimes import load_runtime
+
+    backend, variant = TARGETS[args.target]
+    path = default_runtime_path(backend, args.model, variant)
+    images = sample_images(args.images_dir, args.samples) if args.images_dir else []
+    images = images or synthetic_images(args.samples)
+
+    start = time.perf_counter()
+    runtime = load_runtime(backend, path)
+    result = {"path": path, "load_seconds": round(time.perf_counter() - start, 3)}
+
+    batch = np.stack([preprocess_array(decode_image(c, IMAGE_SIZE), IMAGE_SIZE) for c in images[:max(args.batch_sizes)]])
+    runtime.predict_on_batch(batch[:1])
+    result["stages"] = bench_stages(runtime, images)
+    result["raw_images_per_sec"] = bench_batch_sizes(runtime, batch, args.batch_sizes, args.repeats)
+    if getattr(runtime, "supports_gradcam", False):
+        result["gradcam"] = bench_gradcam(runtime, batch, args.batch_sizes, args.repeats, result["raw_images_per_sec"])
+
+    if not args.skip_app:
+        # Configure the app before importing it: main reads its settings at import
+        os.environ.update({
+            "MODEL_BACKEND": backend,
+            "MODEL_VARIANT": variant or "",
+            "MODEL_RUNTIME_PATH": path,
+            "MODEL_LOAD_MODE": "blocking",
+            "PREDICTION_CACHE_SIZE": "0",
+            "PREDICTION_CACHE_DB": "",
+            "JOB_WORKERS": "0",
+        })
+        result["app"] = bench_app(images, args.concurrency, args.requests)
+
+    result["peak_rss_mb"] = peak_rss_mb()
+    return result
+
+
+def tracked_metrics(results: Dict) -> Dict[str, Tuple[float, bool]]:
+    """Flatten results to {metric: (value, higher_is_better)} for baseline comparison."""
+    metrics = {}
+    for target, result in results["targets"].items():
+        if "error" in result:
+            continue
+        for stage, summary in result["stages"].items():
+            metrics[f"{target}.{stage}.p95_ms"] = (summary["p95_ms"], False)
+        for batch_size, value in result["raw_images_per_sec"].items():
+            metrics[f"{target}.raw.batch{batch_size}.images_per_sec"] = (value, True)
+        for batch_size, entry in result.get("gradcam", {}).items():
+            metrics[f"{target}.gradcam.batch{batch_size}.images_per_sec"] = (entry["images_per_sec"], True)
+        for concurrency, entry in result.get("app", {}).items():
+            metrics[f"{target}.app.c{concurrency}.requests_per_sec"] = (entry["requests_per_sec"], True)
+            metrics[f"{target}.app.c{concurrency}.p95_ms"] = (entry["latency"]["p95_ms"], False)
+        metrics[f"{target}.peak_rss_mb"] = (result["peak_rss_mb"], False)
+    return metrics
+
+
+def compare(results: Dict, baseline: Dict, max_regression: float) -> List[str]:
+    """Describe every tracked metric that regressed by more than `max_regression`."""
+    current, previous = tracked_metrics(results), tracked_metrics(baseline)
+    regressions = []
+    for name, (value, higher_is_better) in sorted(current.items()):
+        if name not in previous or not previous[name][0]:
+            continue
+        old = previous[name][0]
+        change = (old - value) / old if higher_is_better else (value - old) / old
+        if change > max_regression:
+            regressions.append(f"{name}: {old} -> {value} ({change:+.1%} worse)")
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the prediction path.")
+    parser.add_argument("--model", default=DEFAULT_MODEL_PATH, help="Keras .h5 model; exports are found next to it")
+    parser.add_argument("--targets", nargs="+", choices=list(TARGETS), help="Default: every target with an artifact")
+    parser.add_argument("--images-dir", help="Sample scans (searched recursively); synthetic images otherwise")
+    parser.add_argument("--samples", type=int, default=64)
+    parser.add_argument("--batch-sizes", nargs="+", type=int, default=[1, 8, 32])
+    parser.add_argument("--repeats", type=int, default=5)
+    parser.add_argument("--concurrency", nargs="+", type=int, default=[1, 8, 32])
+    parser.add_argument("--requests", type=int, default=128, help="/predict requests per concurrency level")
+    parser.add_argument("--skip-app", action="store_true", help="Only benchmark the raw runtimes")
+    parser.add_argument("--output", help="Write results as JSON to this path")
+    parser.add_argument("--baseline", help="Compare with a stored results file")
+    parser.add_argument("--max-regression", type=float, default=0.15, help="Allowed relative regression (0.15 = 15%%)")
+    parser.add_argument("--target", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.target:
+        print(json.dumps(run_target(args)))
+        return
+
+    targets = args.targets or [
+        name for name, (backend, variant) in TARGETS.items()
+        if os.path.exists(default_runtime_path(backend, args.model, variant))
+    ]
+    if not targets:
+        sys.exit(f"No model artifacts found next to {args.model}")
+
+    results = {"created": time.time(), "config": {k: v for k, v in vars(args).items() if k != "target"}, "targets": {}}
+    child_args = sys.argv[1:]
+    for target in targets:
+        print(f"Benchmarking {target}...", file=sys.stderr)
+        completed = subprocess.run(
+            [sys.executable, os.path.abspath(__file__), *child_args, "--target", target],
+            stdout=subprocess.PIPE, text=True
+        )
+        if completed.returncode != 0:
+            results["targets"][target] = {"error": f"exit code {completed.returncode}"}
+            continue
+        results["targets"][target] = json.loads(completed.stdout.strip().splitlines()[-1])
+
+    for target, result in results["targets"].items():
+        if "error" in result:
+            print(f"{target}: {result['error']}")
+            continue
+        stages = ", ".join(f"{stage} p50 {s['p50_ms']} / p95 {s['p95_ms']} ms" for stage, s in result["stages"].items())
+        raw = ", ".join(f"bs{bs}: {ips}" for bs, ips in result["raw_images_per_sec"].items())
+        print(f"{target}: {stages}")
+        print(f"  raw images/sec {raw}; peak RSS {result['peak_rss_mb']} MB")
+        if "gradcam" in result:
+            gradcam = ", ".join(
+                f"bs{bs}: {entry['images_per_sec']} ({entry['overhead']}x)" for bs, entry in result["gradcam"].items()
+            )
+            print(f"  grad-cam images/sec {gradcam}")
+        for concurrency, entry in result.get("app", {}).items():
+            print(f"  /predict c={concurrency}: {entry['requests_per_sec']} req/s, "
+                  f"p50 {entry['latency']['p50_ms']} ms, p95 {entry['latency']['p95_ms']} ms")
+
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(results, f, indent=2)
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            regressions = compare(results, json.load(f), args.max_regression)
+        if regressions:
+            print(f"\n{len(regressions)} regression(s) above {args.max_regression:.0%}:")
+            for line in regressions:
+                print(f"  {line}")
+            sys.exit(1)
+        print(f"\nNo regressions above {args.max_regression:.0%} against {args.baseline}")
+
+
+if __name__ == "__main__":
+    main()
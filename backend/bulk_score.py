@@ -0,0 +1,354 @@
+"""
+Score large collections of scans offline, without the HTTP API.
+
+Usage:
+    python bulk_score.py /archive/Testing --output scores.csv
+    python bulk_score.py scans.tar.gz more_scans/ --output scores.parquet --backend onnx
+    python bulk_score.py /archive/Testing --output scores.csv --resume   # continue a killed run
+
+Inputs are directories (searched recursively), zip/tar archives or single
+images. Scans are decoded on a pool of threads with the API's preprocessing,
+fed to the model in large batches, and every batch is appended to the output
+(.csv, .jsonl, or a .parquet directory of part files) as soon as it is scored.
+With --resume, inputs already in the output are skipped.
+
+When a scan's folder is named after a class (e.g. `glioma_tumor`, as in the
+/archive/<split>/<label> layout exp.py reads), it is used as the true label
+and a confusion matrix with per-class accuracy is printed at the end.
+"""
+
+import argparse
+import csv
+import json
+import os
+import sys
+import tarfile
+import time
+import zipfile
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, Iterator, List, Optional, Tuple, Union
+
+import numpy as np
+
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+from archives import is_image_name
+from preprocessing import preprocess_file, preprocess_image
+from runtimes import RUNTIME_BACKENDS, default_runtime_path, load_runtime
+
+try:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+except ImportError:
+    pa = pq = None
+
+IMAGE_SIZE = 150
+LABELS = ['Glioma Tumour', 'Meningioma Tumour', 'No Tumour', 'Pituitary Tumour']
+DEFAULT_MODEL_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "models", "braintumourN.h5")
+
+# Separates an archive path from the member name in output keys
+ARCHIVE_SEPARATOR = "::"
+OUTPUT_FORMATS = ("csv", "jsonl", "parquet")
+
+
+def _label_key(name: str) -> str:
+    return name.strip().lower().replace(" ", "_").replace("-", "_").replace("tumour", "tumor")
+
+
+# Folder name (normalized) -> class index, e.g. "glioma_tumor" -> 0
+FOLDER_LABELS = {_label_key(label): index for index, label in enumerate(LABELS)}
+SCORE_COLUMNS = [f"score_{_label_key(label)}" for label in LABELS]
+COLUMNS = ["path", "label", "prediction", "confidence", *SCORE_COLUMNS, "error"]
+
+
+def label_from_key(key: str) -> Optional[str]:
+    """The class named by a scan's parent folder, if any."""
+    member = key.rsplit(ARCHIVE_SEPARATOR, 1)[-1]
+    folder = os.path.basename(os.path.dirname(member))
+    index = FOLDER_LABELS.get(_label_key(folder))
+    return LABELS[index] if index is not None else None
+
+
+def iter_inputs(paths: List[str]) -> Iterator[Tuple[str, Union[str, bytes]]]:
+    """
+    Yield (key, source) for every scan: a file path for files on disk, or the
+    member bytes for archives (read sequentially, so tar streams are never seeked).
+    """
+    for path in paths:
+        if os.path.isdir(path):
+            for root, dirs, filenames in os.walk(path):
+                dirs.sort()
+                for filename in sorted(filenames):
+                    if is_image_name(filename):
+                        full_path = os.path.join(root, filename)
+                        yield full_path, full_path
+        elif zipfile.is_zipfile(path):
+            with zipfile.ZipFile(path) as archive:
+                for info in archive.infolist():
+                    if not info.is_dir() and is_image_name(info.filename):
+                        yield f"{path}{ARCHIVE_SEPARATOR}{info.filename}", archive.read(info)
+        elif tarfile.is_tarfile(path):
+            with tarfile.open(path, mode="r|*") as archive:
+                for info in archive:
+                    if info.isfile() and is_image_name(info.name):
+                        yield f"{path}{ARCHIVE_SEPARATOR}{info.name}", archive.extractfile(info).read()
+        elif os.path.isfile(path):
+            yield path, path
+        else:
+            print(f"Skipping {path}: not found", file=sys.stderr)
+
+
+def decode_batch(items: List[Tuple[str, Union[str, bytes]]], image_size: int) -> Tuple[np.ndarray, List[Optional[str]]]:
+    """Decode a chunk of scans into one batch; returns (batch, per-item error or None)."""
+    batch = np.empty((len(items), image_size, image_size, 3), dtype=np.uint8)
+    errors: List[Optional[str]] = [None] * len(items)
+    for i, (_, source) in enumerate(items):
+        try:
+            if isinstance(source, str):
+                preprocess_file(source, image_size, out=batch[i])
+            else:
+                preprocess_image(source, image_size, out=batch[i])
+        except Exception as e:
+            errors[i] = str(e) or type(e).__name__
+    return batch, errors
+
+
+class _LineWriter:
+    """Appends rows to a CSV or JSONL file, flushed after every batch."""
+
+    def __init__(self, path: str, fmt: str, append: bool):
+        if append:
+            _truncate_partial_line(path)
+        new_file = not append or not os.path.exists(path) or os.path.getsize(path) == 0
+        self.fmt = fmt
+        self.file = open(path, "a" if append else "w", newline="")
+        self.csv = csv.DictWriter(self.file, fieldnames=COLUMNS) if fmt == "csv" else None
+        if self.csv is not None and new_file:
+            self.csv.writeheader()
+
+    def write(self, rows: List[Dict]):
+        if self.csv is not None:
+            self.csv.writerows(rows)
+        else:
+            self.file.writelines(json.dumps(row) + "\n" for row in rows)
+        self.file.flush()
+
+    def close(self):
+        self.file.close()
+
+
+class _ParquetWriter:
+    """
+    Writes a directory of Parquet part files. A Parquet file is unreadable
+    until its footer is written, so rows are committed as complete parts
+    (atomically renamed) every `rows_per_part` rows.
+    """
+
+    def __init__(self, path: str, append: bool, rows_per_part: int = 8192):
+        if pq is None:
+            sys.exit("Parquet output requires pyarrow (pip install pyarrow)")
+        os.makedirs(path, exist_ok=True)
+        if not append:
+            for name in os.listdir(path):
+                if name.startswith("part-"):
+                    os.remove(os.path.join(path, name))
+        self.path = path
+        self.rows_per_part = rows_per_part
+        self.rows: List[Dict] = []
+        self.part = len([name for name in os.listdir(path) if name.endswith(".parquet")])
+
+    def write(self, rows: List[Dict]):
+        self.rows.extend(rows)
+        if len(self.rows) >= self.rows_per_part:
+            self._flush()
+
+    def _flush(self):
+        if not self.rows:
+            return
+        # Explicit schema: a part without failures must not get a null-typed "error" column
+        schema = pa.schema([
+            (column, pa.float64() if column == "confidence" or column in SCORE_COLUMNS else pa.string())
+            for column in COLUMNS
+        ])
+        table = pa.Table.from_pylist(self.rows, schema=schema)
+        final = os.path.join(self.path, f"part-{self.part:05d}.parquet")
+        pq.write_table(table, final + ".tmp")
+        os.replace(final + ".tmp", final)
+        self.part += 1
+        self.rows = []
+
+    def close(self):
+        self._flush()
+
+
+def _truncate_partial_line(path: str):
+    """Drop a half-written last line left by a killed run."""
+    if not os.path.exists(path):
+        return
+    with open(path, "rb+") as f:
+        data = f.read()
+        if data and not data.endswith(b"\n"):
+            f.truncate(data.rfind(b"\n") + 1)
+
+
+def read_existing(path: str, fmt: str) -> List[Dict]:
+    """Rows already written by a previous run (for --resume)."""
+    if not os.path.exists(path):
+        return []
+    if fmt == "parquet":
+        if pq is None:
+            sys.exit("Parquet output requires pyarrow (pip install pyarrow)")
+        rows = []
+        for name in sorted(os.listdir(path)):
+            if name.endswith(".parquet"):
+                rows.extend(pq.read_table(os.path.join(path, name), columns=["path", "label", "prediction"]).to_pylist())
+        return rows
+    _truncate_partial_line(path)
+    with open(path, newline="") as f:
+        if fmt == "csv":
+            return list(csv.DictReader(f))
+        return [json.loads(line) for line in f if line.strip()]
+
+
+def open_writer(path: str, fmt: str, append: bool):
+    if fmt == "parquet":
+        return _ParquetWriter(path, append)
+    return _LineWriter(path, fmt, append)
+
+
+def score_rows(items, batch: np.ndarray, errors: List[Optional[str]], runtime) -> List[Dict]:
+    """Run the decodable scans of a batch through the model and build output rows."""
+    valid = [i for i, error in enumerate(errors) if error is None]
+    scores = {}
+    if valid:
+        inputs = batch if len(valid) == len(items) else batch[valid]
+        scores = dict(zip(valid, np.asarray(runtime.predict_on_batch(inputs))))
+
+    rows = []
+    for i, (key, _) in enumerate(items):
+        row = dict.fromkeys(COLUMNS, None)
+        row.update({"path": key, "label": label_from_key(key), "error": errors[i]})
+        if i in scores:
+            row["prediction"] = LABELS[int(np.argmax(scores[i]))]
+            row["confidence"] = round(float(np.max(scores[i])), 6)
+            row.update({column: round(float(value), 6) for column, value in zip(SCORE_COLUMNS, scores[i])})
+        rows.append(row)
+    return rows
+
+
+def confusion_matrix(rows: List[Dict]) -> Optional[np.ndarray]:
+    """Confusion matrix (true x predicted) over labeled, successfully scored rows."""
+    index = {label: i for i, label in enumerate(LABELS)}
+    matrix = np.zeros((len(LABELS), len(LABELS)), dtype=np.int64)
+    for row in rows:
+        if row.get("label") in index and row.get("prediction") in index:
+            matrix[index[row["label"]], index[row["prediction"]]] += 1
+    return matrix if matrix.sum() else None
+
+
+def print_confusion(matrix: np.ndarray):
+    width = max(len(label) for label in LABELS) + 2
+    print(f"\nConfusion matrix (rows: true, columns: predicted), {matrix.sum()} labeled scans")
+    print(" " * width + "".join(f"{label:>{width}}" for label in LABELS))
+    for label, counts in zip(LABELS, matrix):
+        print(f"{label:<{width}}" + "".join(f"{count:>{width}}" for count in counts))
+
+    print("\nPer-class accuracy:")
+    for label, counts, correct in zip(LABELS, matrix, np.diag(matrix)):
+        total = counts.sum()
+        accuracy = f"{correct / total:.2%}" if total else "n/a"
+        print(f"  {label:<{width}}{accuracy:>8}  ({correct}/{total})")
+    print(f"  {'Overall':<{width}}{np.trace(matrix) / matrix.sum():>8.2%}")
+
+
+def _chunks(items: Iterator, size: int) -> Iterator[List]:
+    chunk = []
+    for item in items:
+        chunk.append(item)
+        if len(chunk) == size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Score directories and archives of scans offline.")
+    parser.add_argument("inputs", nargs="+", help="Directories, zip/tar archives or image files")
+    parser.add_argument("--output", required=True, help="Results file: .csv, .jsonl or .parquet (a directory of parts)")
+    parser.add_argument("--format", choices=OUTPUT_FORMATS, help="Default: from the --output extension")
+    parser.add_argument("--resume", action="store_true", help="Skip inputs already in --output and append")
+    parser.add_argument("--overwrite", action="store_true", help="Replace an existing --output")
+    parser.add_argument("--model", default=DEFAULT_MODEL_PATH, help="Keras .h5 model; exports are found next to it")
+    parser.add_argument("--backend", choices=RUNTIME_BACKENDS, default=os.getenv("MODEL_BACKEND", "tensorflow"))
+    parser.add_argument("--variant", default=os.getenv("MODEL_VARIANT") or None, help="TFLite variant, e.g. float16 or int8")
+    parser.add_argument("--threads", type=int, default=0, help="Intra-op threads for ONNX Runtime / TFLite")
+    parser.add_argument("--batch-size", type=int, default=256)
+    parser.add_argument("--workers", type=int, default=os.cpu_count() or 4, help="Decode threads")
+    parser.add_argument("--prefetch", type=int, help="Decoded batches kept ahead of the model (default: workers + 1)")
+    parser.add_argument("--progress-every", type=float, default=10.0, help="Seconds between progress lines")
+    args = parser.parse_args()
+
+    fmt = args.format or os.path.splitext(args.output)[1].lstrip(".").lower()
+    if fmt not in OUTPUT_FORMATS:
+        sys.exit(f"Unknown output format '{fmt}', expected one of {OUTPUT_FORMATS} (use --format)")
+    if os.path.exists(args.output) and not (args.resume or args.overwrite):
+        sys.exit(f"{args.output} exists; pass --resume to continue it or --overwrite to replace it")
+
+    existing = read_existing(args.output, fmt) if args.resume else []
+    done = {row["path"] for row in existing}
+    if done:
+        print(f"Resuming: {len(done)} scans already scored")
+
+    path = default_runtime_path(args.backend, args.model, args.variant)
+    start = time.perf_counter()
+    runtime = load_runtime(args.backend, path, num_threads=args.threads)
+    print(f"Loaded {path} ({args.backend} runtime) in {time.perf_counter() - start:.1f}s")
+
+    items = ((key, source) for key, source in iter_inputs(args.inputs) if key not in done)
+    writer = open_writer(args.output, fmt, append=args.resume)
+    prefetch = args.prefetch or args.workers + 1
+    results: List[Dict] = [{"path": row["path"], "label": row["label"], "prediction": row["prediction"]} for row in existing]
+    scored = failed = 0
+
+    start = last_report = time.perf_counter()
+    # Decoding runs ahead on the pool while the model scores the oldest batch
+    with ThreadPoolExecutor(max_workers=args.workers, thread_name_prefix="decode") as pool:
+        pending = deque()
+
+        def score_next():
+            nonlocal scored, failed, last_report
+            chunk, future = pending.popleft()
+            batch, errors = future.result()
+            rows = score_rows(chunk, batch, errors, runtime)
+            writer.write(rows)
+            results.extend({"path": r["path"], "label": r["label"], "prediction": r["prediction"]} for r in rows)
+            scored += len(rows)
+            failed += sum(error is not None for error in errors)
+            now = time.perf_counter()
+            if now - last_report >= args.progress_every:
+                print(f"{scored} scans, {scored / (now - start):.1f} images/sec")
+                last_report = now
+
+        try:
+            for chunk in _chunks(items, args.batch_size):
+                pending.append((chunk, pool.submit(decode_batch, chunk, IMAGE_SIZE)))
+                if len(pending) > prefetch:
+                    score_next()
+            while pending:
+                score_next()
+        finally:
+            writer.close()
+
+    elapsed = time.perf_counter() - start
+    print(f"Scored {scored} scans ({failed} unreadable) in {elapsed:.1f}s: "
+          f"{scored / elapsed if elapsed else 0:.1f} images/sec -> {args.output}")
+
+    matrix = confusion_matrix(results)
+    if matrix is not None:
+        print_confusion(matrix)
+
+
+if __name__ == "__main__":
+    main()
@@ -4,25 +4,90 @@ Provides medical education and explains brain tumor detection results.
 """
 
 import os
-from typing import List, Dict, Optional
-from groq import Groq
+import time
+import asyncio
+from typing import AsyncIterator, List, Dict, Optional, Tuple
+from llm_client import UpstreamClient, CircuitOpenError, DeadlineExceededError
 from educational_data import get_tumor_info, FAQS
+from response_cache import ChatResponseCache, make_cache_key
+from prompt_builder import PromptBuilder, Tokenizer
+from telemetry import CHAT_TOKENS, record_stage, stage
 
-# Initialize Groq client
+# Groq model and sampling settings
+CHAT_MODEL = "llama-3.3-70b-versatile"  # Fast and accurate model
+CHAT_TEMPERATURE = 0.7  # Balanced creativity and consistency
+CHAT_MAX_TOKENS = 800  # Reasonable response length
+CHAT_TOP_P = 0.9
+
+# Response cache for first-turn questions asked without a scan context (later
+# turns depend on the history, and answers about a scan quote its exact numbers)
+CHAT_CACHE_ENABLED = os.getenv("CHAT_CACHE_ENABLED", "1") != "0"
+CHAT_CACHE_SIZE = int(os.getenv("CHAT_CACHE_SIZE", "512"))
+CHAT_CACHE_TTL = float(os.getenv("CHAT_CACHE_TTL", "86400"))
+
+response_cache = ChatResponseCache(max_entries=CHAT_CACHE_SIZE, ttl_seconds=CHAT_CACHE_TTL)
+
+# Upstream client: connection pool, concurrent calls, tokens-per-minute budget
+# (0 = unlimited), retries on 429/5xx and the circuit breaker (see llm_client.py)
+CHAT_UPSTREAM_CONNECTIONS = int(os.getenv("CHAT_UPSTREAM_CONNECTIONS", "20"))
+CHAT_UPSTREAM_CONCURRENCY = int(os.getenv("CHAT_UPSTREAM_CONCURRENCY", "8"))
+CHAT_UPSTREAM_TPM = int(os.getenv("CHAT_UPSTREAM_TPM", "0"))
+CHAT_UPSTREAM_RETRIES = int(os.getenv("CHAT_UPSTREAM_RETRIES", "3"))
+CHAT_UPSTREAM_BACKOFF_MS = float(os.getenv("CHAT_UPSTREAM_BACKOFF_MS", "250"))
+CHAT_UPSTREAM_BACKOFF_MAX_MS = float(os.getenv("CHAT_UPSTREAM_BACKOFF_MAX_MS", "8000"))
+CHAT_UPSTREAM_TIMEOUT = float(os.getenv("CHAT_UPSTREAM_TIMEOUT", "30"))
+CHAT_BREAKER_FAILURES = int(os.getenv("CHAT_BREAKER_FAILURES", "5"))
+CHAT_BREAKER_RESET = float(os.getenv("CHAT_BREAKER_RESET", "30"))
+
+# Prompt token budget: local tokenizer (auto = tiktoken if installed, else a
+# heuristic), total input tokens per request, longest user message, tokens for
+# the summary of history turns that no longer fit, and history messages considered
+CHAT_TOKENIZER = os.getenv("CHAT_TOKENIZER", "auto")
+CHAT_INPUT_TOKEN_BUDGET = int(os.getenv("CHAT_INPUT_TOKEN_BUDGET", "3000"))
+CHAT_MAX_USER_TOKENS = int(os.getenv("CHAT_MAX_USER_TOKENS", "1000"))
+CHAT_HISTORY_SUMMARY_TOKENS = int(os.getenv("CHAT_HISTORY_SUMMARY_TOKENS", "150"))
+CHAT_MAX_HISTORY_MESSAGES = int(os.getenv("CHAT_MAX_HISTORY_MESSAGES", "20"))
+
+tokenizer = Tokenizer(CHAT_TOKENIZER)
+
+# Shared upstream client (async, so generation never blocks the event loop)
 client = None
 
-def initialize_groq_client(api_key: str = None):
-    """Initialize the Groq API client."""
+def initialize_groq_client(api_key: str = None, base_url: str = None):
+    """
+    Initialize the Groq API client.
+    GROQ_BASE_URL can point it at any Groq/OpenAI-compatible server (e.g. a local fake for tests).
+    """
     global client
     if api_key is None:
         api_key = os.getenv("GROQ_API_KEY")
+    if base_url is None:
+        base_url = os.getenv("GROQ_BASE_URL") or None
     
     if not api_key:
         raise ValueError("GROQ_API_KEY not found in environment variables")
     
-    client = Groq(api_key=api_key)
+    client = UpstreamClient(
+        api_key,
+        base_url=base_url,
+        max_connections=CHAT_UPSTREAM_CONNECTIONS,
+        max_concurrency=CHAT_UPSTREAM_CONCURRENCY,
+        tokens_per_minute=CHAT_UPSTREAM_TPM,
+        max_retries=CHAT_UPSTREAM_RETRIES,
+        backoff_base=CHAT_UPSTREAM_BACKOFF_MS / 1000,
+        backoff_max=CHAT_UPSTREAM_BACKOFF_MAX_MS / 1000,
+        timeout=CHAT_UPSTREAM_TIMEOUT,
+        breaker_failures=CHAT_BREAKER_FAILURES,
+        breaker_reset=CHAT_BREAKER_RESET,
+        count_tokens=tokenizer.count
+    )
     return client
 
+async def close_groq_client():
+    """Close the upstream connection pool."""
+    if client is not None:
+        await client.close()
+
 # System prompt that defines the chatbot's personality and role
 SYSTEM_PROMPT = """You are MedBot, an intelligent medical education assistant for a Brain Tumor Detection platform. Your role is to:
 
@@ -78,15 +143,45 @@ def build_context_prompt(context: Optional[Dict] = None) -> str:
     
     return context_prompt
 
-def format_conversation_history(history: List[Dict]) -> List[Dict]:
-    """Format conversation history for Groq API."""
-    formatted = []
-    for msg in history[-10:]:  # Keep last 10 messages for context
-        formatted.append({
-            "role": msg["role"],
-            "content": msg["content"]
-        })
-    return formatted
+prompt_builder = PromptBuilder(
+    SYSTEM_PROMPT,
+    build_context_prompt,
+    tokenizer,
+    input_budget=CHAT_INPUT_TOKEN_BUDGET,
+    max_user_tokens=CHAT_MAX_USER_TOKENS,
+    summary_tokens=CHAT_HISTORY_SUMMARY_TOKENS,
+    max_history_messages=CHAT_MAX_HISTORY_MESSAGES
+)
+
+def build_messages(
+    user_message: str,
+    context: Optional[Dict] = None,
+    conversation_history: List[Dict] = None
+) -> Tuple[List[Dict], Dict]:
+    """
+    Assemble the system prompt, scan context, history and user message for Groq
+    within the input token budget.
+    
+    Returns:
+        (messages, token stats from the prompt builder)
+    """
+    return prompt_builder.build(user_message, context, conversation_history)
+
+def is_cacheable(context: Optional[Dict], conversation_history: Optional[List[Dict]]) -> bool:
+    """Only context-free first turns are cached: their answer is the same for every user."""
+    return CHAT_CACHE_ENABLED and not context and not conversation_history
+
+def log_token_usage(stats: Dict, prompt_tokens: Optional[int], completion_tokens: Optional[int]):
+    """Log one request's input/output token counts (local estimate vs upstream usage)."""
+    print(
+        f"Chat tokens: input {stats['input_tokens']} est "
+        f"(prefix {stats['prefix_tokens']}, summary {stats['summary_tokens']}, "
+        f"history {stats['history_tokens']} in {stats['history_kept']} msgs, "
+        f"{stats['history_dropped']} dropped, user {stats['user_tokens']}"
+        f"{', truncated' if stats['user_truncated'] else ''}), "
+        f"upstream prompt {prompt_tokens if prompt_tokens is not None else '?'}, "
+        f"completion {completion_tokens if completion_tokens is not None else '?'}"
+    )
 
 async def get_chatbot_response(
     user_message: str,
@@ -109,49 +204,164 @@ async def get_chatbot_response(
     if client is None:
         initialize_groq_client()
     
-    if conversation_history is None:
-        conversation_history = []
-    
-    # Build the messages array
-    messages = [
-        {"role": "system", "content": SYSTEM_PROMPT}
-    ]
+    cacheable = is_cacheable(context, conversation_history)
     
-    # Add context if available
-    if context:
-        context_prompt = build_context_prompt(context)
-        messages.append({
-            "role": "system",
-            "content": context_prompt
-        })
-    
-    # Add conversation history
-    messages.extend(format_conversation_history(conversation_history))
-    
-    # Add current user message
-    messages.append({
-        "role": "user",
-        "content": user_message
-    })
+    with stage("chat", "prompt_build"):
+        messages, stats = build_messages(user_message, context, conversation_history)
     
     try:
-        # Call Groq API
-        chat_completion = client.chat.completions.create(
+        if cacheable:
+            # Identical in-flight questions share one upstream call
+            key = make_cache_key(user_message, "")
+            return await response_cache.get_or_compute(key, lambda: request_completion(messages, stats))
+        return await request_completion(messages, stats)
+        
+    except Exception as e:
+        return connection_error_message(e)
+
+async def request_completion(messages: List[Dict], stats: Optional[Dict] = None) -> str:
+    """Call the Groq API once; raises on upstream errors."""
+    with stage("chat", "upstream", model=CHAT_MODEL) as span:
+        chat_completion = await client.complete(
             messages=messages,
-            model="llama-3.3-70b-versatile",  # Fast and accurate model
-            temperature=0.7,  # Balanced creativity and consistency
-            max_tokens=800,  # Reasonable response length
-            top_p=0.9,
-            stream=False
+            model=CHAT_MODEL,
+            temperature=CHAT_TEMPERATURE,
+            max_tokens=CHAT_MAX_TOKENS,
+            top_p=CHAT_TOP_P
         )
+        usage = chat_completion.get("usage") or {}
+        if usage:
+            record_token_usage(usage.get("prompt_tokens"), usage.get("completion_tokens"), span)
+        if stats is not None:
+            log_token_usage(stats, usage.get("prompt_tokens"), usage.get("completion_tokens"))
+    
+    return chat_completion["choices"][0]["message"]["content"]
+
+def record_token_usage(prompt_tokens: Optional[int], completion_tokens: Optional[int], span=None):
+    """Count upstream token usage in /metrics and on the current trace span."""
+    for kind, tokens in (("prompt", prompt_tokens), ("completion", completion_tokens)):
+        if tokens is not None:
+            CHAT_TOKENS.inc(tokens, kind=kind)
+            if span is not None:
+                span.set_attribute(f"llm.usage.{kind}_tokens", tokens)
+
+async def stream_chatbot_response(
+    user_message: str,
+    context: Optional[Dict] = None,
+    conversation_history: List[Dict] = None
+) -> AsyncIterator[Dict]:
+    """
+    Stream a response from the Groq-powered chatbot as it is generated.
+    
+    Yields:
+        {"type": "token", "content": str} for every generated text delta, then
+        {"type": "done", "response": str, "ttft_ms": float, "tokens": int,
+         "tokens_per_sec": float} once the stream completes.
+    
+    Raises:
+        Any upstream error; the caller decides how to surface it
+    """
+    if client is None:
+        initialize_groq_client()
+    
+    start = time.perf_counter()
+    cache_key = None
+    if is_cacheable(context, conversation_history):
+        cache_key = make_cache_key(user_message, "")
+        cached = response_cache.lookup(cache_key)
+        if cached is not None:
+            yield {"type": "token", "content": cached}
+            yield {
+                "type": "done",
+                "response": cached,
+                "cached": True,
+                "ttft_ms": round((time.perf_counter() - start) * 1000, 1),
+                "tokens": 0,
+                "tokens_per_sec": 0.0
+            }
+            return
+    
+    with stage("chat", "prompt_build"):
+        messages, stats = build_messages(user_message, context, conversation_history)
+    
+    upstream_start = time.perf_counter()
+    first_token_at = None
+    prompt_tokens = None
+    chunk_count = 0
+    completion_tokens = None
+    parts = []
+    
+    stream = client.stream(
+        messages=messages,
+        model=CHAT_MODEL,
+        temperature=CHAT_TEMPERATURE,
+        max_tokens=CHAT_MAX_TOKENS,
+        top_p=CHAT_TOP_P
+    )
+    async for chunk in stream:
+        # Groq reports exact usage on the final chunk
+        usage = (chunk.get("x_groq") or {}).get("usage") or chunk.get("usage")
+        if usage and usage.get("completion_tokens") is not None:
+            completion_tokens = usage["completion_tokens"]
+            prompt_tokens = usage.get("prompt_tokens")
         
-        response = chat_completion.choices[0].message.content
-        return response
-        
-    except Exception as e:
-        error_msg = f"I apologize, but I'm having trouble connecting to my AI brain right now. Error: {str(e)}"
-        error_msg += "\n\n⚕️ *If you have medical concerns, please consult a healthcare professional immediately.*"
-        return error_msg
+        if not chunk.get("choices"):
+            continue
+        content = chunk["choices"][0].get("delta", {}).get("content")
+        if not content:
+            continue
+        if first_token_at is None:
+            first_token_at = time.perf_counter()
+        chunk_count += 1
+        parts.append(content)
+        yield {"type": "token", "content": content}
+    
+    end = time.perf_counter()
+    tokens = completion_tokens if completion_tokens is not None else chunk_count
+    record_stage("chat", "upstream_ttft", (first_token_at or end) - upstream_start)
+    record_stage("chat", "upstream", end - upstream_start, model=CHAT_MODEL)
+    record_token_usage(prompt_tokens, tokens)
+    log_token_usage(stats, prompt_tokens, tokens)
+    generation_time = end - (first_token_at or end)
+    response = "".join(parts)
+    if cache_key is not None and response:
+        response_cache.put(cache_key, response)
+    yield {
+        "type": "done",
+        "response": response,
+        "cached": False,
+        "ttft_ms": round(((first_token_at or end) - start) * 1000, 1),
+        "tokens": tokens,
+        "tokens_per_sec": round(tokens / generation_time, 1) if generation_time > 0 else 0.0
+    }
+
+async def precompute_suggested_answers(concurrency: int = 4) -> int:
+    """
+    Warm the response cache with answers to the suggested questions shown
+    before a scan is uploaded (the only cached, context-free ones).
+    
+    Returns:
+        The number of answers now cached
+    """
+    semaphore = asyncio.Semaphore(concurrency)
+    
+    async def answer(question: str):
+        async with semaphore:
+            await get_chatbot_response(question, None, [])
+    
+    await asyncio.gather(*[answer(question) for question in get_suggested_questions(None)])
+    return response_cache.get_stats()["entries"]
+
+def connection_error_message(error: Exception) -> str:
+    """Fallback reply shown when the upstream LLM call fails."""
+    if isinstance(error, CircuitOpenError):
+        error_msg = "I'm temporarily unavailable because my AI service is not responding. Please try again in a little while."
+    elif isinstance(error, DeadlineExceededError):
+        error_msg = "I'm receiving a lot of questions right now and couldn't answer in time. Please try again shortly."
+    else:
+        error_msg = f"I apologize, but I'm having trouble connecting to my AI brain right now. Error: {str(error)}"
+    error_msg += "\n\n⚕️ *If you have medical concerns, please consult a healthcare professional immediately.*"
+    return error_msg
 
 def get_suggested_questions(context: Optional[Dict] = None) -> List[str]:
     """Generate suggested questions based on context."""
@@ -175,12 +175,24 @@ FAQS = [
     }
 ]
 
+def _build_alias_index():
+    """Map every accepted spelling of a tumor type (prediction label, dataset
+    folder name, bare key) to its TUMOR_INFO key."""
+    index = {}
+    for key, info in TUMOR_INFO.items():
+        stems = [key, "no"] if key == "normal" else [key]
+        for stem in stems:
+            for suffix in ("", " tumour", " tumor", "_tumour", "_tumor"):
+                index[stem + suffix] = key
+        index[info["name"].lower()] = key
+    return index
+
+TUMOR_ALIASES = _build_alias_index()
+
 def get_tumor_info(tumor_type: str):
     """Get detailed information about a specific tumor type."""
-    tumor_key = tumor_type.lower().replace(" tumour", "").replace(" tumor", "")
-    if tumor_key == "no":
-        tumor_key = "normal"
-    return TUMOR_INFO.get(tumor_key, None)
+    tumor_key = TUMOR_ALIASES.get(tumor_type.strip().lower())
+    return TUMOR_INFO[tumor_key] if tumor_key else None
 
 def get_all_tumor_info():
     """Get information about all tumor types."""
@@ -0,0 +1,196 @@
+"""
+Export the Keras CNN to ONNX and TFLite, then check parity and throughput.
+
+Usage:
+    python export_model.py --calibration-dir /archive/Testing
+    python export_model.py --formats onnx tflite --skip-benchmark
+
+Writes next to the Keras model:
+    braintumourN.onnx, braintumourN.tflite, braintumourN_float16.tflite,
+    braintumourN_int8.tflite (needs calibration scans), plus a .json sidecar
+    per artifact with the layer counts and parameter count used by /model-info.
+"""
+
+import argparse
+import json
+import os
+import sys
+import time
+from typing import Dict, List
+
+import numpy as np
+
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+from preprocessing import preprocess_file
+from runtimes import load_runtime, metadata_path, default_runtime_path
+from model_summary import keras_layer_table
+from archives import IMAGE_EXTENSIONS
+
+IMAGE_SIZE = 150
+DEFAULT_MODEL_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "models", "braintumourN.h5")
+TFLITE_VARIANTS = ("float32", "float16", "int8")
+
+
+def load_sample_images(directory: str, limit: int) -> np.ndarray:
+    """Load up to `limit` scans (searched recursively) with the API's preprocessing."""
+    images = []
+    for root, _, filenames in sorted(os.walk(directory)):
+        for filename in sorted(filenames):
+            if os.path.splitext(filename)[1].lower() not in IMAGE_EXTENSIONS:
+                continue
+            try:
+                images.append(preprocess_file(os.path.join(root, filename), IMAGE_SIZE))
+            except ValueError:
+                continue
+            if len(images) >= limit:
+                return np.stack(images)
+    if not images:
+        raise ValueError(f"No readable images found under {directory}")
+    return np.stack(images)
+
+
+def write_metadata(artifact_path: str, keras_model, extra: Dict):
+    """Write the sidecar JSON the non-Keras runtimes use for /model-info."""
+    layer_counts = {}
+    for layer in keras_model.layers:
+        l_type = type(layer).__name__
+        layer_counts[l_type] = layer_counts.get(l_type, 0) + 1
+    metadata = {
+        "source": os.path.basename(extra.pop("source")),
+        "layer_counts": layer_counts,
+        "params": int(keras_model.count_params()),
+        "input_shape": [IMAGE_SIZE, IMAGE_SIZE, 3],
+        "layers": keras_layer_table(keras_model),
+        **extra
+    }
+    with open(metadata_path(artifact_path), "w") as f:
+        json.dump(metadata, f, indent=2)
+
+
+def export_onnx(keras_model, output_path: str, opset: int = 13):
+    import tensorflow as tf
+    import tf2onnx
+
+    spec = [tf.TensorSpec((None, IMAGE_SIZE, IMAGE_SIZE, 3), tf.float32, name="input")]
+    tf2onnx.convert.from_keras(keras_model, input_signature=spec, opset=opset, output_path=output_path)
+
+
+def export_tflite(keras_model, output_path: str, variant: str, calibration: np.ndarray = None):
+    import tensorflow as tf
+
+    converter = tf.lite.TFLiteConverter.from_keras_model(keras_model)
+    if variant == "float16":
+        converter.optimizations = [tf.lite.Optimize.DEFAULT]
+        converter.target_spec.supported_types = [tf.float16]
+    elif variant == "int8":
+        def representative_dataset():
+            for image in calibration:
+                yield [image[np.newaxis].astype(np.float32)]
+
+        # Full integer kernels; inputs/outputs stay float32 so callers are unchanged
+        converter.optimizations = [tf.lite.Optimize.DEFAULT]
+        converter.representative_dataset = representative_dataset
+        converter.target_spec.supported_ops = [tf.lite.OpsSet.TFLITE_BUILTINS_INT8]
+
+    with open(output_path, "wb") as f:
+        f.write(converter.convert())
+
+
+def check_parity(reference: np.ndarray, runtime, samples: np.ndarray, batch_size: int = 32) -> Dict:
+    """Compare a runtime's outputs with the Keras reference outputs."""
+    outputs = np.concatenate([
+        runtime.predict_on_batch(samples[i:i + batch_size]) for i in range(0, len(samples), batch_size)
+    ])
+    diff = np.abs(outputs - reference)
+    return {
+        "max_abs_diff": round(float(diff.max()), 6),
+        "mean_abs_diff": round(float(diff.mean()), 6),
+        "top1_agreement": round(float(np.mean(outputs.argmax(axis=1) == reference.argmax(axis=1))), 4),
+    }
+
+
+def measure_throughput(runtime, samples: np.ndarray, batch_sizes: List[int], repeats: int = 5) -> Dict:
+    """Images/sec for each batch size, after one warm-up call."""
+    results = {}
+    for batch_size in batch_sizes:
+        batch = np.resize(samples, (batch_size,) + samples.shape[1:])
+        runtime.predict_on_batch(batch)
+        start = time.perf_counter()
+        for _ in range(repeats):
+            runtime.predict_on_batch(batch)
+        elapsed = time.perf_counter() - start
+        results[str(batch_size)] = round(batch_size * repeats / elapsed, 1)
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Export the brain tumour CNN to ONNX/TFLite.")
+    parser.add_argument("--model", default=DEFAULT_MODEL_PATH, help="Keras .h5 model to export")
+    parser.add_argument("--formats", nargs="+", default=["onnx", "tflite"], choices=["onnx", "tflite"])
+    parser.add_argument("--tflite-variants", nargs="+", default=list(TFLITE_VARIANTS), choices=TFLITE_VARIANTS)
+    parser.add_argument("--calibration-dir", help="Directory of sample scans for int8 calibration and parity checks")
+    parser.add_argument("--calibration-samples", type=int, default=200)
+    parser.add_argument("--opset", type=int, default=13)
+    parser.add_argument("--batch-sizes", nargs="+", type=int, default=[1, 8, 32])
+    parser.add_argument("--skip-benchmark", action="store_true", help="Only run the parity check")
+    parser.add_argument("--report", help="Write the parity/throughput report as JSON to this path")
+    args = parser.parse_args()
+
+    from tensorflow.keras.models import load_model
+    keras_model = load_model(args.model)
+
+    if args.calibration_dir:
+        samples = load_sample_images(args.calibration_dir, args.calibration_samples)
+    else:
+        print("No --calibration-dir given: using random images for parity checks, skipping int8 export")
+        samples = np.random.default_rng(0).integers(0, 256, (32, IMAGE_SIZE, IMAGE_SIZE, 3), dtype=np.uint8)
+
+    artifacts = []
+    if "onnx" in args.formats:
+        path = default_runtime_path("onnx", args.model)
+        export_onnx(keras_model, path, opset=args.opset)
+        write_metadata(path, keras_model, {"source": args.model, "format": "onnx", "opset": args.opset})
+        artifacts.append(("onnx", "onnx", path))
+        print(f"Exported ONNX model to {path}")
+
+    if "tflite" in args.formats:
+        for variant in args.tflite_variants:
+            if variant == "int8" and not args.calibration_dir:
+                continue
+            path = default_runtime_path("tflite", args.model, None if variant == "float32" else variant)
+            export_tflite(keras_model, path, variant, calibration=samples)
+            write_metadata(path, keras_model, {"source": args.model, "format": "tflite", "variant": variant})
+            artifacts.append((f"tflite-{variant}", "tflite", path))
+            print(f"Exported TFLite ({variant}) model to {path}")
+
+    reference_runtime = load_runtime("tensorflow", args.model)
+    reference = np.concatenate([
+        reference_runtime.predict_on_batch(samples[i:i + 32]) for i in range(0, len(samples), 32)
+    ])
+
+    report = {"samples": int(len(samples)), "runtimes": {}}
+    runtimes = [("tensorflow", reference_runtime, args.model)]
+    for name, backend, path in artifacts:
+        runtimes.append((name, load_runtime(backend, path), path))
+
+    for name, runtime, path in runtimes:
+        entry = {"path": path, "size_mb": round(os.path.getsize(path) / 1e6, 2)}
+        entry["parity"] = check_parity(reference, runtime, samples)
+        if not args.skip_benchmark:
+            entry["images_per_sec"] = measure_throughput(runtime, samples, args.batch_sizes)
+        report["runtimes"][name] = entry
+
+    print(f"\n{'runtime':<16}{'size MB':>9}{'max diff':>11}{'top-1':>8}  images/sec by batch size")
+    for name, entry in report["runtimes"].items():
+        parity = entry["parity"]
+        throughput = ", ".join(f"{bs}: {ips}" for bs, ips in entry.get("images_per_sec", {}).items())
+        print(f"{name:<16}{entry['size_mb']:>9}{parity['max_abs_diff']:>11}{parity['top1_agreement']:>8}  {throughput}")
+
+    if args.report:
+        with open(args.report, "w") as f:
+            json.dump(report, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,126 @@
+"""
+Local stand-in for the Groq chat completions API, for development and testing.
+
+Usage:
+    uvicorn fake_groq_server:app --port 8100
+    GROQ_API_KEY=test GROQ_BASE_URL=http://localhost:8100 uvicorn main:app
+
+Replies by echoing the last user message word by word. Behaviour can be tuned
+with environment variables:
+    FAKE_GROQ_TOKEN_DELAY_MS   Delay between streamed tokens (default 20)
+    FAKE_GROQ_LATENCY_MS       Delay before the first token / full response (default 50)
+    FAKE_GROQ_ERROR_RATE       Share of requests failing with 503 (default 0)
+    FAKE_GROQ_RATE_LIMIT_RATE  Share of requests rejected with 429 + Retry-After (default 0)
+
+The same settings can be changed at runtime (e.g. to trip the circuit breaker
+in a test) with POST /fake/config {"error_rate": 1.0}; GET /fake/config also
+reports how many requests were received and failed.
+"""
+
+import asyncio
+import json
+import os
+import random
+import time
+import uuid
+
+from fastapi import FastAPI, Request
+from fastapi.responses import JSONResponse, StreamingResponse
+
+config = {
+    "token_delay_ms": float(os.getenv("FAKE_GROQ_TOKEN_DELAY_MS", "20")),
+    "latency_ms": float(os.getenv("FAKE_GROQ_LATENCY_MS", "50")),
+    "error_rate": float(os.getenv("FAKE_GROQ_ERROR_RATE", "0")),
+    "rate_limit_rate": float(os.getenv("FAKE_GROQ_RATE_LIMIT_RATE", "0")),
+}
+counters = {"requests": 0, "errors": 0, "rate_limited": 0}
+
+app = FastAPI(title="Fake Groq API")
+
+
+@app.get("/fake/config")
+def get_config():
+    return {**config, **counters}
+
+
+@app.post("/fake/config")
+async def set_config(request: Request):
+    updates = await request.json()
+    config.update({key: float(value) for key, value in updates.items() if key in config})
+    counters.update(dict.fromkeys(counters, 0))
+    return config
+
+
+def _reply_tokens(body: dict):
+    user_messages = [m["content"] for m in body.get("messages", []) if m.get("role") == "user"]
+    text = f"You asked: {user_messages[-1] if user_messages else ''}"
+    words = text.split(" ")
+    return [word if i == 0 else " " + word for i, word in enumerate(words)][:body.get("max_tokens") or None]
+
+
+def _usage(body: dict, completion_tokens: int) -> dict:
+    prompt_tokens = sum(len(str(m.get("content", "")).split()) for m in body.get("messages", []))
+    return {
+        "prompt_tokens": prompt_tokens,
+        "completion_tokens": completion_tokens,
+        "total_tokens": prompt_tokens + completion_tokens
+    }
+
+
+@app.post("/openai/v1/chat/completions")
+async def chat_completions(request: Request):
+    body = await request.json()
+    counters["requests"] += 1
+    roll = random.random()
+    if roll < config["rate_limit_rate"]:
+        counters["rate_limited"] += 1
+        return JSONResponse(status_code=429, content={"error": {"message": "Rate limit reached"}}, headers={"Retry-After": "0"})
+    if roll < config["rate_limit_rate"] + config["error_rate"]:
+        counters["errors"] += 1
+        return JSONResponse(status_code=503, content={"error": {"message": "Service unavailable"}})
+
+    tokens = _reply_tokens(body)
+    completion_id = f"chatcmpl-{uuid.uuid4().hex[:12]}"
+    created = int(time.time())
+    model = body.get("model", "fake-model")
+
+    await asyncio.sleep(config["latency_ms"] / 1000)
+
+    if not body.get("stream"):
+        return {
+            "id": completion_id,
+            "object": "chat.completion",
+            "created": created,
+            "model": model,
+            "choices": [{
+                "index": 0,
+                "message": {"role": "assistant", "content": "".join(tokens)},
+                "finish_reason": "stop"
+            }],
+            "usage": _usage(body, len(tokens))
+        }
+
+    async def stream():
+        for i, token in enumerate(tokens):
+            if i:
+                await asyncio.sleep(config["token_delay_ms"] / 1000)
+            chunk = {
+                "id": completion_id,
+                "object": "chat.completion.chunk",
+                "created": created,
+                "model": model,
+                "choices": [{"index": 0, "delta": {"content": token}, "finish_reason": None}]
+            }
+            yield f"data: {json.dumps(chunk)}\n\n"
+        final = {
+            "id": completion_id,
+            "object": "chat.completion.chunk",
+            "created": created,
+            "model": model,
+            "choices": [{"index": 0, "delta": {}, "finish_reason": "stop"}],
+            "x_groq": {"id": completion_id, "usage": _usage(body, len(tokens))}
+        }
+        yield f"data: {json.dumps(final)}\n\n"
+        yield "data: [DONE]\n\n"
+
+    return StreamingResponse(stream(), media_type="text/event-stream")
@@ -0,0 +1,95 @@
+"""
+Grad-CAM saliency maps.
+Runs the Keras model once per batch under a gradient tape, returning both the
+class scores and the last convolutional layer's activations, then weights each
+activation channel by its spatially averaged gradient for the predicted class.
+"""
+
+import base64
+from typing import Dict, Optional, Tuple
+
+import cv2
+import numpy as np
+
+HEATMAP_FORMATS = ("png", "uint8")
+
+
+def find_target_layer(keras_model, layer_name: Optional[str] = None):
+    """The named layer, or the last convolutional layer with a 4D (N, H, W, C) output."""
+    if layer_name:
+        return keras_model.get_layer(layer_name)
+    for layer in reversed(keras_model.layers):
+        if type(layer).__name__.endswith("Conv2D") and len(layer.output.shape) == 4:
+            return layer
+    raise ValueError("Grad-CAM needs a model with a Conv2D layer")
+
+
+class GradCam:
+    """Scores plus class activation maps for a batch in one forward/backward pass."""
+
+    def __init__(self, keras_model, layer_name: Optional[str] = None):
+        import tensorflow as tf
+
+        self.layer = find_target_layer(keras_model, layer_name)
+        self.layer_name = self.layer.name
+        grad_model = tf.keras.Model(keras_model.inputs, [self.layer.output, keras_model.output])
+
+        @tf.function(reduce_retracing=True)
+        def compute(inputs):
+            with tf.GradientTape() as tape:
+                activations, scores = grad_model(inputs, training=False)
+                # Each row only depends on its own image, so the gradient of the
+                # summed predicted-class scores gives every row's gradient at once
+                predicted = tf.one_hot(tf.argmax(scores, axis=1), tf.shape(scores)[1], dtype=scores.dtype)
+                target = tf.reduce_sum(scores * predicted)
+            gradients = tape.gradient(target, activations)
+            weights = tf.reduce_mean(gradients, axis=(1, 2), keepdims=True)
+            cams = tf.nn.relu(tf.reduce_sum(weights * activations, axis=-1))
+            return scores, cams
+
+        self._compute = compute
+        self._tf = tf
+
+    def __call__(self, batch: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        Args:
+            batch: (N, H, W, C) preprocessed images
+
+        Returns:
+            ((N, classes) scores, (N, h, w) float class activation maps at the layer's resolution)
+        """
+        scores, cams = self._compute(self._tf.convert_to_tensor(batch, dtype=self._tf.float32))
+        return np.asarray(scores), np.asarray(cams)
+
+
+def to_heatmaps(cams: np.ndarray, size: int) -> np.ndarray:
+    """Normalize each map to [0, 1], upsample to `size` x `size` and quantize to uint8."""
+    heatmaps = np.empty((len(cams), size, size), dtype=np.uint8)
+    for i, cam in enumerate(cams):
+        cam = cv2.resize(np.asarray(cam, dtype=np.float32), (size, size), interpolation=cv2.INTER_LINEAR)
+        peak = float(cam.max())
+        if peak > 0:
+            cam = cam / peak
+        heatmaps[i] = np.clip(np.round(cam * 255), 0, 255).astype(np.uint8)
+    return heatmaps
+
+
+def encode_heatmap(heatmap: np.ndarray, fmt: str = "png") -> Dict:
+    """
+    Serialize a (size, size) uint8 heatmap for a JSON response: a grayscale PNG
+    or the raw row-major bytes, base64-encoded either way.
+    """
+    if fmt == "png":
+        ok, encoded = cv2.imencode(".png", heatmap, [cv2.IMWRITE_PNG_COMPRESSION, 6])
+        if not ok:
+            raise ValueError("Could not encode the heatmap as PNG")
+        data = encoded.tobytes()
+    elif fmt == "uint8":
+        data = np.ascontiguousarray(heatmap, dtype=np.uint8).tobytes()
+    else:
+        raise ValueError(f"Unknown heatmap format '{fmt}', expected one of {HEATMAP_FORMATS}")
+    return {
+        "format": fmt,
+        "shape": list(heatmap.shape),
+        "data": base64.b64encode(data).decode("ascii"),
+    }
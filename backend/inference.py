@@ -0,0 +1,349 @@
+"""
+Inference execution layer.
+Runs image decoding and model inference off the asyncio event loop on dedicated
+thread or process pools, and bounds the number of pending prediction requests.
+"""
+
+import asyncio
+import functools
+import multiprocessing
+import time
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from typing import Callable, Dict, List, Optional, Tuple, Union
+
+import numpy as np
+
+from batching import MicroBatcher
+from gradcam import to_heatmaps
+from preprocessing import BatchBuffers, decode_image, preprocess_array, preprocess_image
+from runtimes import load_runtime
+
+EXECUTOR_MODES = ("thread", "process")
+
+# Model instance owned by a process-pool worker (loaded once per worker)
+_worker_model = None
+
+
+class QueueFullError(Exception):
+    """Raised when the inference engine has no room for another request."""
+
+
+def _timed_preprocess(contents: bytes, image_size: int):
+    """Preprocess on a worker thread, returning (image, decode seconds, resize seconds)."""
+    start = time.perf_counter()
+    img = decode_image(contents, image_size)
+    decoded = time.perf_counter()
+    image = preprocess_array(img, image_size)
+    return image, decoded - start, time.perf_counter() - decoded
+
+
+def _init_worker(backend: str, model_path: str, num_threads: int):
+    """Process-pool initializer: load the model once in each worker process."""
+    global _worker_model
+    _worker_model = load_runtime(backend, model_path, num_threads=num_threads)
+
+
+def _worker_predict(batch: np.ndarray) -> np.ndarray:
+    """Run a batch through the worker process's model."""
+    return _worker_model.predict_on_batch(batch)
+
+
+def _gradcam_rows(gradcam_fn: Callable, layer_name: Optional[str], image_size: int, batch: np.ndarray) -> List[Tuple]:
+    """Run a Grad-CAM batch and split it into one (scores, uint8 heatmap) pair per image."""
+    scores, cams = gradcam_fn(batch, layer_name)
+    return list(zip(np.asarray(scores), to_heatmaps(cams, image_size)))
+
+
+def _worker_gradcam(layer_name: Optional[str], image_size: int, batch: np.ndarray) -> List[Tuple]:
+    """Run a Grad-CAM batch through the worker process's model."""
+    return _gradcam_rows(_worker_model.gradcam_on_batch, layer_name, image_size, batch)
+
+
+class InferenceEngine:
+    """
+    Executes /predict work away from the event loop.
+
+    Decoding runs on a small thread pool (OpenCV releases the GIL) and batches
+    are assembled in reused, preallocated buffers. Batched
+    model calls run on either a thread pool sharing the already loaded model or
+    a process pool where every worker loads its own copy of the model.
+    """
+
+    def __init__(
+        self,
+        model,
+        model_path: str,
+        image_size: int,
+        backend: str = "tensorflow",
+        model_threads: int = 0,
+        mode: str = "thread",
+        workers: int = 1,
+        preprocess_workers: int = 2,
+        max_pending: int = 64,
+        max_batch_size: int = 32,
+        max_wait_ms: float = 10.0,
+        on_stage: Optional[Callable[[str, float], None]] = None,
+        gradcam_layer: Optional[str] = None
+    ):
+        """
+        Args:
+            model: Loaded model runtime (used directly in thread mode)
+            model_path: Path each worker loads the model from in process mode
+            image_size: Square input size expected by the model
+            backend: Runtime each worker loads in process mode
+            model_threads: Intra-op threads per worker runtime (0 = runtime default)
+            mode: "thread" or "process"
+            workers: Number of model workers (and concurrent batches)
+            preprocess_workers: Number of threads used for decoding/resizing
+            max_pending: Maximum requests admitted at once before rejecting
+            max_batch_size: Maximum images per model call
+            max_wait_ms: Maximum time to wait while filling a batch
+            on_stage: Called with (stage, seconds) for the "decode", "resize" and
+                      "inference" stages of each predict() call
+            gradcam_layer: Layer explain() takes activations from (default: the last Conv2D)
+        """
+        if mode not in EXECUTOR_MODES:
+            raise ValueError(f"Unknown inference executor mode '{mode}', expected one of {EXECUTOR_MODES}")
+
+        self.mode = mode
+        self.workers = max(1, int(workers))
+        self.image_size = image_size
+        self.max_pending = max(1, int(max_pending))
+        self.pending = 0
+        self.rejected = 0
+        self.on_stage = on_stage
+
+        if mode == "process":
+            self.model_pool = ProcessPoolExecutor(
+                max_workers=self.workers,
+                mp_context=multiprocessing.get_context("spawn"),
+                initializer=_init_worker,
+                initargs=(backend, model_path, model_threads)
+            )
+            predict_fn = _worker_predict
+            explain_fn = functools.partial(_worker_gradcam, gradcam_layer, image_size)
+        else:
+            self.model_pool = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix="inference")
+            predict_fn = model.predict_on_batch
+            explain_fn = functools.partial(_gradcam_rows, getattr(model, "gradcam_on_batch", None), gradcam_layer, image_size)
+        self.predict_fn = predict_fn
+
+        self.preprocess_pool = ThreadPoolExecutor(
+            max_workers=max(1, int(preprocess_workers)),
+            thread_name_prefix="preprocess"
+        )
+        # One batch buffer per concurrent batch, plus one for /predict/batch chunks
+        self.max_batch_size = max(1, int(max_batch_size))
+        self.buffers = BatchBuffers(self.max_batch_size, image_size, count=self.workers + 1)
+        self.batcher = MicroBatcher(
+            predict_fn,
+            max_batch_size=max_batch_size,
+            max_wait_ms=max_wait_ms,
+            executor=self.model_pool,
+            max_concurrent_batches=self.workers,
+            buffers=self.buffers
+        )
+        # Grad-CAM requests are batched separately: their model call also
+        # returns activation maps, so they cannot share a batch with plain ones
+        self.supports_gradcam = bool(getattr(model, "supports_gradcam", False))
+        self.explain_batcher = MicroBatcher(
+            explain_fn,
+            max_batch_size=max_batch_size,
+            max_wait_ms=max_wait_ms,
+            executor=self.model_pool,
+            max_concurrent_batches=self.workers
+        ) if self.supports_gradcam else None
+
+    async def predict(self, contents: bytes) -> np.ndarray:
+        """
+        Decode an uploaded image and return its model scores.
+
+        Raises:
+            QueueFullError: If `max_pending` requests are already in progress
+        """
+        if self.pending >= self.max_pending:
+            self.rejected += 1
+            raise QueueFullError(f"{self.pending} prediction requests already pending")
+
+        self.pending += 1
+        try:
+            loop = asyncio.get_running_loop()
+            if self.on_stage is None:
+                image = await loop.run_in_executor(self.preprocess_pool, preprocess_image, contents, self.image_size)
+                return await self.batcher.predict(image)
+
+            image, decode_seconds, resize_seconds = await loop.run_in_executor(
+                self.preprocess_pool, _timed_preprocess, contents, self.image_size
+            )
+            self.on_stage("decode", decode_seconds)
+            self.on_stage("resize", resize_seconds)
+            start = time.perf_counter()
+            scores = await self.batcher.predict(image)
+            # Includes queueing for a batch slot, as the request experiences it
+            self.on_stage("inference", time.perf_counter() - start)
+            return scores
+        finally:
+            self.pending -= 1
+
+    async def predict_views(self, contents: bytes, build_views: Callable[[np.ndarray], np.ndarray]) -> np.ndarray:
+        """
+        Decode an uploaded image once, expand it into several views (e.g. TTA
+        flips/rotations) and run all of them through the model in one call,
+        bypassing the micro-batching queue.
+
+        Args:
+            contents: Raw bytes of the uploaded image
+            build_views: Maps the preprocessed (H, W, C) image to a (V, H, W, C) batch
+
+        Returns:
+            (V, classes) scores, one row per view
+
+        Raises:
+            QueueFullError: If `max_pending` requests are already in progress
+        """
+        if self.pending >= self.max_pending:
+            self.rejected += 1
+            raise QueueFullError(f"{self.pending} prediction requests already pending")
+
+        self.pending += 1
+        try:
+            loop = asyncio.get_running_loop()
+            image, decode_seconds, resize_seconds = await loop.run_in_executor(
+                self.preprocess_pool, _timed_preprocess, contents, self.image_size
+            )
+            batch = build_views(image)
+            start = time.perf_counter()
+            scores = await loop.run_in_executor(self.model_pool, self.predict_fn, batch)
+            if self.on_stage is not None:
+                self.on_stage("decode", decode_seconds)
+                self.on_stage("resize", resize_seconds)
+                self.on_stage("inference", time.perf_counter() - start)
+            return np.asarray(scores)
+        finally:
+            self.pending -= 1
+
+    async def explain(self, contents: bytes) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        Decode an uploaded image and return its scores together with a Grad-CAM
+        heatmap for the predicted class, both from one batched model call.
+
+        Returns:
+            (scores, (image_size, image_size) uint8 heatmap)
+
+        Raises:
+            QueueFullError: If `max_pending` requests are already in progress
+            RuntimeError: If the model runtime cannot compute gradients
+        """
+        if self.explain_batcher is None:
+            raise RuntimeError("Grad-CAM is only available with the tensorflow backend")
+        if self.pending >= self.max_pending:
+            self.rejected += 1
+            raise QueueFullError(f"{self.pending} prediction requests already pending")
+
+        self.pending += 1
+        try:
+            loop = asyncio.get_running_loop()
+            image, decode_seconds, resize_seconds = await loop.run_in_executor(
+                self.preprocess_pool, _timed_preprocess, contents, self.image_size
+            )
+            start = time.perf_counter()
+            scores, heatmap = await self.explain_batcher.predict(image)
+            if self.on_stage is not None:
+                self.on_stage("decode", decode_seconds)
+                self.on_stage("resize", resize_seconds)
+                self.on_stage("inference", time.perf_counter() - start)
+            return scores, heatmap
+        finally:
+            self.pending -= 1
+
+    def warmup(self, batch_sizes: List[int], on_batch: Optional[Callable[[int, float], None]] = None):
+        """
+        Run dummy batches of each size through the model workers (blocking), so
+        the first real requests do not pay graph tracing and allocation costs.
+
+        Args:
+            batch_sizes: Batch sizes to warm up
+            on_batch: Called with (batch_size, seconds) after each size is warm
+        """
+        for batch_size in batch_sizes:
+            dummy = np.zeros((batch_size, self.image_size, self.image_size, 3), dtype=np.uint8)
+            start = time.perf_counter()
+            futures = [self.model_pool.submit(self.predict_fn, dummy) for _ in range(self.workers)]
+            for future in futures:
+                future.result()
+            if on_batch is not None:
+                on_batch(batch_size, time.perf_counter() - start)
+
+    def has_capacity(self) -> bool:
+        """Check whether another request would be admitted right now."""
+        return self.pending < self.max_pending
+
+    async def predict_chunk(self, contents_list: List[bytes]) -> List[Union[np.ndarray, Exception]]:
+        """
+        Decode several uploaded images in parallel and run them through the
+        model as a single batch, bypassing the micro-batching queue.
+
+        Args:
+            contents_list: Raw bytes of each uploaded image
+
+        Returns:
+            One entry per input: its score vector, or the exception that made
+            it fail to decode
+        """
+        loop = asyncio.get_running_loop()
+        count = len(contents_list)
+        self.pending += count
+        pooled = count <= self.max_batch_size
+        if pooled:
+            buffer = self.buffers.acquire()
+        else:
+            buffer = np.empty((count, self.image_size, self.image_size, 3), dtype=np.uint8)
+        try:
+            # Each image is decoded straight into its row of the batch buffer
+            decoded = await asyncio.gather(
+                *[
+                    loop.run_in_executor(self.preprocess_pool, preprocess_image, contents, self.image_size, buffer[i])
+                    for i, contents in enumerate(contents_list)
+                ],
+                return_exceptions=True
+            )
+            valid = [i for i, img in enumerate(decoded) if not isinstance(img, BaseException)]
+            results: List[Union[np.ndarray, Exception]] = list(decoded)
+            if valid:
+                batch = buffer[:count] if len(valid) == count else buffer[valid]
+                scores = await loop.run_in_executor(self.model_pool, self.predict_fn, batch)
+                for i, row in zip(valid, scores):
+                    results[i] = row
+            return results
+        except asyncio.CancelledError:
+            # Executor threads may still be writing into the buffer: never hand it out again
+            pooled = False
+            raise
+        finally:
+            if pooled:
+                self.buffers.release(buffer)
+            self.pending -= count
+
+    async def shutdown(self):
+        """Stop batching and release the worker pools."""
+        await self.batcher.stop()
+        if self.explain_batcher is not None:
+            await self.explain_batcher.stop()
+        self.preprocess_pool.shutdown(wait=False, cancel_futures=True)
+        self.model_pool.shutdown(wait=False, cancel_futures=True)
+
+    def get_stats(self) -> Dict:
+        """Return executor occupancy plus the batcher's statistics."""
+        stats = {
+            "executor": {
+                "mode": self.mode,
+                "workers": self.workers,
+                "max_pending": self.max_pending,
+                "pending": self.pending,
+                "rejected": self.rejected,
+            },
+            "batching": self.batcher.get_stats(),
+        }
+        if self.explain_batcher is not None and self.explain_batcher.total_requests:
+            stats["explain_batching"] = self.explain_batcher.get_stats()
+        return stats
@@ -0,0 +1,370 @@
+"""
+Persistent job queue for asynchronous prediction workloads.
+Jobs live in a SQLite file shared by the API and the worker processes, so no
+external broker is needed. Workers claim the highest priority job under a
+lease; a job whose worker dies is handed out again once the lease expires
+(at-least-once), and failed attempts are retried with backoff.
+"""
+
+import json
+import os
+import re
+import shutil
+import sqlite3
+import threading
+import time
+import uuid
+from contextlib import contextmanager
+from typing import Dict, List, Optional, Tuple
+
+JOB_STATES = ("queued", "running", "succeeded", "failed", "cancelled")
+FINISHED_STATES = ("succeeded", "failed", "cancelled")
+
+_UNSAFE_NAME = re.compile(r"[^A-Za-z0-9._-]+")
+
+
+class JobQueueFullError(Exception):
+    """Raised when the queue already holds the maximum number of unfinished jobs."""
+
+
+def _safe_name(filename: Optional[str]) -> str:
+    return _UNSAFE_NAME.sub("_", os.path.basename(filename or "")) or "upload"
+
+
+class JobQueue:
+    """SQLite-backed priority queue of prediction jobs; inputs are stored as files next to it."""
+
+    def __init__(self, db_path: str, storage_dir: Optional[str] = None, max_attempts: int = 3,
+                 retry_backoff: float = 5.0, max_queued: int = 1000):
+        """
+        Args:
+            db_path: SQLite file holding the jobs
+            storage_dir: Directory for uploaded inputs (default: "<db_path>.files")
+            max_attempts: Attempts per job before it is marked failed
+            retry_backoff: Seconds before the first retry, doubling per attempt
+            max_queued: Unfinished jobs accepted at once (0 = unlimited)
+        """
+        self.db_path = db_path
+        self.storage_dir = storage_dir or db_path + ".files"
+        self.max_attempts = max(1, int(max_attempts))
+        self.retry_backoff = retry_backoff
+        self.max_queued = max_queued
+
+        os.makedirs(os.path.dirname(os.path.abspath(db_path)), exist_ok=True)
+        os.makedirs(self.storage_dir, exist_ok=True)
+        self._lock = threading.Lock()
+        # Autocommit mode; multi-statement updates manage their own transaction
+        self._db = sqlite3.connect(db_path, check_same_thread=False, timeout=30, isolation_level=None)
+        self._db.row_factory = sqlite3.Row
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute(
+            "CREATE TABLE IF NOT EXISTS jobs ("
+            "id TEXT PRIMARY KEY, idempotency_key TEXT UNIQUE, status TEXT NOT NULL, "
+            "priority INTEGER NOT NULL, options TEXT NOT NULL, files TEXT NOT NULL, webhook_url TEXT, "
+            "attempts INTEGER NOT NULL DEFAULT 0, max_attempts INTEGER NOT NULL, "
+            "created_at REAL NOT NULL, available_at REAL NOT NULL, started_at REAL, finished_at REAL, "
+            "lease_expires_at REAL, worker TEXT, cancel_requested INTEGER NOT NULL DEFAULT 0, "
+            "progress_done INTEGER NOT NULL DEFAULT 0, progress_total INTEGER, "
+            "result TEXT, error TEXT, webhook_status TEXT)"
+        )
+        self._db.execute(
+            "CREATE INDEX IF NOT EXISTS jobs_claim ON jobs (status, priority DESC, created_at)"
+        )
+        # The model version /predict serves; workers reload when it changes
+        self._db.execute(
+            "CREATE TABLE IF NOT EXISTS live_model ("
+            "id INTEGER PRIMARY KEY CHECK (id = 0), version TEXT NOT NULL, path TEXT NOT NULL, "
+            "backend TEXT NOT NULL, updated_at REAL NOT NULL)"
+        )
+
+    @contextmanager
+    def _transaction(self):
+        """BEGIN IMMEDIATE ... COMMIT; serializes writers across the API and worker processes."""
+        with self._lock:
+            self._db.execute("BEGIN IMMEDIATE")
+            try:
+                yield
+            except BaseException:
+                self._db.execute("ROLLBACK")
+                raise
+            self._db.execute("COMMIT")
+
+    def submit(
+        self,
+        files: List[Tuple[str, bytes]],
+        options: Optional[Dict] = None,
+        priority: int = 0,
+        webhook_url: Optional[str] = None,
+        idempotency_key: Optional[str] = None
+    ) -> Tuple[Dict, bool]:
+        """
+        Queue a job for uploaded (filename, bytes) files.
+        A repeated idempotency key returns the job it first created instead.
+
+        Returns:
+            (job, whether it was created by this call)
+
+        Raises:
+            JobQueueFullError: If `max_queued` jobs are already waiting or running
+        """
+        if idempotency_key:
+            existing = self._find_by_key(idempotency_key)
+            if existing is not None:
+                return existing, False
+
+        # Inputs are written before the transaction so the write lock is held
+        # only for the INSERT, not while hundreds of MB go to disk
+        job_id = uuid.uuid4().hex
+        job_dir = os.path.join(self.storage_dir, job_id)
+        os.makedirs(job_dir)
+        try:
+            stored = []
+            for index, (filename, contents) in enumerate(files):
+                path = os.path.join(job_dir, f"{index:05d}_{_safe_name(filename)}")
+                with open(path, "wb") as f:
+                    f.write(contents)
+                stored.append({"filename": filename, "path": path})
+
+            with self._transaction():
+                if idempotency_key:
+                    row = self._db.execute(
+                        "SELECT id FROM jobs WHERE idempotency_key = ?", (idempotency_key,)
+                    ).fetchone()
+                    if row is not None:
+                        # Lost a race with a concurrent submit of the same key
+                        shutil.rmtree(job_dir, ignore_errors=True)
+                        return self._get(row["id"]), False
+                unfinished = self._db.execute(
+                    "SELECT COUNT(*) FROM jobs WHERE status IN ('queued', 'running')"
+                ).fetchone()[0]
+                if self.max_queued and unfinished >= self.max_queued:
+                    raise JobQueueFullError(f"{self.max_queued} jobs already queued or running")
+
+                now = time.time()
+                self._db.execute(
+                    "INSERT INTO jobs (id, idempotency_key, status, priority, options, files, webhook_url, "
+                    "max_attempts, created_at, available_at) VALUES (?, ?, 'queued', ?, ?, ?, ?, ?, ?, ?)",
+                    (job_id, idempotency_key, int(priority), json.dumps(options or {}), json.dumps(stored),
+                     webhook_url, self.max_attempts, now, now)
+                )
+                return self._get(job_id), True
+        except BaseException:
+            shutil.rmtree(job_dir, ignore_errors=True)
+            raise
+
+    def _find_by_key(self, idempotency_key: str) -> Optional[Dict]:
+        with self._lock:
+            row = self._db.execute("SELECT id FROM jobs WHERE idempotency_key = ?", (idempotency_key,)).fetchone()
+            return self._get(row["id"]) if row is not None else None
+
+    def claim(self, worker: str, lease_seconds: float) -> Optional[Dict]:
+        """
+        Take the next runnable job (highest priority, then oldest) under a lease.
+        Jobs whose lease ran out are returned to the queue first.
+        """
+        now = time.time()
+        with self._transaction():
+            self._requeue_expired(now)
+            row = self._db.execute(
+                "SELECT id FROM jobs WHERE status = 'queued' AND available_at <= ? "
+                "ORDER BY priority DESC, created_at LIMIT 1", (now,)
+            ).fetchone()
+            if row is None:
+                return None
+            self._db.execute(
+                "UPDATE jobs SET status = 'running', attempts = attempts + 1, worker = ?, "
+                "started_at = ?, lease_expires_at = ?, error = NULL WHERE id = ?",
+                (worker, now, now + lease_seconds, row["id"])
+            )
+            return self._get(row["id"], include_internal=True)
+
+    def _requeue_expired(self, now: float):
+        # The worker holding these died or hung: retry, or give up after max_attempts
+        self._db.execute(
+            "UPDATE jobs SET status = CASE WHEN cancel_requested THEN 'cancelled' "
+            "WHEN attempts >= max_attempts THEN 'failed' ELSE 'queued' END, "
+            "finished_at = CASE WHEN cancel_requested OR attempts >= max_attempts THEN ? ELSE NULL END, "
+            "error = 'Worker lease expired', worker = NULL, lease_expires_at = NULL "
+            "WHERE status = 'running' AND lease_expires_at < ?", (now, now)
+        )
+
+    def heartbeat(self, job_id: str, worker: str, lease_seconds: float, done: int, total: int) -> bool:
+        """
+        Extend a running job's lease and record its progress.
+
+        Returns:
+            False when the worker should stop: the job was cancelled or is no longer its own
+        """
+        with self._lock:
+            cursor = self._db.execute(
+                "UPDATE jobs SET lease_expires_at = ?, progress_done = ?, progress_total = ? "
+                "WHERE id = ? AND status = 'running' AND worker = ? AND cancel_requested = 0",
+                (time.time() + lease_seconds, done, total, job_id, worker)
+            )
+            return cursor.rowcount == 1
+
+    def complete(self, job_id: str, worker: str, result: Dict) -> bool:
+        """Store a job's result; False if the job was cancelled or taken over meanwhile."""
+        with self._lock:
+            cursor = self._db.execute(
+                "UPDATE jobs SET status = 'succeeded', result = ?, finished_at = ?, lease_expires_at = NULL, "
+                "progress_done = progress_total WHERE id = ? AND status = 'running' AND worker = ?",
+                (json.dumps(result), time.time(), job_id, worker)
+            )
+            return cursor.rowcount == 1
+
+    def fail(self, job_id: str, worker: str, error: str) -> str:
+        """
+        Record a failed attempt. The job is queued again after a backoff until
+        it has used `max_attempts`. Returns the job's new status.
+        """
+        now = time.time()
+        with self._transaction():
+            row = self._db.execute(
+                "SELECT attempts, max_attempts, cancel_requested FROM jobs "
+                "WHERE id = ? AND status = 'running' AND worker = ?", (job_id, worker)
+            ).fetchone()
+            if row is None:
+                return self._get(job_id)["status"]
+            if row["cancel_requested"]:
+                status = "cancelled"
+            elif row["attempts"] < row["max_attempts"]:
+                status = "queued"
+            else:
+                status = "failed"
+            delay = self.retry_backoff * (2 ** (row["attempts"] - 1))
+            self._db.execute(
+                "UPDATE jobs SET status = ?, error = ?, worker = NULL, lease_expires_at = NULL, "
+                "available_at = ?, finished_at = ? WHERE id = ?",
+                (status, error, now + delay, None if status == "queued" else now, job_id)
+            )
+            return status
+
+    def release(self, job_id: str, worker: str):
+        """Hand a running job back untouched (worker shutting down); the attempt is not counted."""
+        with self._lock:
+            self._db.execute(
+                "UPDATE jobs SET status = CASE WHEN cancel_requested THEN 'cancelled' ELSE 'queued' END, "
+                "attempts = attempts - 1, worker = NULL, lease_expires_at = NULL, "
+                "finished_at = CASE WHEN cancel_requested THEN ? ELSE NULL END "
+                "WHERE id = ? AND status = 'running' AND worker = ?",
+                (time.time(), job_id, worker)
+            )
+
+    def finish_cancelled(self, job_id: str, worker: str):
+        """Mark a job the worker stopped because of a cancel request."""
+        with self._lock:
+            self._db.execute(
+                "UPDATE jobs SET status = 'cancelled', finished_at = ?, worker = NULL, lease_expires_at = NULL "
+                "WHERE id = ? AND status = 'running' AND worker = ?",
+                (time.time(), job_id, worker)
+            )
+
+    def cancel(self, job_id: str) -> Optional[Dict]:
+        """
+        Cancel a job: queued jobs stop at once, running ones when their worker
+        next checks in. Returns the job (unchanged if already finished), or None.
+        """
+        now = time.time()
+        with self._transaction():
+            cursor = self._db.execute(
+                "UPDATE jobs SET status = 'cancelled', finished_at = ?, cancel_requested = 1 "
+                "WHERE id = ? AND status = 'queued'", (now, job_id)
+            )
+            self._db.execute(
+                "UPDATE jobs SET cancel_requested = 1 WHERE id = ? AND status = 'running'", (job_id,)
+            )
+            job = self._get(job_id)
+        if cursor.rowcount:
+            self.delete_inputs(job_id)
+        return job
+
+    def set_live_model(self, version: Optional[str], path: Optional[str] = None, backend: Optional[str] = None):
+        """Publish the live model version for the workers to follow (None clears it)."""
+        with self._lock:
+            if version is None:
+                self._db.execute("DELETE FROM live_model")
+                return
+            self._db.execute(
+                "INSERT OR REPLACE INTO live_model (id, version, path, backend, updated_at) VALUES (0, ?, ?, ?, ?)",
+                (version, path, backend, time.time())
+            )
+
+    def get_live_model(self) -> Optional[Dict]:
+        with self._lock:
+            row = self._db.execute("SELECT version, path, backend FROM live_model").fetchone()
+        return dict(row) if row is not None else None
+
+    def set_webhook_status(self, job_id: str, status: str):
+        with self._lock:
+            self._db.execute("UPDATE jobs SET webhook_status = ? WHERE id = ?", (status, job_id))
+
+    def get(self, job_id: str, include_result: bool = True) -> Optional[Dict]:
+        with self._lock:
+            return self._get(job_id, include_result=include_result)
+
+    def _get(self, job_id: str, include_result: bool = True, include_internal: bool = False) -> Optional[Dict]:
+        row = self._db.execute("SELECT * FROM jobs WHERE id = ?", (job_id,)).fetchone()
+        if row is None:
+            return None
+        job = {
+            "id": row["id"],
+            "status": "cancelling" if row["status"] == "running" and row["cancel_requested"] else row["status"],
+            "priority": row["priority"],
+            "options": json.loads(row["options"]),
+            "files": len(json.loads(row["files"])),
+            "attempts": row["attempts"],
+            "max_attempts": row["max_attempts"],
+            "created_at": row["created_at"],
+            "started_at": row["started_at"],
+            "finished_at": row["finished_at"],
+            "progress": {"done": row["progress_done"], "total": row["progress_total"]},
+            "error": row["error"],
+            "webhook_url": row["webhook_url"],
+            "webhook_status": row["webhook_status"],
+        }
+        if include_result:
+            job["result"] = json.loads(row["result"]) if row["result"] else None
+        if include_internal:
+            job["input_files"] = json.loads(row["files"])
+        return job
+
+    def purge(self, retention_seconds: float) -> int:
+        """Delete jobs finished more than `retention_seconds` ago, with their inputs."""
+        with self._transaction():
+            rows = self._db.execute(
+                "SELECT id FROM jobs WHERE finished_at IS NOT NULL AND finished_at < ?",
+                (time.time() - retention_seconds,)
+            ).fetchall()
+            for row in rows:
+                self._db.execute("DELETE FROM jobs WHERE id = ?", (row["id"],))
+        for row in rows:
+            self.delete_inputs(row["id"])
+        return len(rows)
+
+    def delete_inputs(self, job_id: str):
+        """Remove a finished job's uploaded files (its result stays in the database)."""
+        shutil.rmtree(os.path.join(self.storage_dir, job_id), ignore_errors=True)
+
+    def get_stats(self) -> Dict:
+        """Job counts by status and the age of the oldest job still waiting."""
+        now = time.time()
+        with self._lock:
+            counts = dict(self._db.execute("SELECT status, COUNT(*) FROM jobs GROUP BY status").fetchall())
+            oldest = self._db.execute(
+                "SELECT MIN(created_at) FROM jobs WHERE status = 'queued'"
+            ).fetchone()[0]
+            by_priority = dict(self._db.execute(
+                "SELECT priority, COUNT(*) FROM jobs WHERE status = 'queued' GROUP BY priority"
+            ).fetchall())
+        return {
+            "counts": {state: counts.get(state, 0) for state in JOB_STATES},
+            "queued_by_priority": {str(priority): count for priority, count in sorted(by_priority.items())},
+            "oldest_queued_age_seconds": round(now - oldest, 3) if oldest is not None else 0.0,
+            "max_queued": self.max_queued,
+        }
+
+    def close(self):
+        with self._lock:
+            self._db.close()
+
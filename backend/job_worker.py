@@ -0,0 +1,365 @@
+"""
+Worker processes for the asynchronous job API.
+Each worker loads its own copy of the model, claims jobs from the shared
+SQLite queue (see job_queue.py), scores the job's images in batches with the
+same preprocessing, TTA and Grad-CAM code as /predict, and posts the finished
+job to its webhook. Between jobs it follows the live model version the API
+publishes in the queue, reloading when a promote or hot reload changes it.
+"""
+
+import multiprocessing
+import os
+import socket
+import threading
+import time
+from typing import Callable, Collection, Dict, List, Optional, Tuple
+from urllib.parse import urlsplit
+
+import numpy as np
+
+from archives import ArchiveError, expand_archive, is_archive
+from gradcam import encode_heatmap, to_heatmaps
+from job_queue import JobQueue
+from prediction_cache import model_fingerprint
+from preprocessing import preprocess_image
+from runtimes import load_runtime
+from tta import aggregate, build_views
+
+try:
+    import httpx
+except ImportError:
+    httpx = None
+
+
+# Longest wait between attempts to load a model, and between restarts of a crashing worker
+MAX_LOAD_BACKOFF = 60.0
+MAX_RESTART_BACKOFF = 300.0
+
+
+class JobInterrupted(Exception):
+    """Raised inside a job when it was cancelled or its worker is shutting down."""
+
+
+def format_prediction(scores, labels: List[str]) -> Dict:
+    """Same fields as a /predict response."""
+    scores = np.asarray(scores)
+    index = int(np.argmax(scores))
+    return {
+        "prediction": labels[index],
+        "index": index,
+        "confidence": round(float(np.max(scores)) * 100, 2),
+        "all_scores": scores.tolist(),
+    }
+
+
+class JobProcessor:
+    """Scores every image of a job with a loaded runtime."""
+
+    def __init__(self, runtime, model_version: str, labels: List[str], image_size: int, batch_size: int = 32,
+                 max_files: int = 512, max_bytes: int = 512 * 1024 * 1024,
+                 gradcam_layer: Optional[str] = None, gradcam_format: str = "png"):
+        self.runtime = runtime
+        self.model_version = model_version
+        self.labels = labels
+        self.image_size = image_size
+        self.batch_size = max(1, int(batch_size))
+        self.max_files = max_files
+        self.max_bytes = max_bytes
+        self.gradcam_layer = gradcam_layer
+        self.gradcam_format = gradcam_format
+
+    def load_items(self, input_files: List[Dict]) -> List[Tuple[str, bytes]]:
+        """Read a job's stored uploads, expanding zip/tar archives into their images."""
+        items = []
+        total_bytes = 0
+        for stored in input_files:
+            with open(stored["path"], "rb") as f:
+                contents = f.read()
+            if is_archive(stored["filename"], contents):
+                items.extend(expand_archive(contents, self.max_files - len(items), self.max_bytes - total_bytes))
+            else:
+                items.append((stored["filename"], contents))
+            total_bytes += len(contents)
+            if len(items) > self.max_files or total_bytes > self.max_bytes:
+                raise ArchiveError(f"Job exceeds {self.max_files} images or {self.max_bytes} bytes")
+        return items
+
+    def _score_chunk(self, images: np.ndarray, views: Optional[List[str]], explain: bool) -> List[Dict]:
+        if views:
+            # All views of all images in one model call
+            batch = np.concatenate([build_views(image, views) for image in images])
+            view_scores = np.asarray(self.runtime.predict_on_batch(batch)).reshape(len(images), len(views), -1)
+            results = []
+            for scores in view_scores:
+                aggregated = aggregate(scores, views)
+                result = format_prediction(aggregated["scores"], self.labels)
+                result["tta"] = aggregated["tta"]
+                results.append(result)
+            return results
+        if explain:
+            scores, cams = self.runtime.gradcam_on_batch(images, self.gradcam_layer)
+            results = []
+            for row, heatmap in zip(np.asarray(scores), to_heatmaps(cams, self.image_size)):
+                result = format_prediction(row, self.labels)
+                result["explanation"] = {
+                    "method": "gradcam",
+                    "class": result["prediction"],
+                    "heatmap": encode_heatmap(heatmap, self.gradcam_format),
+                }
+                results.append(result)
+            return results
+        return [format_prediction(row, self.labels) for row in self.runtime.predict_on_batch(images)]
+
+    def run(self, job: Dict, on_progress: Callable[[int, int], bool]) -> Dict:
+        """
+        Score a claimed job. `on_progress(done, total)` is called after every
+        batch; returning False interrupts the job.
+
+        Raises:
+            JobInterrupted: When on_progress asks to stop
+        """
+        options = job["options"]
+        views = options.get("tta")
+        explain = options.get("explain") == "gradcam"
+        if explain and not getattr(self.runtime, "supports_gradcam", False):
+            # The live model changed since the job was accepted
+            raise ValueError(f"Grad-CAM needs the tensorflow backend, model {self.model_version} does not support it")
+        items = self.load_items(job["input_files"])
+        if not on_progress(0, len(items)):
+            raise JobInterrupted()
+
+        predictions = []
+        errors = 0
+        buffer = np.empty((self.batch_size, self.image_size, self.image_size, 3), dtype=np.uint8)
+        for start in range(0, len(items), self.batch_size):
+            chunk = items[start:start + self.batch_size]
+            valid = []
+            entries = []
+            for filename, contents in chunk:
+                entry = {"filename": filename}
+                try:
+                    preprocess_image(contents, self.image_size, out=buffer[len(valid)])
+                    valid.append(entry)
+                except Exception as e:
+                    entry["error"] = f"Invalid image: {e}"
+                    errors += 1
+                entries.append(entry)
+            if valid:
+                for entry, result in zip(valid, self._score_chunk(buffer[:len(valid)], views, explain)):
+                    entry.update(result)
+            predictions.extend(entries)
+            if not on_progress(len(predictions), len(items)):
+                raise JobInterrupted()
+
+        return {
+            "model_version": self.model_version,
+            "count": len(predictions),
+            "errors": errors,
+            "predictions": predictions,
+        }
+
+
+def webhook_allowed(url: str, hosts: Collection[str]) -> bool:
+    """Only http(s) URLs whose host is on the configured allowlist may be called back."""
+    try:
+        parts = urlsplit(url)
+    except ValueError:
+        return False
+    return parts.scheme in ("http", "https") and (parts.hostname or "").lower() in hosts
+
+
+def deliver_webhook(url: str, payload: Dict, attempts: int = 3, timeout: float = 10.0) -> str:
+    """POST the finished job to its webhook, retrying with backoff. Returns the delivery status."""
+    if httpx is None:
+        return "failed: httpx is not installed"
+    error = None
+    with httpx.Client(timeout=timeout) as client:
+        for attempt in range(attempts):
+            try:
+                response = client.post(url, json=payload)
+                if response.status_code < 300:
+                    return "delivered"
+                error = f"HTTP {response.status_code}"
+                if response.status_code < 500 and response.status_code != 429:
+                    break
+            except httpx.HTTPError as e:
+                error = type(e).__name__
+            if attempt + 1 < attempts:
+                time.sleep(2 ** attempt)
+    return f"failed: {error}"
+
+
+def load_processor(config: Dict, path: str, backend: str, version: Optional[str] = None) -> JobProcessor:
+    """Load and warm a model for the worker; `version` defaults to "<file name>@<fingerprint>"."""
+    runtime = load_runtime(backend, path, num_threads=config.get("model_threads", 0))
+    if version is None:
+        version = f"{os.path.splitext(os.path.basename(path))[0]}@{model_fingerprint(path)}"
+    runtime.predict_on_batch(np.zeros((1, config["image_size"], config["image_size"], 3), dtype=np.uint8))
+    return JobProcessor(
+        runtime,
+        version,
+        config["labels"],
+        config["image_size"],
+        batch_size=config["batch_size"],
+        max_files=config["max_files"],
+        max_bytes=config["max_bytes"],
+        gradcam_layer=config.get("gradcam_layer"),
+        gradcam_format=config.get("gradcam_format", "png")
+    )
+
+
+def worker_main(config: Dict, stop_event, ready=None):
+    """
+    Worker process entry point: load the model, then claim and run jobs until stopped.
+    `ready` (a shared flag) is set while a model is loaded and jobs can be claimed.
+    """
+    queue = JobQueue(config["db_path"], config.get("storage_dir"),
+                     max_attempts=config["max_attempts"], retry_backoff=config["retry_backoff"])
+    worker = f"{socket.gethostname()}:{os.getpid()}"
+    lease = config["lease_seconds"]
+
+    # No model yet (missing file or runtime): retry with backoff, following the
+    # live version the API publishes, instead of exiting into a restart loop
+    processor = None
+    backoff = max(1.0, config["poll_interval"])
+    while processor is None and not stop_event.is_set():
+        live = queue.get_live_model()
+        try:
+            if live is not None:
+                processor = load_processor(config, live["path"], live["backend"], live["version"])
+            else:
+                processor = load_processor(config, config["model_path"], config["backend"])
+        except Exception as e:
+            print(f"Job worker {worker} could not load a model, retrying in {backoff:.0f}s: {e}")
+            stop_event.wait(backoff)
+            backoff = min(backoff * 2, MAX_LOAD_BACKOFF)
+    if processor is None:
+        queue.close()
+        return
+    if ready is not None:
+        ready.value = 1
+
+    last_purge = 0.0
+    failed_version = None
+    print(f"Job worker {worker} ready ({processor.model_version})")
+
+    while not stop_event.is_set():
+        live = queue.get_live_model()
+        if live is not None and live["version"] not in (processor.model_version, failed_version):
+            try:
+                processor = load_processor(config, live["path"], live["backend"], live["version"])
+                print(f"Job worker {worker} switched to {processor.model_version}")
+            except Exception as e:
+                # Keep scoring with the loaded model rather than retrying every poll
+                failed_version = live["version"]
+                print(f"Job worker {worker} could not load {live['version']}: {e}")
+
+        job = queue.claim(worker, lease)
+        if job is None:
+            if time.time() - last_purge > 60:
+                queue.purge(config["retention_seconds"])
+                last_purge = time.time()
+            stop_event.wait(config["poll_interval"])
+            continue
+
+        def on_progress(done: int, total: int) -> bool:
+            return not stop_event.is_set() and queue.heartbeat(job["id"], worker, lease, done, total)
+
+        start = time.perf_counter()
+        try:
+            result = processor.run(job, on_progress)
+        except JobInterrupted:
+            if stop_event.is_set():
+                queue.release(job["id"], worker)
+            else:
+                queue.finish_cancelled(job["id"], worker)
+            status = queue.get(job["id"], include_result=False)["status"]
+        except Exception as e:
+            status = queue.fail(job["id"], worker, f"{type(e).__name__}: {e}")
+        else:
+            status = "succeeded" if queue.complete(job["id"], worker, result) else queue.get(job["id"])["status"]
+        print(f"Job {job['id']}: {status} after {time.perf_counter() - start:.2f}s (attempt {job['attempts']})")
+
+        if status in ("succeeded", "failed", "cancelled"):
+            queue.delete_inputs(job["id"])
+            if job["webhook_url"] and not webhook_allowed(job["webhook_url"], config.get("webhook_hosts", ())):
+                queue.set_webhook_status(job["id"], "failed: host not allowed")
+            elif job["webhook_url"]:
+                finished = queue.get(job["id"])
+                payload = {"job_id": finished["id"], "status": finished["status"],
+                           "result": finished["result"], "error": finished["error"]}
+                queue.set_webhook_status(job["id"], deliver_webhook(job["webhook_url"], payload))
+    queue.close()
+
+
+class JobWorkerPool:
+    """
+    Supervises the worker processes, restarting any that exit unexpectedly
+    with exponential backoff while they keep failing.
+    """
+
+    def __init__(self, config: Dict, workers: int = 1, check_interval: float = 5.0):
+        self.config = config
+        self.workers = max(0, int(workers))
+        self.check_interval = check_interval
+        self._context = multiprocessing.get_context("spawn")
+        self._stop_event = self._context.Event()
+        self._processes: List[multiprocessing.Process] = []
+        # Per slot: model-loaded flag, consecutive failed runs, pending restart time
+        self._ready = [self._context.Value("b", 0, lock=False) for _ in range(self.workers)]
+        self._failures = [0] * self.workers
+        self._restart_at: List[Optional[float]] = [None] * self.workers
+        self._supervisor: Optional[threading.Thread] = None
+        self.restarts = 0
+
+    def _spawn(self, slot: int) -> multiprocessing.Process:
+        self._ready[slot].value = 0
+        process = self._context.Process(
+            target=worker_main, args=(self.config, self._stop_event, self._ready[slot]),
+            name="job-worker", daemon=True
+        )
+        process.start()
+        return process
+
+    def start(self):
+        self._processes = [self._spawn(slot) for slot in range(self.workers)]
+        self._supervisor = threading.Thread(target=self._supervise, name="job-supervisor", daemon=True)
+        self._supervisor.start()
+
+    def _supervise(self):
+        while not self._stop_event.wait(self.check_interval):
+            now = time.monotonic()
+            for slot, process in enumerate(self._processes):
+                if process.is_alive():
+                    if self._ready[slot].value:
+                        self._failures[slot] = 0
+                    continue
+                if self._restart_at[slot] is None:
+                    # A worker that never got a model counts as a failed run
+                    self._failures[slot] = 0 if self._ready[slot].value else self._failures[slot] + 1
+                    delay = min(MAX_RESTART_BACKOFF, self.check_interval * (2 ** self._failures[slot] - 1))
+                    self._restart_at[slot] = now + delay
+                    print(f"Job worker {process.pid} exited with code {process.exitcode}, restarting in {delay:.0f}s")
+                if now >= self._restart_at[slot]:
+                    self._restart_at[slot] = None
+                    self.restarts += 1
+                    self._processes[slot] = self._spawn(slot)
+
+    def alive(self) -> int:
+        return sum(1 for process in self._processes if process.is_alive())
+
+    def ready(self) -> int:
+        """Workers running with a model loaded, i.e. able to claim jobs."""
+        return sum(1 for process, flag in zip(self._processes, self._ready) if process.is_alive() and flag.value)
+
+    def stop(self, timeout: float = 30.0):
+        """Ask workers to finish their current batch and hand their jobs back, then wait for them."""
+        self._stop_event.set()
+        deadline = time.monotonic() + timeout
+        for process in self._processes:
+            process.join(max(0.0, deadline - time.monotonic()))
+            if process.is_alive():
+                process.terminate()
+
+    def get_stats(self) -> Dict:
+        return {"workers": self.workers, "alive": self.alive(), "ready": self.ready(), "restarts": self.restarts}
@@ -0,0 +1,432 @@
+"""
+Async upstream client for the Groq (OpenAI-compatible) chat completions API.
+One pooled HTTP client per process, with a concurrency limit, a tokens-per-
+minute token bucket, exponential backoff with jitter on 429/5xx, per-request
+deadlines and a circuit breaker that fails fast while the upstream is down.
+"""
+
+import asyncio
+import contextvars
+import json
+import random
+import time
+from contextlib import contextmanager
+from typing import AsyncIterator, Callable, Dict, List, Optional
+
+import httpx
+
+from telemetry import REGISTRY as METRICS
+
+DEFAULT_BASE_URL = "https://api.groq.com"
+COMPLETIONS_PATH = "/openai/v1/chat/completions"
+RETRYABLE_STATUS = {429, 500, 502, 503, 504}
+
+UPSTREAM_CALLS = METRICS.counter(
+    "llm_upstream_calls_total", "Upstream LLM attempts by outcome", ("outcome",))
+
+# Absolute time.monotonic() deadline of the request being served, if any
+_deadline: contextvars.ContextVar[Optional[float]] = contextvars.ContextVar("llm_deadline", default=None)
+
+
+class UpstreamError(Exception):
+    """Raised when the upstream LLM call fails for good."""
+
+
+class UpstreamHTTPError(UpstreamError):
+    def __init__(self, status_code: int, detail: str):
+        super().__init__(f"Upstream returned {status_code}: {detail}")
+        self.status_code = status_code
+
+
+class CircuitOpenError(UpstreamError):
+    """Raised without calling upstream while the circuit breaker is open."""
+
+
+class DeadlineExceededError(UpstreamError):
+    """Raised when the request's deadline leaves no time for (another) attempt."""
+
+
+@contextmanager
+def deadline_scope(seconds: Optional[float]):
+    """Bound every upstream call made inside the block by `seconds` from now (nested scopes keep the earliest)."""
+    if seconds is None or seconds <= 0:
+        yield
+        return
+    deadline = time.monotonic() + seconds
+    current = _deadline.get()
+    token = _deadline.set(deadline if current is None else min(current, deadline))
+    try:
+        yield
+    finally:
+        _deadline.reset(token)
+
+
+def remaining_time() -> Optional[float]:
+    deadline = _deadline.get()
+    return None if deadline is None else deadline - time.monotonic()
+
+
+class TokenBucket:
+    """
+    Tokens-per-minute limiter. Calls reserve an estimate up front and settle
+    with the real usage afterwards, so the bucket tracks what upstream bills.
+    """
+
+    def __init__(self, tokens_per_minute: int):
+        self.capacity = float(tokens_per_minute)
+        self.rate = self.capacity / 60.0
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+        self.waits = 0
+        # Waiters queue here so each one debits before the next re-checks the balance
+        self._lock = asyncio.Lock()
+
+    def _refill(self):
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    async def acquire(self, tokens: int):
+        """
+        Wait until `tokens` are available (requests larger than the bucket wait for a full bucket).
+
+        Raises:
+            DeadlineExceededError: If the wait would outlast the request's deadline
+        """
+        needed = min(float(tokens), self.capacity)
+        remaining = remaining_time()
+        if remaining is not None and remaining <= 0:
+            raise DeadlineExceededError("Rate limit: request deadline already passed")
+        try:
+            await asyncio.wait_for(self._lock.acquire(), remaining)
+        except asyncio.TimeoutError:
+            raise DeadlineExceededError("Rate limit: queued past the request deadline") from None
+        try:
+            self._refill()
+            # Loop: settle() may have charged a shortfall while we slept
+            while self.tokens < needed:
+                wait = (needed - self.tokens) / self.rate
+                remaining = remaining_time()
+                if remaining is not None and wait > remaining:
+                    raise DeadlineExceededError(f"Rate limit: {wait:.1f}s wait exceeds the request deadline")
+                self.waits += 1
+                await asyncio.sleep(wait)
+                self._refill()
+            self.tokens -= tokens
+        finally:
+            self._lock.release()
+
+    def settle(self, reserved: int, used: int):
+        """Return over-reserved tokens (or charge the shortfall)."""
+        self.tokens = min(self.capacity, self.tokens + reserved - used)
+
+
+class CircuitBreaker:
+    """
+    Opens after `failure_threshold` consecutive failures and rejects calls for
+    `reset_timeout` seconds, then lets one trial call through (half-open).
+    A trial that never reports back is replaced after another `reset_timeout`.
+    """
+
+    def __init__(self, failure_threshold: int = 5, reset_timeout: float = 30.0):
+        self.failure_threshold = max(1, int(failure_threshold))
+        self.reset_timeout = float(reset_timeout)
+        self.state = "closed"
+        self.failures = 0
+        self.opened_at = 0.0
+        self.trial_started = 0.0
+        self.trips = 0
+        self.rejected = 0
+
+    def before_call(self):
+        now = time.monotonic()
+        if self.state == "open":
+            if now - self.opened_at < self.reset_timeout:
+                self.rejected += 1
+                raise CircuitOpenError("Upstream LLM is unavailable (circuit open), failing fast")
+            self.state = "half_open"
+            self.trial_started = now
+        elif self.state == "half_open":
+            # Only the trial call goes through until it succeeds or fails
+            if now - self.trial_started < self.reset_timeout:
+                self.rejected += 1
+                raise CircuitOpenError("Upstream LLM is recovering (circuit half-open), failing fast")
+            self.trial_started = now
+
+    def record_success(self):
+        self.state = "closed"
+        self.failures = 0
+
+    def record_failure(self):
+        self.failures += 1
+        if self.state == "half_open" or self.failures >= self.failure_threshold:
+            if self.state != "open":
+                self.trips += 1
+            self.state = "open"
+            self.opened_at = time.monotonic()
+
+
+def estimate_tokens(messages: List[Dict], max_tokens: int, count_tokens: Optional[Callable[[str], int]] = None) -> int:
+    """
+    Upper bound of a request's token usage: prompt tokens (counted with
+    `count_tokens` if given, else about 4 characters per token) plus max_tokens.
+    """
+    texts = [str(message.get("content", "")) for message in messages]
+    if count_tokens is None:
+        prompt_tokens = sum(len(text) for text in texts) // 4
+    else:
+        prompt_tokens = sum(count_tokens(text) for text in texts)
+    return prompt_tokens + len(messages) * 4 + int(max_tokens or 0)
+
+
+class UpstreamClient:
+    """Pooled, rate-limited and retrying client for chat completions."""
+
+    def __init__(
+        self,
+        api_key: str,
+        base_url: Optional[str] = None,
+        max_connections: int = 20,
+        max_concurrency: int = 8,
+        tokens_per_minute: int = 0,
+        max_retries: int = 3,
+        backoff_base: float = 0.25,
+        backoff_max: float = 8.0,
+        timeout: float = 30.0,
+        breaker_failures: int = 5,
+        breaker_reset: float = 30.0,
+        count_tokens: Optional[Callable[[str], int]] = None
+    ):
+        """
+        Args:
+            api_key: Bearer token for the upstream API
+            base_url: API root (default: Groq); point at fake_groq_server.py for tests
+            max_connections: HTTP connection pool size (kept alive between calls)
+            max_concurrency: Upstream calls in flight at once; others wait
+            tokens_per_minute: Token bucket size per minute (0 disables)
+            max_retries: Retries on 429/5xx, timeouts and connection errors
+            backoff_base / backoff_max: Exponential backoff bounds in seconds (full jitter)
+            timeout: Per-attempt timeout in seconds (shortened by the request deadline)
+            breaker_failures / breaker_reset: Circuit breaker threshold and open time
+            count_tokens: Local tokenizer for rate-limit reservations (default: ~4 chars/token)
+        """
+        self.base_url = (base_url or DEFAULT_BASE_URL).rstrip("/")
+        self.max_concurrency = max(1, int(max_concurrency))
+        self.max_retries = max(0, int(max_retries))
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        self.timeout = timeout
+        self.bucket = TokenBucket(tokens_per_minute) if tokens_per_minute > 0 else None
+        self.breaker = CircuitBreaker(breaker_failures, breaker_reset)
+        self.count_tokens = count_tokens
+        self.http = httpx.AsyncClient(
+            base_url=self.base_url,
+            headers={"Authorization": f"Bearer {api_key}"},
+            limits=httpx.Limits(max_connections=max_connections, max_keepalive_connections=max_connections),
+            timeout=timeout
+        )
+        self._semaphore: Optional[asyncio.Semaphore] = None
+        self.in_flight = 0
+        self.waiting = 0
+        self.retries = 0
+
+    def _attempt_timeout(self) -> float:
+        remaining = remaining_time()
+        if remaining is None:
+            return self.timeout
+        if remaining <= 0:
+            raise DeadlineExceededError("Request deadline exceeded before calling upstream")
+        return min(self.timeout, remaining)
+
+    async def _backoff(self, attempt: int, retry_after: Optional[str]):
+        delay = random.uniform(0, min(self.backoff_max, self.backoff_base * (2 ** attempt)))
+        try:
+            delay = max(delay, float(retry_after)) if retry_after else delay
+        except ValueError:
+            pass
+        remaining = remaining_time()
+        if remaining is not None and delay >= remaining:
+            raise DeadlineExceededError("Request deadline leaves no time to retry upstream")
+        self.retries += 1
+        UPSTREAM_CALLS.inc(outcome="retry")
+        await asyncio.sleep(delay)
+
+    async def _acquire_slot(self):
+        if self._semaphore is None:
+            self._semaphore = asyncio.Semaphore(self.max_concurrency)
+        self.waiting += 1
+        try:
+            remaining = remaining_time()
+            if remaining is None:
+                await self._semaphore.acquire()
+            else:
+                try:
+                    await asyncio.wait_for(self._semaphore.acquire(), max(remaining, 0))
+                except asyncio.TimeoutError:
+                    raise DeadlineExceededError("Request deadline exceeded waiting for an upstream slot")
+        finally:
+            self.waiting -= 1
+        self.in_flight += 1
+
+    def _release_slot(self):
+        self.in_flight -= 1
+        self._semaphore.release()
+
+    async def _admit(self, payload: Dict) -> int:
+        """Breaker check and rate limiting; returns the reserved token estimate."""
+        try:
+            self.breaker.before_call()
+        except CircuitOpenError:
+            UPSTREAM_CALLS.inc(outcome="circuit_open")
+            raise
+        reserved = estimate_tokens(payload["messages"], payload.get("max_tokens", 0), self.count_tokens)
+        if self.bucket is not None:
+            await self.bucket.acquire(reserved)
+        return reserved
+
+    def _settle(self, reserved: int, usage: Optional[Dict]):
+        if self.bucket is not None and usage and usage.get("total_tokens") is not None:
+            self.bucket.settle(reserved, int(usage["total_tokens"]))
+
+    def _failed(self, error: Exception, outcome: str = "error"):
+        UPSTREAM_CALLS.inc(outcome=outcome)
+        if not isinstance(error, DeadlineExceededError):
+            self.breaker.record_failure()
+
+    def _http_failed(self, error: UpstreamHTTPError):
+        if error.status_code in RETRYABLE_STATUS:
+            self._failed(error)
+        else:
+            # Client errors (bad request, auth) mean upstream is reachable
+            UPSTREAM_CALLS.inc(outcome="error")
+            self.breaker.record_success()
+
+    async def complete(self, **payload) -> Dict:
+        """
+        POST a non-streaming chat completion and return the decoded JSON body.
+
+        Raises:
+            UpstreamError: After retries are exhausted, on the deadline, or while the circuit is open
+        """
+        reserved = await self._admit(payload)
+        await self._acquire_slot()
+        try:
+            attempt = 0
+            while True:
+                try:
+                    response = await self.http.post(COMPLETIONS_PATH, json=payload, timeout=self._attempt_timeout())
+                except (httpx.TimeoutException, httpx.TransportError) as e:
+                    if attempt >= self.max_retries:
+                        raise UpstreamError(f"Upstream request failed: {e!r}")
+                    await self._backoff(attempt, None)
+                    attempt += 1
+                    continue
+
+                if response.status_code in RETRYABLE_STATUS and attempt < self.max_retries:
+                    await self._backoff(attempt, response.headers.get("retry-after"))
+                    attempt += 1
+                    continue
+                if response.status_code >= 400:
+                    raise UpstreamHTTPError(response.status_code, response.text[:200])
+
+                body = response.json()
+                self.breaker.record_success()
+                UPSTREAM_CALLS.inc(outcome="ok")
+                self._settle(reserved, body.get("usage"))
+                return body
+        except UpstreamHTTPError as e:
+            self._http_failed(e)
+            raise
+        except UpstreamError as e:
+            self._failed(e, "deadline" if isinstance(e, DeadlineExceededError) else "error")
+            raise
+        finally:
+            self._release_slot()
+
+    async def stream(self, **payload) -> AsyncIterator[Dict]:
+        """
+        Stream a chat completion, yielding each decoded SSE chunk. Failures
+        before the first chunk are retried; once tokens were yielded they are not.
+
+        Raises:
+            UpstreamError: As for complete(), or when the deadline passes mid-stream
+        """
+        payload["stream"] = True
+        reserved = await self._admit(payload)
+        await self._acquire_slot()
+        usage = None
+        try:
+            attempt = 0
+            while True:
+                request = self.http.build_request("POST", COMPLETIONS_PATH, json=payload, timeout=self._attempt_timeout())
+                try:
+                    response = await self.http.send(request, stream=True)
+                except (httpx.TimeoutException, httpx.TransportError) as e:
+                    if attempt >= self.max_retries:
+                        raise UpstreamError(f"Upstream request failed: {e!r}")
+                    await self._backoff(attempt, None)
+                    attempt += 1
+                    continue
+
+                if response.status_code >= 400:
+                    detail = (await response.aread()).decode("utf-8", "replace")[:200]
+                    await response.aclose()
+                    if response.status_code in RETRYABLE_STATUS and attempt < self.max_retries:
+                        await self._backoff(attempt, response.headers.get("retry-after"))
+                        attempt += 1
+                        continue
+                    raise UpstreamHTTPError(response.status_code, detail)
+                break
+
+            try:
+                async for line in response.aiter_lines():
+                    remaining = remaining_time()
+                    if remaining is not None and remaining <= 0:
+                        raise DeadlineExceededError("Request deadline exceeded mid-stream")
+                    if not line.startswith("data:"):
+                        continue
+                    data = line[5:].strip()
+                    if data == "[DONE]":
+                        break
+                    chunk = json.loads(data)
+                    usage = (chunk.get("x_groq") or {}).get("usage") or chunk.get("usage") or usage
+                    yield chunk
+            except (httpx.TimeoutException, httpx.TransportError) as e:
+                raise UpstreamError(f"Upstream stream interrupted: {e!r}")
+            finally:
+                await response.aclose()
+
+            self.breaker.record_success()
+            UPSTREAM_CALLS.inc(outcome="ok")
+            self._settle(reserved, usage)
+        except UpstreamHTTPError as e:
+            self._http_failed(e)
+            raise
+        except UpstreamError as e:
+            self._failed(e, "deadline" if isinstance(e, DeadlineExceededError) else "error")
+            raise
+        finally:
+            self._release_slot()
+
+    async def close(self):
+        await self.http.aclose()
+
+    def get_stats(self) -> Dict:
+        return {
+            "base_url": self.base_url,
+            "in_flight": self.in_flight,
+            "waiting": self.waiting,
+            "max_concurrency": self.max_concurrency,
+            "retries": self.retries,
+            "circuit": {
+                "state": self.breaker.state,
+                "consecutive_failures": self.breaker.failures,
+                "trips": self.breaker.trips,
+                "rejected": self.breaker.rejected,
+            },
+            "rate_limit": {
+                "tokens_per_minute": int(self.bucket.capacity),
+                "available_tokens": int(self.bucket.tokens),
+                "waits": self.bucket.waits,
+            } if self.bucket is not None else None,
+        }
@@ -1,12 +1,16 @@
 import os
 import sys
-import pickle
 import numpy as np
-import cv2
 import uuid
-from fastapi import FastAPI, UploadFile, File, HTTPException
+import json
+import asyncio
+import hmac
+import threading
+from fastapi import FastAPI, UploadFile, File, HTTPException, Request, Query
 from fastapi.middleware.cors import CORSMiddleware
-from tensorflow.keras.models import load_model
+from fastapi.responses import JSONResponse, StreamingResponse, Response
+from starlette.background import BackgroundTask
+from starlette.concurrency import run_in_threadpool
 from pydantic import BaseModel
 from typing import List, Dict, Optional
 from dotenv import load_dotenv
@@ -15,8 +19,29 @@ from dotenv import load_dotenv
 sys.path.append(os.path.dirname(os.path.abspath(__file__)))
 
 # Import chatbot and educational modules
-from chatbot import get_chatbot_response, get_suggested_questions, initialize_groq_client
-from educational_data import get_tumor_info, get_all_tumor_info, get_faqs
+from chatbot import (
+    get_chatbot_response, stream_chatbot_response, get_suggested_questions,
+    initialize_groq_client, close_groq_client, connection_error_message, precompute_suggested_answers,
+    response_cache as chat_response_cache
+)
+import chatbot
+from llm_client import deadline_scope
+from educational_data import get_all_tumor_info, get_faqs, TUMOR_ALIASES
+from inference import InferenceEngine, QueueFullError
+from archives import ArchiveError, is_archive, expand_archive
+from prediction_cache import PredictionCache
+from runtimes import default_runtime_path
+from model_registry import ModelRegistry, ModelFileWatcher, ROUTING_MODES
+from preprocessing import ImageTooLargeError, MAX_UPLOAD_BYTES
+from readiness import ModelStatus
+from session_store import create_session_store
+from training_history import HistoryStore
+from static_payloads import StaticPayload
+from tta import parse_tta, build_views, aggregate
+from gradcam import HEATMAP_FORMATS, encode_heatmap
+from job_queue import JobQueue, JobQueueFullError, FINISHED_STATES
+from job_worker import JobWorkerPool, webhook_allowed
+from telemetry import REGISTRY, InstrumentationMiddleware, record_stage, stage
 
 # Load environment variables
 load_dotenv()
@@ -32,18 +57,170 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+# Request counts/latency per route and trace spans (see telemetry.py, /metrics)
+app.add_middleware(InstrumentationMiddleware)
+
 # Constants
 MODEL_PATH = os.path.join(os.path.dirname(__file__), "models", "braintumourN.h5")
-HISTORY_PATH = os.path.join(os.path.dirname(__file__), "data", "training_history.pkl")
+HISTORY_PATH = os.path.join(os.path.dirname(__file__), "data", "training_history.json")
 IMAGE_SIZE = 150
 LABELS = ['Glioma Tumour', 'Meningioma Tumour', 'No Tumour', 'Pituitary Tumour']
 
-# Global model variable
-model = None
+# Model runtime: "tensorflow" (Keras .h5), "onnx" or "tflite" (see export_model.py).
+# MODEL_VARIANT picks a quantized TFLite export, e.g. "float16" or "int8".
+MODEL_BACKEND = os.getenv("MODEL_BACKEND", "tensorflow")
+MODEL_VARIANT = os.getenv("MODEL_VARIANT") or None
+MODEL_RUNTIME_PATH = os.getenv("MODEL_RUNTIME_PATH") or default_runtime_path(MODEL_BACKEND, MODEL_PATH, MODEL_VARIANT)
+MODEL_THREADS = int(os.getenv("MODEL_THREADS", "0"))
+
+# Micro-batching configuration for /predict
+BATCH_MAX_SIZE = int(os.getenv("BATCH_MAX_SIZE", "32"))
+BATCH_MAX_WAIT_MS = float(os.getenv("BATCH_MAX_WAIT_MS", "10"))
+
+# Inference executor configuration ("thread" shares the loaded model,
+# "process" loads one copy of the model per worker process)
+INFERENCE_EXECUTOR = os.getenv("INFERENCE_EXECUTOR", "thread")
+INFERENCE_WORKERS = int(os.getenv("INFERENCE_WORKERS", "1"))
+PREPROCESS_WORKERS = int(os.getenv("PREPROCESS_WORKERS", "2"))
+INFERENCE_MAX_PENDING = int(os.getenv("INFERENCE_MAX_PENDING", "64"))
+INFERENCE_RETRY_AFTER = int(os.getenv("INFERENCE_RETRY_AFTER", "1"))
+
+# Prediction result cache (PREDICTION_CACHE_DB enables the persistent tier)
+PREDICTION_CACHE_SIZE = int(os.getenv("PREDICTION_CACHE_SIZE", "1024"))
+PREDICTION_CACHE_TTL = float(os.getenv("PREDICTION_CACHE_TTL", "3600"))
+PREDICTION_CACHE_DB = os.getenv("PREDICTION_CACHE_DB") or None
+
+# Startup: "background" serves lightweight endpoints immediately while the
+# model loads and warms up; "blocking" loads it before accepting requests
+MODEL_LOAD_MODE = os.getenv("MODEL_LOAD_MODE", "background")
+WARMUP_BATCH_SIZES = sorted({
+    int(size) for size in os.getenv("WARMUP_BATCH_SIZES", f"1,8,{BATCH_MAX_SIZE}").split(",") if size.strip()
+})
+MODEL_LOADING_RETRY_AFTER = int(os.getenv("MODEL_LOADING_RETRY_AFTER", "5"))
+
+# Limits for /predict/batch uploads
+BATCH_UPLOAD_MAX_FILES = int(os.getenv("BATCH_UPLOAD_MAX_FILES", "512"))
+BATCH_UPLOAD_MAX_BYTES = int(os.getenv("BATCH_UPLOAD_MAX_BYTES", str(512 * 1024 * 1024)))
+
+# Model versions: a candidate can get a share of /predict traffic, either
+# answering it ("ab") or running in the background for comparison ("shadow")
+MODEL_CANDIDATE_PATH = os.getenv("MODEL_CANDIDATE_PATH") or None
+MODEL_CANDIDATE_BACKEND = os.getenv("MODEL_CANDIDATE_BACKEND", MODEL_BACKEND)
+MODEL_CANDIDATE_MODE = os.getenv("MODEL_CANDIDATE_MODE", "shadow")
+MODEL_CANDIDATE_SHARE = float(os.getenv("MODEL_CANDIDATE_SHARE", "0.1"))
+
+# Poll the model file every N seconds and hot-swap to a replaced file (0 disables)
+MODEL_WATCH_INTERVAL = float(os.getenv("MODEL_WATCH_INTERVAL", "0"))
+
+# Batch size /model-info reports compute and activation memory for
+MODEL_INFO_BATCH_SIZE = int(os.getenv("MODEL_INFO_BATCH_SIZE", str(BATCH_MAX_SIZE)))
+
+# Grad-CAM for /predict?explain=gradcam: layer to explain (default: the last
+# Conv2D) and heatmap encoding ("png" or raw "uint8", both base64 in the JSON)
+GRADCAM_LAYER = os.getenv("GRADCAM_LAYER") or None
+GRADCAM_FORMAT = os.getenv("GRADCAM_FORMAT", "png")
+if GRADCAM_FORMAT not in HEATMAP_FORMATS:
+    raise ValueError(f"Unknown GRADCAM_FORMAT '{GRADCAM_FORMAT}', expected one of {HEATMAP_FORMATS}")
+
+# Asynchronous /jobs: worker processes (each loads its own copy of the model,
+# so the job API is opt-in; 0 disables it), SQLite queue file, lease after which a silent
+# worker's job is handed out again, attempts per job, first retry delay in
+# seconds (doubling), unfinished jobs accepted and how long finished jobs are kept
+JOB_WORKERS = int(os.getenv("JOB_WORKERS", "0"))
+JOB_DB = os.getenv("JOB_DB", os.path.join(os.path.dirname(__file__), "data", "jobs.db"))
+JOB_LEASE_SECONDS = float(os.getenv("JOB_LEASE_SECONDS", "60"))
+JOB_MAX_ATTEMPTS = int(os.getenv("JOB_MAX_ATTEMPTS", "3"))
+JOB_RETRY_BACKOFF = float(os.getenv("JOB_RETRY_BACKOFF", "5"))
+JOB_MAX_QUEUED = int(os.getenv("JOB_MAX_QUEUED", "1000"))
+JOB_RETENTION = float(os.getenv("JOB_RETENTION", "86400"))
+JOB_POLL_INTERVAL = float(os.getenv("JOB_POLL_INTERVAL", "0.5"))
+# Hosts job webhooks may call (comma-separated); unset disables webhooks, so
+# clients cannot make the server send requests to internal addresses
+JOB_WEBHOOK_HOSTS = frozenset(
+    host.strip().lower() for host in os.getenv("JOB_WEBHOOK_HOSTS", "").split(",") if host.strip()
+)
+
+# Token for the /models admin endpoints (X-Admin-Token header); unset disables them
+MODEL_ADMIN_TOKEN = os.getenv("MODEL_ADMIN_TOKEN") or None
+
+# Caches scores by hash of the uploaded bytes and model version
+prediction_cache = None
+
+def create_engine(runtime, path: str, backend: str) -> InferenceEngine:
+    """Build the engine that runs decoding and batched inference off the event loop."""
+    return InferenceEngine(
+        runtime,
+        path,
+        IMAGE_SIZE,
+        backend=backend,
+        model_threads=MODEL_THREADS,
+        mode=INFERENCE_EXECUTOR,
+        workers=INFERENCE_WORKERS,
+        preprocess_workers=PREPROCESS_WORKERS,
+        max_pending=INFERENCE_MAX_PENDING,
+        max_batch_size=BATCH_MAX_SIZE,
+        max_wait_ms=BATCH_MAX_WAIT_MS,
+        on_stage=lambda name, seconds: record_stage("predict", name, seconds),
+        gradcam_layer=GRADCAM_LAYER
+    )
+
+def on_model_promoted(version):
+    # Cached results belong to the previous live model
+    if prediction_cache is not None and prediction_cache.model_version != version.id:
+        prediction_cache.invalidate(version.id)
+    # Job workers reload between jobs to score with the same version as /predict
+    if job_queue is not None:
+        job_queue.set_live_model(version.id, version.path, version.backend)
+
+# Loaded model versions and the routing between them
+model_registry = ModelRegistry(
+    create_engine,
+    LABELS,
+    WARMUP_BATCH_SIZES,
+    model_threads=MODEL_THREADS,
+    on_promote=on_model_promoted
+)
+model_watcher = None
+
+# Job queue shared with the job worker processes
+job_queue = JobQueue(
+    JOB_DB,
+    max_attempts=JOB_MAX_ATTEMPTS,
+    retry_backoff=JOB_RETRY_BACKOFF,
+    max_queued=JOB_MAX_QUEUED
+) if JOB_WORKERS > 0 else None
+job_workers = None
 
-# Session storage for conversation history (in-memory for MVP)
-# In production, use Redis or a database
-conversation_sessions = {}
+# Load/warm-up progress reported by /ready
+model_status = ModelStatus()
+
+# Training history for /stats, re-read only when the file changes
+history_store = HistoryStore(HISTORY_PATH)
+
+# Precompute chatbot answers for all suggested questions at startup
+CHAT_CACHE_PRECOMPUTE = os.getenv("CHAT_CACHE_PRECOMPUTE", "0") == "1"
+
+# Upper bound for one chat answer, including upstream retries and rate limit waits
+CHAT_REQUEST_TIMEOUT = float(os.getenv("CHAT_REQUEST_TIMEOUT", "60"))
+
+# Session storage for conversation history: "memory" (per process, LRU + idle
+# expiry), or "sqlite"/"redis" to share history between uvicorn workers
+SESSION_STORE = os.getenv("SESSION_STORE", "memory")
+SESSION_MAX_SESSIONS = int(os.getenv("SESSION_MAX_SESSIONS", "10000"))
+SESSION_MAX_BYTES = int(os.getenv("SESSION_MAX_BYTES", str(64 * 1024 * 1024)))
+SESSION_IDLE_TTL = float(os.getenv("SESSION_IDLE_TTL", "3600"))
+SESSION_DB = os.getenv("SESSION_DB", os.path.join(os.path.dirname(__file__), "data", "sessions.db"))
+REDIS_URL = os.getenv("REDIS_URL", "redis://localhost:6379/0")
+
+conversation_sessions = create_session_store(
+    SESSION_STORE,
+    max_sessions=SESSION_MAX_SESSIONS,
+    max_bytes=SESSION_MAX_BYTES,
+    idle_ttl=SESSION_IDLE_TTL,
+    max_messages=20,
+    db_path=SESSION_DB,
+    redis_url=REDIS_URL
+)
 
 # Pydantic models for request/response
 class ChatRequest(BaseModel):
@@ -56,17 +233,78 @@ class ChatResponse(BaseModel):
     session_id: str
     suggested_questions: List[str]
 
-@app.on_event("startup")
-def load_resources():
-    global model
-    if os.path.exists(MODEL_PATH):
+def load_model_resources():
+    """Load the model runtime, warm it up and make it the live model version."""
+    global prediction_cache, model_watcher
+    if not os.path.exists(MODEL_RUNTIME_PATH):
+        model_status.fail("missing", f"Model file not found at {MODEL_RUNTIME_PATH}")
+        print(f"Model file not found at {MODEL_RUNTIME_PATH}")
+        return
+    
+    try:
+        version = model_registry.load(MODEL_RUNTIME_PATH, MODEL_BACKEND, status=model_status)
+        prediction_cache = PredictionCache(
+            version.id,
+            max_entries=PREDICTION_CACHE_SIZE,
+            ttl_seconds=PREDICTION_CACHE_TTL,
+            db_path=PREDICTION_CACHE_DB
+        )
+        
+        # Publish the model only once everything it needs is in place
+        model_registry.promote(version.id)
+        model_status.set_state("ready")
+        print(f"Model loaded successfully ({MODEL_BACKEND} runtime)")
+    except Exception as e:
+        model_status.fail("failed", str(e))
+        print(f"Error loading model: {e}")
+        return
+    
+    if MODEL_CANDIDATE_PATH:
         try:
-            model = load_model(MODEL_PATH)
-            print("Model loaded successfully")
+            candidate = model_registry.load(MODEL_CANDIDATE_PATH, MODEL_CANDIDATE_BACKEND)
+            model_registry.set_candidate(candidate.id, MODEL_CANDIDATE_MODE, MODEL_CANDIDATE_SHARE)
+            print(f"Candidate model {candidate.id}: {MODEL_CANDIDATE_MODE}, {MODEL_CANDIDATE_SHARE:.0%} of traffic")
         except Exception as e:
-            print(f"Error loading model: {e}")
+            print(f"Warning: candidate model {MODEL_CANDIDATE_PATH} not loaded: {e}")
+    
+    if MODEL_WATCH_INTERVAL > 0:
+        model_watcher = ModelFileWatcher(model_registry, MODEL_RUNTIME_PATH, MODEL_BACKEND, MODEL_WATCH_INTERVAL)
+        model_watcher.start()
+
+@app.on_event("startup")
+def load_resources():
+    global job_workers
+    # Retired model versions are drained and shut down on the event loop
+    model_registry.loop = asyncio.get_running_loop()
+    if job_queue is not None:
+        # Forget the previous run's live model; load_model_resources publishes this run's
+        job_queue.set_live_model(None)
+    if MODEL_LOAD_MODE == "blocking":
+        load_model_resources()
     else:
-        print(f"Model file not found at {MODEL_PATH}")
+        threading.Thread(target=load_model_resources, name="model-loader", daemon=True).start()
+    
+    if job_queue is not None:
+        job_workers = JobWorkerPool({
+            "db_path": JOB_DB,
+            "backend": MODEL_BACKEND,
+            "model_path": MODEL_RUNTIME_PATH,
+            "model_threads": MODEL_THREADS,
+            "labels": LABELS,
+            "image_size": IMAGE_SIZE,
+            "batch_size": BATCH_MAX_SIZE,
+            "max_files": BATCH_UPLOAD_MAX_FILES,
+            "max_bytes": BATCH_UPLOAD_MAX_BYTES,
+            "gradcam_layer": GRADCAM_LAYER,
+            "gradcam_format": GRADCAM_FORMAT,
+            "max_attempts": JOB_MAX_ATTEMPTS,
+            "retry_backoff": JOB_RETRY_BACKOFF,
+            "lease_seconds": JOB_LEASE_SECONDS,
+            "retention_seconds": JOB_RETENTION,
+            "poll_interval": JOB_POLL_INTERVAL,
+            "webhook_hosts": JOB_WEBHOOK_HOSTS,
+        }, workers=JOB_WORKERS)
+        job_workers.start()
     
     # Initialize Groq chatbot
     try:
@@ -76,127 +314,606 @@ def load_resources():
         print(f"Warning: Groq chatbot initialization failed: {e}")
         print("Chatbot features will be unavailable. Set GROQ_API_KEY in .env file.")
 
+@app.on_event("startup")
+async def warm_chat_cache():
+    if CHAT_CACHE_PRECOMPUTE:
+        async def precompute():
+            try:
+                cached = await precompute_suggested_answers()
+                print(f"Precomputed chatbot answers: {cached} cached")
+            except Exception as e:
+                print(f"Warning: chatbot answer precomputation failed: {e}")
+        
+        # Runs in the background so startup is not delayed by LLM calls
+        asyncio.ensure_future(precompute())
+
+@app.on_event("shutdown")
+async def release_resources():
+    if model_watcher is not None:
+        model_watcher.stop()
+    await model_registry.shutdown()
+    if job_workers is not None:
+        # Workers hand their running jobs back to the queue before exiting
+        await run_in_threadpool(job_workers.stop)
+    if job_queue is not None:
+        job_queue.close()
+    if prediction_cache is not None:
+        prediction_cache.close()
+    await close_groq_client()
+
 @app.get("/")
 def read_root():
     return {"message": "Brain Tumour Detection API is running"}
 
+@app.get("/ready")
+def readiness():
+    """
+    Report model load/warm-up progress and timings.
+    Returns 503 until the model is ready to serve predictions.
+    """
+    status = model_status.to_dict()
+    if not model_status.is_ready:
+        return JSONResponse(status_code=503, content=status)
+    return status
+
+@app.get("/metrics")
+def metrics():
+    """Prometheus text-format metrics: per-route requests/errors/latency, per-stage timings and queue gauges."""
+    return Response(content=REGISTRY.render(), media_type="text/plain; version=0.0.4; charset=utf-8")
+
+# Point-in-time gauges, read at scrape time
+REGISTRY.gauge("model_ready", "1 once the model is loaded and warmed up", lambda: int(model_status.is_ready))
+REGISTRY.gauge("inference_pending_requests", "Prediction requests admitted and not yet finished (live model)",
+               lambda: model_registry.live.engine.pending if model_registry.live else None)
+REGISTRY.gauge("inference_queue_depth", "Images waiting for a micro-batch (live model)",
+               lambda: model_registry.live.engine.get_stats()["batching"]["queue_depth"] if model_registry.live else None)
+REGISTRY.gauge("model_versions_loaded", "Model versions held in memory", lambda: len(model_registry))
+REGISTRY.gauge("prediction_cache_entries", "Entries in the in-memory prediction cache",
+               lambda: prediction_cache.get_stats()["memory_entries"] if prediction_cache else None)
+REGISTRY.gauge("llm_upstream_in_flight", "Upstream LLM calls in progress",
+               lambda: chatbot.client.in_flight if chatbot.client else None)
+REGISTRY.gauge("llm_circuit_open", "1 while the upstream LLM circuit breaker is open or half-open",
+               lambda: int(chatbot.client.breaker.state != "closed") if chatbot.client else None)
+REGISTRY.gauge("chat_response_cache_entries", "Cached chatbot answers",
+               lambda: chat_response_cache.get_stats()["entries"])
+REGISTRY.gauge("jobs", "Jobs in the /jobs queue by status",
+               lambda: job_queue.get_stats()["counts"] if job_queue else None, ("status",))
+REGISTRY.gauge("job_queue_oldest_age_seconds", "Age of the oldest queued job",
+               lambda: job_queue.get_stats()["oldest_queued_age_seconds"] if job_queue else None)
+REGISTRY.gauge("job_workers_alive", "Job worker processes running",
+               lambda: job_workers.alive() if job_workers else None)
+REGISTRY.gauge("job_workers_ready", "Job worker processes with a model loaded",
+               lambda: job_workers.ready() if job_workers else None)
+JOBS_SUBMITTED = REGISTRY.counter("jobs_submitted_total", "POST /jobs requests by outcome", ("outcome",))
+
+def require_engine():
+    """Fail fast with 503 while the model is still loading; returns the live model version."""
+    live = model_registry.live
+    if live is None or prediction_cache is None:
+        if model_status.state in ("pending", "loading", "warming"):
+            raise HTTPException(
+                status_code=503,
+                detail="Model is still loading, please retry shortly",
+                headers={"Retry-After": str(MODEL_LOADING_RETRY_AFTER)}
+            )
+        raise HTTPException(status_code=500, detail="Model not loaded")
+    return live
+
 @app.get("/stats")
-def get_stats():
-    if os.path.exists(HISTORY_PATH):
-        with open(HISTORY_PATH, "rb") as f:
-            history = pickle.load(f)
-        
-        # Add summary stats
-        summary = {
-            "max_accuracy": round(max(history.get('accuracy', [0])) * 100, 2),
-            "max_val_accuracy": round(max(history.get('val_accuracy', [0])) * 100, 2),
-            "final_loss": round(history.get('loss', [0])[-1], 4),
-            "epochs": len(history.get('accuracy', []))
-        }
-        return {"history": history, "summary": summary}
-    else:
+def get_stats(request: Request, points: Optional[int] = Query(None, ge=1)):
+    """Training history and summary; `points` downsamples long runs."""
+    cached = history_store.get(points)
+    if cached is None:
         raise HTTPException(status_code=404, detail="Training history not found")
+    
+    body, etag = cached
+    # no-cache: the history changes while train.py runs, so always revalidate
+    headers = {"ETag": etag, "Cache-Control": "no-cache"}
+    if etag in request.headers.get("if-none-match", ""):
+        return Response(status_code=304, headers=headers)
+    return Response(content=body, media_type="application/json", headers=headers)
 
-@app.get("/model-info")
-def get_model_info():
-    if model:
-        # Count layer types
-        layer_counts = {}
-        for layer in model.layers:
-            l_type = type(layer).__name__
-            layer_counts[l_type] = layer_counts.get(l_type, 0) + 1
-        
-        # Build descriptive info
-        architecture_type = "Deep Convolutional Neural Network (CNN)"
-        description = (
-            f"The model is a {architecture_type} meticulously designed for high-resolution MRI analysis. "
-            f"It features {layer_counts.get('Conv2D', 0)} Convolutional layers that extract intricate spatial features from the scans, "
-            f"supported by {layer_counts.get('MaxPooling2D', 0)} Max Pooling layers for downsampling and translational invariance. "
-            f"To prevent overfitting, {layer_counts.get('Dropout', 0)} Dropout layers are strategically placed throughout the network. "
-            f"The final classification is handled by {layer_counts.get('Dense', 0)} Fully Connected layers, culminating in a 4-way Softmax output."
-        )
+def build_model_info(live, batch_size: int) -> Dict:
+    """The /model-info payload for the live model version."""
+    layer_counts = live.layer_counts
+    summary = live.summary(batch_size)
+    
+    # Build descriptive info
+    architecture_type = "Deep Convolutional Neural Network (CNN)"
+    description = (
+        f"The model is a {architecture_type} meticulously designed for high-resolution MRI analysis. "
+        f"It features {layer_counts.get('Conv2D', 0)} Convolutional layers that extract intricate spatial features from the scans, "
+        f"supported by {layer_counts.get('MaxPooling2D', 0)} Max Pooling layers for downsampling and translational invariance. "
+        f"To prevent overfitting, {layer_counts.get('Dropout', 0)} Dropout layers are strategically placed throughout the network. "
+        f"The final classification is handled by {layer_counts.get('Dense', 0)} Fully Connected layers, culminating in a 4-way Softmax output."
+    )
+    
+    return {
+        "name": "NeuroScan CNN V1",
+        "type": architecture_type,
+        "runtime": live.backend,
+        "version": live.id,
+        "description": description,
+        "params": f"{live.params:,}",
+        "stats": [
+            {"label": "Convolutional Stages", "value": layer_counts.get('Conv2D', 0)},
+            {"label": "Pooling Operations", "value": layer_counts.get('MaxPooling2D', 0)},
+            {"label": "Regularization Layers", "value": layer_counts.get('Dropout', 0)},
+            {"label": "Input Resolution", "value": "x".join(str(dim) for dim in live.input_shape)}
+        ],
+        "architecture": summary,
+        "live_versions": model_registry.versions(include_stats=False)
+    }
 
-        return {
-            "name": "NeuroScan CNN V1",
-            "type": architecture_type,
-            "description": description,
-            "params": f"{model.count_params():,}",
-            "stats": [
-                {"label": "Convolutional Stages", "value": layer_counts.get('Conv2D', 0)},
-                {"label": "Pooling Operations", "value": layer_counts.get('MaxPooling2D', 0)},
-                {"label": "Regularization Layers", "value": layer_counts.get('Dropout', 0)},
-                {"label": "Input Resolution", "value": "150x150x3"}
-            ]
-        }
+# Serialized /model-info responses by (registry generation, batch size)
+model_info_payloads: Dict[tuple, StaticPayload] = {}
+
+@app.get("/model-info")
+def get_model_info(request: Request, batch_size: Optional[int] = Query(None, ge=1, le=4096)):
+    """
+    Model description plus an architecture summary: per-layer output shapes,
+    params, MACs/FLOPs and activation memory for `batch_size` images
+    (default MODEL_INFO_BATCH_SIZE). Built once per model version and batch size.
+    """
+    live = model_registry.live
+    if live:
+        batch_size = batch_size or MODEL_INFO_BATCH_SIZE
+        key = (model_registry.generation, batch_size)
+        payload = model_info_payloads.get(key)
+        if payload is None:
+            if len(model_info_payloads) >= 32:
+                model_info_payloads.clear()
+            # max-age=0: the live version can change, so clients revalidate with the ETag
+            payload = model_info_payloads[key] = StaticPayload(build_model_info(live, batch_size), max_age=0)
+        return payload.response(request)
     else:
         return {
             "name": "Model Not Loaded",
             "description": "The AI engine is currently offline or the model file could not be loaded.",
+            "status": model_status.state,
             "params": "0",
-            "stats": []
+            "stats": [],
+            "live_versions": []
         }
 
 @app.post("/predict")
-async def predict(file: UploadFile = File(...)):
-    if model is None:
-        raise HTTPException(status_code=500, detail="Model not loaded")
+async def predict(
+    file: UploadFile = File(...),
+    tta: Optional[str] = Query(None),
+    explain: Optional[str] = Query(None)
+):
+    """
+    Classify an MRI scan.
+    `tta` (e.g. "flips,rot") also scores flipped/rotated views of the scan in
+    one batched model call and returns their averaged probabilities with an
+    uncertainty summary.
+    `explain=gradcam` adds a Grad-CAM heatmap of the regions behind the
+    predicted class, computed in the same model call as the scores.
+    """
+    require_engine()
+    shadow = None
+    try:
+        views = parse_tta(tta) if tta else None
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    if explain is not None and explain != "gradcam":
+        raise HTTPException(status_code=400, detail=f"Unknown explain method '{explain}', expected 'gradcam'")
+    if explain and views:
+        raise HTTPException(status_code=400, detail="explain cannot be combined with tta")
+    
+    # Reject oversized uploads before reading them into memory
+    if file.size is not None and file.size > MAX_UPLOAD_BYTES:
+        raise HTTPException(status_code=413, detail=f"Upload exceeds the {MAX_UPLOAD_BYTES} byte limit")
     
     try:
-        # Read image
-        contents = await file.read()
-        nparr = np.frombuffer(contents, np.uint8)
-        img = cv2.imdecode(nparr, cv2.IMREAD_COLOR)
-        
-        # Preprocess
-        img_res = cv2.resize(img, (IMAGE_SIZE, IMAGE_SIZE))
-        img_array = np.array(img_res).reshape(1, IMAGE_SIZE, IMAGE_SIZE, 3)
+        # Read image and serve repeated uploads from the cache
+        with stage("predict", "read"):
+            contents = await file.read()
+        with stage("predict", "cache_lookup") as span:
+            # Pick the serving model version (and maybe a shadow) by upload hash
+            cache_key = prediction_cache.key_for(contents)
+            served, shadow = model_registry.route(cache_key)
+            role = "live" if served is model_registry.live else "ab"
+            if explain and not served.engine.supports_gradcam:
+                raise HTTPException(
+                    status_code=400,
+                    detail=f"Grad-CAM needs the tensorflow backend, model {served.id} runs on {served.backend}"
+                )
+            if served.id != prediction_cache.model_version:
+                cache_key = prediction_cache.key_for(contents, served.id)
+            if views:
+                # TTA results are cached as per-view scores, separately per view set
+                cache_key += f"|tta={','.join(views)}"
+                shadow = None
+            elif explain:
+                # Cached as {"scores", "heatmap"} with the heatmap already encoded
+                cache_key += f"|explain=gradcam&format={GRADCAM_FORMAT}"
+            scores = (await prediction_cache.lookup([cache_key]))[0]
+            if span is not None:
+                span.set_attribute("cache.hit", scores is not None)
+                span.set_attribute("model.version", served.id)
         
-        # Predict
-        prediction = model.predict(img_array)
-        index = np.argmax(prediction, axis=1)[0]
-        confidence = float(np.max(prediction))
-        
-        return {
-            "prediction": LABELS[index],
-            "index": int(index),
-            "confidence": round(confidence * 100, 2),
-            "all_scores": prediction.tolist()[0]
-        }
+        heatmap = None
+        if scores is not None and explain:
+            scores, heatmap = scores["scores"], scores["heatmap"]
+            served.record_prediction(scores, role=role)
+        elif scores is not None:
+            served.record_prediction(np.mean(scores, axis=0) if views else scores, role=role)
+        elif views:
+            # Every view goes through the model as one batch
+            scores = await served.predict_views(contents, lambda image: build_views(image, views), role=role)
+            prediction_cache.put(cache_key, scores.tolist())
+        elif explain:
+            # Scores and activation maps come from one (micro-batched) forward pass
+            scores, heatmap_pixels = await served.explain(contents, role=role)
+            with stage("predict", "encode_heatmap"):
+                heatmap = encode_heatmap(heatmap_pixels, GRADCAM_FORMAT)
+            scores = scores.tolist()
+            prediction_cache.put(cache_key, {"scores": scores, "heatmap": heatmap})
+        else:
+            # Decode and predict off the event loop
+            # (batched together with any concurrent requests)
+            scores = await served.predict(contents, role=role)
+            prediction_cache.put(cache_key, scores.tolist())
+    except HTTPException:
+        raise
+    except QueueFullError:
+        raise HTTPException(
+            status_code=503,
+            detail="Prediction queue is full, please retry shortly",
+            headers={"Retry-After": str(INFERENCE_RETRY_AFTER)}
+        )
+    except ImageTooLargeError as e:
+        raise HTTPException(status_code=413, detail=str(e))
     except Exception as e:
         raise HTTPException(status_code=400, detail=f"Invalid image: {str(e)}")
+    
+    with stage("predict", "serialize"):
+        tta_summary = None
+        if views:
+            aggregated = aggregate(scores, views)
+            scores, tta_summary = aggregated["scores"], aggregated["tta"]
+        payload = format_prediction(scores)
+        payload["model_version"] = served.id
+        if tta_summary is not None:
+            payload["tta"] = tta_summary
+        if heatmap is not None:
+            payload["explanation"] = {
+                "method": "gradcam",
+                "class": payload["prediction"],
+                "heatmap": heatmap
+            }
+        # The shadow model runs after the response is sent
+        background = BackgroundTask(model_registry.shadow_predict, shadow, contents, scores) if shadow else None
+        return JSONResponse(payload, background=background)
+
+def format_prediction(scores) -> Dict:
+    """Map a model score vector to the /predict response payload."""
+    scores = np.asarray(scores)
+    index = int(np.argmax(scores))
+    confidence = float(np.max(scores))
+    
+    return {
+        "prediction": LABELS[index],
+        "index": index,
+        "confidence": round(confidence * 100, 2),
+        "all_scores": scores.tolist()
+    }
+
+@app.post("/predict/batch")
+async def predict_batch(files: List[UploadFile] = File(...)):
+    """
+    Predict many scans in one request.
+    Accepts several image files and/or zip/tar archives of images and streams
+    one NDJSON line per image as each batch finishes.
+    """
+    live = require_engine()
+    if not live.engine.has_capacity():
+        raise HTTPException(
+            status_code=503,
+            detail="Prediction queue is full, please retry shortly",
+            headers={"Retry-After": str(INFERENCE_RETRY_AFTER)}
+        )
+    
+    # Collect (filename, bytes) for every image in the upload
+    items = []
+    total_bytes = 0
+    try:
+        for upload in files:
+            contents = await upload.read()
+            if is_archive(upload.filename, contents):
+                remaining_files = BATCH_UPLOAD_MAX_FILES - len(items)
+                remaining_bytes = BATCH_UPLOAD_MAX_BYTES - total_bytes
+                members = expand_archive(contents, remaining_files, remaining_bytes)
+                items.extend(members)
+                total_bytes += sum(len(data) for _, data in members)
+            else:
+                items.append((upload.filename, contents))
+                total_bytes += len(contents)
+            if len(items) > BATCH_UPLOAD_MAX_FILES or total_bytes > BATCH_UPLOAD_MAX_BYTES:
+                raise ArchiveError(
+                    f"Upload exceeds {BATCH_UPLOAD_MAX_FILES} images or {BATCH_UPLOAD_MAX_BYTES} bytes"
+                )
+    except ArchiveError as e:
+        raise HTTPException(status_code=413, detail=str(e))
+    
+    if not items:
+        raise HTTPException(status_code=400, detail="No images found in upload")
+    
+    async def stream_results():
+        errors = 0
+        for start in range(0, len(items), BATCH_MAX_SIZE):
+            chunk = items[start:start + BATCH_MAX_SIZE]
+            keys = [prediction_cache.key_for(data, live.id) for _, data in chunk]
+            results = await prediction_cache.lookup(keys)
+            misses = [i for i, result in enumerate(results) if result is None]
+            
+            if misses:
+                try:
+                    predicted = await live.engine.predict_chunk([chunk[i][1] for i in misses])
+                except Exception as e:
+                    predicted = [e] * len(misses)
+                for i, result in zip(misses, predicted):
+                    if not isinstance(result, BaseException):
+                        live.record_prediction(result)
+                        prediction_cache.put(keys[i], result.tolist())
+                    results[i] = result
+            
+            lines = []
+            for offset, ((filename, _), result) in enumerate(zip(chunk, results)):
+                line = {"position": start + offset, "filename": filename, "model_version": live.id}
+                if isinstance(result, BaseException):
+                    errors += 1
+                    line["error"] = f"Invalid image: {str(result)}"
+                else:
+                    line.update(format_prediction(result))
+                lines.append(json.dumps(line) + "\n")
+            yield "".join(lines)
+        
+        yield json.dumps({"done": True, "count": len(items), "errors": errors}) + "\n"
+    
+    return StreamingResponse(stream_results(), media_type="application/x-ndjson")
+
+@app.get("/predict/stats")
+def get_predict_stats():
+    """
+    Get inference statistics for /predict: executor occupancy, queue depth,
+    batch size histogram and per-stage latency (live model).
+    """
+    live = model_registry.live
+    if live is None:
+        raise HTTPException(status_code=503, detail="Model not loaded")
+    return live.engine.get_stats()
+
+@app.get("/predict/cache")
+def get_prediction_cache_stats():
+    """Get prediction cache hit/miss/eviction counters."""
+    if prediction_cache is None:
+        raise HTTPException(status_code=503, detail="Model not loaded")
+    return prediction_cache.get_stats()
+
+@app.delete("/predict/cache")
+def invalidate_prediction_cache():
+    """
+    Drop all cached predictions. To serve a replaced model file, load it
+    through POST /models (or MODEL_WATCH_INTERVAL) so it gets a new version.
+    """
+    if prediction_cache is None or model_registry.live is None:
+        raise HTTPException(status_code=503, detail="Model not loaded")
+    prediction_cache.invalidate(model_registry.live.id)
+    return prediction_cache.get_stats()
+
+class ModelLoadRequest(BaseModel):
+    path: str
+    backend: Optional[str] = None
+    name: Optional[str] = None
+    role: str = "standby"
+    share: float = 0.1
+
+class ModelRoutingRequest(BaseModel):
+    mode: str = "shadow"
+    share: float = 0.1
+
+def require_admin(request: Request):
+    """Model management needs MODEL_ADMIN_TOKEN in the X-Admin-Token header."""
+    if MODEL_ADMIN_TOKEN is None:
+        raise HTTPException(status_code=403, detail="Model management is disabled (MODEL_ADMIN_TOKEN is not set)")
+    if not hmac.compare_digest(request.headers.get("x-admin-token", ""), MODEL_ADMIN_TOKEN):
+        raise HTTPException(status_code=401, detail="Invalid admin token")
+
+@app.get("/models")
+def list_models():
+    """Loaded model versions, their routing role and per-version latency and prediction distribution."""
+    return model_registry.get_stats()
+
+@app.post("/models")
+def load_model_version(body: ModelLoadRequest, request: Request):
+    """
+    Load and warm up a model version, then route to it by `role`:
+    "live" swaps it in atomically, "shadow"/"ab" makes it the candidate for
+    `share` of /predict traffic, "standby" only keeps it loaded.
+    """
+    require_admin(request)
+    if body.role not in ("live", "standby") + ROUTING_MODES:
+        raise HTTPException(status_code=400, detail=f"Unknown role '{body.role}'")
+    if not os.path.exists(body.path):
+        raise HTTPException(status_code=400, detail=f"Model file not found at {body.path}")
+    
+    try:
+        version = model_registry.load(body.path, body.backend or MODEL_BACKEND, name=body.name)
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Error loading model: {str(e)}")
+    
+    if body.role == "live":
+        model_registry.promote(version.id)
+    elif body.role in ROUTING_MODES:
+        model_registry.set_candidate(version.id, body.role, body.share)
+    return model_registry.get_stats()
+
+@app.post("/models/{version_id}/promote")
+def promote_model_version(version_id: str, request: Request):
+    """Make a loaded version live; the previous one is drained and unloaded."""
+    require_admin(request)
+    try:
+        model_registry.promote(version_id)
+    except KeyError:
+        raise HTTPException(status_code=404, detail=f"Model version '{version_id}' not loaded")
+    return model_registry.get_stats()
+
+@app.put("/models/{version_id}/routing")
+def route_model_version(version_id: str, body: ModelRoutingRequest, request: Request):
+    """Send `share` of /predict traffic to a loaded version as an A/B arm or a shadow."""
+    require_admin(request)
+    try:
+        model_registry.set_candidate(version_id, body.mode, body.share)
+    except KeyError:
+        raise HTTPException(status_code=404, detail=f"Model version '{version_id}' not loaded")
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    return model_registry.get_stats()
+
+@app.delete("/models/{version_id}")
+def unload_model_version(version_id: str, request: Request):
+    """Unload a version that is not live."""
+    require_admin(request)
+    try:
+        model_registry.unload(version_id)
+    except KeyError:
+        raise HTTPException(status_code=404, detail=f"Model version '{version_id}' not loaded")
+    except ValueError as e:
+        raise HTTPException(status_code=409, detail=str(e))
+    return model_registry.get_stats()
+
+def require_job_queue() -> JobQueue:
+    if job_queue is None:
+        raise HTTPException(status_code=503, detail="The job API is disabled (JOB_WORKERS=0)")
+    return job_queue
+
+@app.post("/jobs", status_code=202)
+async def submit_job(
+    request: Request,
+    files: List[UploadFile] = File(...),
+    priority: int = Query(0, ge=-100, le=100),
+    tta: Optional[str] = Query(None),
+    explain: Optional[str] = Query(None),
+    webhook_url: Optional[str] = Query(None)
+):
+    """
+    Queue scans (images and/or zip/tar archives) for asynchronous scoring and
+    return the job at once. Poll GET /jobs/{id} or pass `webhook_url` to be
+    called when it finishes. Higher `priority` jobs run first. Retrying with
+    the same Idempotency-Key header returns the original job.
+    """
+    queue = require_job_queue()
+    if job_workers is None or job_workers.ready() == 0:
+        JOBS_SUBMITTED.inc(outcome="rejected")
+        raise HTTPException(status_code=503, detail="No job worker has a model loaded",
+                            headers={"Retry-After": str(INFERENCE_RETRY_AFTER)})
+    try:
+        views = parse_tta(tta) if tta else None
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    if explain is not None and explain != "gradcam":
+        raise HTTPException(status_code=400, detail=f"Unknown explain method '{explain}', expected 'gradcam'")
+    if explain and views:
+        raise HTTPException(status_code=400, detail="explain cannot be combined with tta")
+    if explain:
+        # Workers follow the live version, so it decides as it does for /predict
+        live = model_registry.live
+        if live is None:
+            raise HTTPException(status_code=503, detail="Model not loaded",
+                                headers={"Retry-After": str(INFERENCE_RETRY_AFTER)})
+        if not live.engine.supports_gradcam:
+            raise HTTPException(
+                status_code=400,
+                detail=f"Grad-CAM needs the tensorflow backend, model {live.id} runs on {live.backend}"
+            )
+    if webhook_url is not None and not JOB_WEBHOOK_HOSTS:
+        raise HTTPException(status_code=400, detail="Webhooks are disabled (set JOB_WEBHOOK_HOSTS)")
+    if webhook_url is not None and not webhook_allowed(webhook_url, JOB_WEBHOOK_HOSTS):
+        raise HTTPException(status_code=400, detail="webhook_url must be an http(s) URL on an allowed host")
+    
+    uploads = []
+    total_bytes = 0
+    for upload in files:
+        contents = await upload.read()
+        total_bytes += len(contents)
+        if total_bytes > BATCH_UPLOAD_MAX_BYTES:
+            JOBS_SUBMITTED.inc(outcome="rejected")
+            raise HTTPException(status_code=413, detail=f"Upload exceeds {BATCH_UPLOAD_MAX_BYTES} bytes")
+        uploads.append((upload.filename, contents))
+    
+    options = {"tta": views, "explain": explain}
+    try:
+        job, created = await run_in_threadpool(
+            queue.submit, uploads, options, priority, webhook_url, request.headers.get("idempotency-key") or None
+        )
+    except JobQueueFullError as e:
+        JOBS_SUBMITTED.inc(outcome="rejected")
+        raise HTTPException(status_code=503, detail=str(e), headers={"Retry-After": str(INFERENCE_RETRY_AFTER)})
+    
+    JOBS_SUBMITTED.inc(outcome="created" if created else "duplicate")
+    job.pop("result", None)
+    return JSONResponse(job, status_code=202 if created else 200, headers={"Location": f"/jobs/{job['id']}"})
+
+@app.get("/jobs/stats")
+def get_job_stats():
+    """Queue depth by status and priority, age of the oldest queued job and worker processes."""
+    stats = require_job_queue().get_stats()
+    stats["workers"] = job_workers.get_stats() if job_workers else None
+    return stats
+
+@app.get("/jobs/{job_id}")
+def get_job(job_id: str):
+    """Job status and progress; `result` holds one /predict-style entry per image once it succeeded."""
+    job = require_job_queue().get(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail=f"Job '{job_id}' not found")
+    return job
+
+@app.delete("/jobs/{job_id}")
+def cancel_job(job_id: str):
+    """Cancel a job: queued jobs stop at once, running ones after their current batch."""
+    job = require_job_queue().cancel(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail=f"Job '{job_id}' not found")
+    if job["status"] in FINISHED_STATES and job["status"] != "cancelled":
+        raise HTTPException(status_code=409, detail=f"Job '{job_id}' already {job['status']}")
+    job.pop("result", None)
+    return job
+
+def chat_deadline(http_request: Request) -> float:
+    """Seconds the caller allows for a chat answer (X-Request-Timeout header, capped by CHAT_REQUEST_TIMEOUT)."""
+    try:
+        requested = float(http_request.headers.get("x-request-timeout", ""))
+    except ValueError:
+        return CHAT_REQUEST_TIMEOUT
+    return min(requested, CHAT_REQUEST_TIMEOUT) if requested > 0 else CHAT_REQUEST_TIMEOUT
 
 @app.post("/chat", response_model=ChatResponse)
-async def chat(request: ChatRequest):
+async def chat(request: ChatRequest, http_request: Request):
     """
     Chat endpoint for AI-powered medical education assistant.
     Supports context-aware responses based on scan results.
     """
+    timeout = chat_deadline(http_request)
     try:
         # Generate or retrieve session ID
         session_id = request.session_id or str(uuid.uuid4())
         
         # Get conversation history for this session
-        if session_id not in conversation_sessions:
-            conversation_sessions[session_id] = []
+        conversation_history = await run_in_threadpool(conversation_sessions.get, session_id)
         
-        conversation_history = conversation_sessions[session_id]
-        
-        # Get chatbot response
-        response = await get_chatbot_response(
-            user_message=request.message,
-            context=request.context,
-            conversation_history=conversation_history
-        )
+        # Get chatbot response (upstream retries stop at the request's deadline)
+        with deadline_scope(timeout):
+            response = await get_chatbot_response(
+                user_message=request.message,
+                context=request.context,
+                conversation_history=conversation_history
+            )
         
         # Update conversation history
-        conversation_history.append({"role": "user", "content": request.message})
-        conversation_history.append({"role": "assistant", "content": response})
-        
-        # Keep only last 20 messages to prevent memory bloat
-        if len(conversation_history) > 20:
-            conversation_history = conversation_history[-20:]
-        
-        conversation_sessions[session_id] = conversation_history
+        await run_in_threadpool(save_conversation_turn, session_id, request.message, response)
         
         # Get suggested questions
         suggestions = get_suggested_questions(request.context)
@@ -210,25 +927,113 @@ async def chat(request: ChatRequest):
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Chat error: {str(e)}")
 
+@app.post("/chat/stream")
+async def chat_stream(request: ChatRequest, http_request: Request):
+    """
+    Streaming chat endpoint (Server-Sent Events).
+    Emits a `token` event per generated text chunk and a final `done` event with
+    the session ID, suggested questions, time-to-first-token and tokens/sec.
+    """
+    session_id = request.session_id or str(uuid.uuid4())
+    conversation_history = await run_in_threadpool(conversation_sessions.get, session_id)
+    suggestions = get_suggested_questions(request.context)
+    
+    timeout = chat_deadline(http_request)
+    
+    async def event_stream():
+        try:
+            with deadline_scope(timeout):
+                async for event in stream_chatbot_response(
+                    user_message=request.message,
+                    context=request.context,
+                    conversation_history=conversation_history
+                ):
+                    if event["type"] == "token":
+                        yield sse_event("token", {"content": event["content"]})
+                        continue
+                
+                    # Only completed answers are added to the conversation history
+                    await run_in_threadpool(save_conversation_turn, session_id, request.message, event["response"])
+                    print(
+                        f"Chat stream {session_id}: ttft {event['ttft_ms']} ms, "
+                        f"{event['tokens']} tokens at {event['tokens_per_sec']} tokens/sec"
+                    )
+                    yield sse_event("done", {
+                        "session_id": session_id,
+                        "suggested_questions": suggestions,
+                        "cached": event["cached"],
+                        "ttft_ms": event["ttft_ms"],
+                        "tokens": event["tokens"],
+                        "tokens_per_sec": event["tokens_per_sec"]
+                    })
+        except Exception as e:
+            yield sse_event("error", {"session_id": session_id, "message": connection_error_message(e)})
+    
+    return StreamingResponse(
+        event_stream(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
+
+def save_conversation_turn(session_id: str, user_message: str, response: str):
+    """
+    Append a user/assistant exchange to the session history (last 20 messages kept).
+    The sqlite/redis stores block, so async handlers call this in the threadpool.
+    """
+    conversation_sessions.append(session_id, [
+        {"role": "user", "content": user_message},
+        {"role": "assistant", "content": response}
+    ])
+
+@app.get("/chat/sessions/stats")
+def get_session_stats():
+    """Get live session count, evictions and memory footprint of the session store."""
+    return conversation_sessions.get_stats()
+
+@app.get("/chat/upstream/stats")
+def get_chat_upstream_stats():
+    """Get upstream LLM client state: in-flight calls, retries, circuit breaker and rate limit budget."""
+    if chatbot.client is None:
+        raise HTTPException(status_code=503, detail="Chatbot is not configured")
+    return chatbot.client.get_stats()
+
+@app.get("/chat/prompt/stats")
+def get_chat_prompt_stats():
+    """Get prompt builder state: tokenizer, input token budget and prefix cache hits."""
+    return chatbot.prompt_builder.get_stats()
+
+@app.get("/chat/cache/stats")
+def get_chat_cache_stats():
+    """Get chatbot response cache hit/miss/coalescing counters."""
+    return chat_response_cache.get_stats()
+
+def sse_event(event: str, data: Dict) -> str:
+    """Format a Server-Sent Events message."""
+    return f"event: {event}\ndata: {json.dumps(data)}\n\n"
+
+# Educational content never changes at runtime: serialize and compress it once
+EDUCATIONAL_CONTENT = StaticPayload({
+    "tumor_types": get_all_tumor_info(),
+    "faqs": get_faqs()
+})
+TUMOR_CONTENT = {key: StaticPayload(info) for key, info in get_all_tumor_info().items()}
+
 @app.get("/educational-content")
-def get_educational_content():
+def get_educational_content(request: Request):
     """
     Get educational content for all tumor types and FAQs.
     """
-    return {
-        "tumor_types": get_all_tumor_info(),
-        "faqs": get_faqs()
-    }
+    return EDUCATIONAL_CONTENT.response(request)
 
 @app.get("/educational-content/{tumor_type}")
-def get_educational_content_by_type(tumor_type: str):
+def get_educational_content_by_type(tumor_type: str, request: Request):
     """
     Get detailed educational content for a specific tumor type.
     """
-    info = get_tumor_info(tumor_type)
-    if info is None:
+    tumor_key = TUMOR_ALIASES.get(tumor_type.strip().lower())
+    if tumor_key is None:
         raise HTTPException(status_code=404, detail=f"Tumor type '{tumor_type}' not found")
-    return info
+    return TUMOR_CONTENT[tumor_key].response(request)
 
 if __name__ == "__main__":
     import uvicorn
@@ -0,0 +1,426 @@
+"""
+Model registry.
+Holds several loaded model versions, swaps the live version atomically once a
+new one is warmed up, routes a share of /predict traffic to a candidate (A/B)
+or mirrors it in the background (shadow), and keeps per-version latency and
+prediction-distribution statistics.
+"""
+
+import asyncio
+import os
+import threading
+import time
+from typing import Callable, Dict, List, Optional, Tuple
+
+import numpy as np
+
+from batching import LatencyTracker
+from model_summary import summarize
+from prediction_cache import model_fingerprint
+from runtimes import load_runtime
+from telemetry import REGISTRY as METRICS
+
+ROUTING_MODES = ("ab", "shadow")
+
+MODEL_PREDICTIONS = METRICS.counter(
+    "model_predictions_total", "Predictions served or shadowed per model version and label",
+    ("model_version", "label", "role"))
+MODEL_LATENCY = METRICS.histogram(
+    "model_predict_duration_seconds", "Decode + batched inference time per model version", ("model_version",))
+
+
+class ModelVersion:
+    """One loaded model: runtime, inference engine and its statistics."""
+
+    def __init__(self, name: str, path: str, backend: str, runtime, engine, labels: List[str], fingerprint: str):
+        self.name = name
+        self.path = path
+        self.backend = backend
+        self.fingerprint = fingerprint
+        self.id = f"{name}@{self.fingerprint}"
+        self.runtime = runtime
+        self.engine = engine
+        self.labels = labels
+        self.loaded_at = time.time()
+
+        # Architecture summary: the layer walk happens once, at load time
+        self.layer_counts = runtime.layer_counts()
+        self.params = int(runtime.count_params())
+        self.input_shape = runtime.input_shape()
+        self._layer_table = runtime.layer_table()
+        self._bytes_per_element = runtime.bytes_per_element()
+        self._summaries: Dict[int, Dict] = {}
+
+        self.latency = LatencyTracker()
+        self.predictions = [0] * len(labels)
+        self.errors = 0
+        # Shadow comparisons against the live model's answer
+        self.shadow_compared = 0
+        self.shadow_agreed = 0
+        self.shadow_skipped = 0
+
+    async def predict(self, contents: bytes, role: str = "live") -> np.ndarray:
+        start = time.perf_counter()
+        try:
+            scores = await self.engine.predict(contents)
+        except Exception:
+            self.errors += 1
+            raise
+        elapsed = time.perf_counter() - start
+        self.latency.record(elapsed)
+        MODEL_LATENCY.observe(elapsed, model_version=self.id)
+        self.record_prediction(scores, role)
+        return scores
+
+    async def predict_views(self, contents: bytes, build_views, role: str = "live") -> np.ndarray:
+        """Score several views of one image in a single model call; returns (V, classes)."""
+        start = time.perf_counter()
+        try:
+            scores = await self.engine.predict_views(contents, build_views)
+        except Exception:
+            self.errors += 1
+            raise
+        elapsed = time.perf_counter() - start
+        self.latency.record(elapsed)
+        MODEL_LATENCY.observe(elapsed, model_version=self.id)
+        self.record_prediction(scores.mean(axis=0), role)
+        return scores
+
+    async def explain(self, contents: bytes, role: str = "live"):
+        """Scores plus a Grad-CAM heatmap for the predicted class; returns (scores, heatmap)."""
+        start = time.perf_counter()
+        try:
+            scores, heatmap = await self.engine.explain(contents)
+        except Exception:
+            self.errors += 1
+            raise
+        elapsed = time.perf_counter() - start
+        self.latency.record(elapsed)
+        MODEL_LATENCY.observe(elapsed, model_version=self.id)
+        self.record_prediction(scores, role)
+        return scores, heatmap
+
+    def record_prediction(self, scores, role: str = "live"):
+        """Count a served (or shadowed) prediction in the label distribution."""
+        index = int(np.argmax(scores))
+        self.predictions[index] += 1
+        MODEL_PREDICTIONS.inc(model_version=self.id, label=self.labels[index], role=role)
+
+    def summary(self, batch_size: int = 1) -> Dict:
+        """Per-layer shapes, params, MACs/FLOPs and activation memory for a batch (cached)."""
+        cached = self._summaries.get(batch_size)
+        if cached is None:
+            cached = summarize(self._layer_table, self.input_shape, batch_size, self._bytes_per_element)
+            if len(self._summaries) < 16:
+                self._summaries[batch_size] = cached
+        return cached
+
+    def get_stats(self) -> Dict:
+        total = sum(self.predictions)
+        stats = {
+            "predictions": total,
+            "errors": self.errors,
+            "latency": self.latency.summary(),
+            "distribution": {
+                label: round(count / total, 4) if total else 0.0
+                for label, count in zip(self.labels, self.predictions)
+            },
+        }
+        if self.shadow_compared or self.shadow_skipped:
+            stats["shadow"] = {
+                "compared": self.shadow_compared,
+                "skipped": self.shadow_skipped,
+                "agreement": round(self.shadow_agreed / self.shadow_compared, 4) if self.shadow_compared else None,
+            }
+        return stats
+
+    def info(self) -> Dict:
+        return {
+            "id": self.id,
+            "name": self.name,
+            "backend": self.backend,
+            "path": self.path,
+            "loaded_at": self.loaded_at,
+        }
+
+
+class ModelRegistry:
+    """
+    Loaded model versions plus the routing between them.
+
+    `engine_factory(runtime, path, backend)` builds the InferenceEngine for a
+    newly loaded runtime, so every version uses the same executor settings.
+    `on_promote(version)` runs after every swap (e.g. to re-key caches).
+    """
+
+    def __init__(
+        self,
+        engine_factory: Callable,
+        labels: List[str],
+        warmup_batch_sizes: List[int],
+        model_threads: int = 0,
+        drain_timeout: float = 30.0,
+        on_promote: Optional[Callable[[ModelVersion], None]] = None
+    ):
+        self.engine_factory = engine_factory
+        self.on_promote = on_promote
+        self.labels = labels
+        self.warmup_batch_sizes = warmup_batch_sizes
+        self.model_threads = model_threads
+        self.drain_timeout = drain_timeout
+        self.loop: Optional[asyncio.AbstractEventLoop] = None
+
+        self._lock = threading.Lock()
+        self._versions: Dict[str, ModelVersion] = {}
+        self._live: Optional[ModelVersion] = None
+        self._candidate: Optional[ModelVersion] = None
+        self.candidate_mode = "shadow"
+        self.candidate_share = 0.0
+        self.swaps = 0
+        # Bumped whenever versions or their roles change
+        self.generation = 0
+
+    def __len__(self) -> int:
+        return len(self._versions)
+
+    @property
+    def live(self) -> Optional[ModelVersion]:
+        return self._live
+
+    @property
+    def candidate(self) -> Optional[ModelVersion]:
+        return self._candidate
+
+    def get(self, version_id: str) -> Optional[ModelVersion]:
+        return self._versions.get(version_id)
+
+    def load(self, path: str, backend: str, name: Optional[str] = None, status=None) -> ModelVersion:
+        """
+        Load and warm a model version (blocking) without routing traffic to it.
+        An already loaded identical file is returned as is.
+
+        Args:
+            status: Optional ModelStatus to report load/warm-up progress to
+        """
+        name = name or os.path.splitext(os.path.basename(path))[0]
+        # Hashed once: the version id, dedup key and loaded weights must all agree
+        fingerprint = model_fingerprint(path)
+        version_id = f"{name}@{fingerprint}"
+        existing = self._versions.get(version_id)
+        if existing is not None:
+            return existing
+
+        if status is not None:
+            status.set_state("loading")
+        start = time.perf_counter()
+        runtime = load_runtime(backend, path, num_threads=self.model_threads)
+        if model_fingerprint(path) != fingerprint:
+            # Rewritten mid-load: the weights may not be the hashed ones (the watcher retries)
+            raise RuntimeError(f"{path} changed while it was being loaded")
+        if status is not None:
+            status.record("load", time.perf_counter() - start)
+
+        engine = self.engine_factory(runtime, path, backend)
+        if status is not None:
+            status.set_state("warming")
+            status.warmup_total = len(self.warmup_batch_sizes)
+        start = time.perf_counter()
+        engine.warmup(self.warmup_batch_sizes, on_batch=status.record_warmup if status is not None else None)
+        if status is not None:
+            status.record("warmup", time.perf_counter() - start)
+
+        version = ModelVersion(name, path, backend, runtime, engine, self.labels, fingerprint)
+        with self._lock:
+            self._versions[version.id] = version
+            self.generation += 1
+        print(f"Loaded model {version.id} ({backend} runtime)")
+        return version
+
+    def promote(self, version_id: str) -> Optional[ModelVersion]:
+        """
+        Atomically make a loaded version live. The previous live version is
+        drained and unloaded in the background. Returns the previous version.
+        """
+        with self._lock:
+            version = self._versions.get(version_id)
+            if version is None:
+                raise KeyError(version_id)
+            previous = self._live
+            if previous is version:
+                return None
+            # A single reference assignment: requests see either the old or the new model
+            self._live = version
+            if self._candidate is version:
+                self._candidate = None
+            self.swaps += 1
+            self.generation += 1
+        print(f"Model {version.id} is now live")
+        if self.on_promote is not None:
+            self.on_promote(version)
+        if previous is not None:
+            self._retire(previous)
+        return previous
+
+    def set_candidate(self, version_id: str, mode: str = "shadow", share: float = 0.1):
+        """Route `share` of /predict traffic to a loaded version (A/B) or mirror it (shadow)."""
+        if mode not in ROUTING_MODES:
+            raise ValueError(f"Unknown routing mode '{mode}', expected one of {ROUTING_MODES}")
+        with self._lock:
+            version = self._versions.get(version_id)
+            if version is None:
+                raise KeyError(version_id)
+            if version is self._live:
+                raise ValueError(f"{version_id} is already live")
+            self.candidate_mode = mode
+            self.candidate_share = min(max(float(share), 0.0), 1.0)
+            self._candidate = version
+            self.generation += 1
+
+    def unload(self, version_id: str):
+        """Unload a version that is not live."""
+        with self._lock:
+            version = self._versions.get(version_id)
+            if version is None:
+                raise KeyError(version_id)
+            if version is self._live:
+                raise ValueError("Cannot unload the live model; promote another version first")
+            if version is self._candidate:
+                self._candidate = None
+        self._retire(version)
+
+    def _retire(self, version: ModelVersion):
+        with self._lock:
+            self._versions.pop(version.id, None)
+            self.generation += 1
+        if self.loop is None or self.loop.is_closed():
+            return
+
+        async def drain():
+            # Let requests that already picked this version finish first
+            deadline = time.monotonic() + self.drain_timeout
+            while version.engine.pending and time.monotonic() < deadline:
+                await asyncio.sleep(0.05)
+            await version.engine.shutdown()
+            print(f"Unloaded model {version.id}")
+
+        asyncio.run_coroutine_threadsafe(drain(), self.loop)
+
+    def route(self, routing_key: str) -> Tuple[Optional[ModelVersion], Optional[ModelVersion]]:
+        """
+        Pick the version that serves a request and an optional shadow version.
+        Routing is deterministic per key (the upload hash), so retries of the
+        same scan always hit the same model.
+        """
+        live, candidate = self._live, self._candidate
+        if candidate is None or self.candidate_share <= 0:
+            return live, None
+        if self.candidate_mode == "shadow":
+            in_share = self.candidate_share >= 1 or _bucket(routing_key) < self.candidate_share
+            return live, candidate if in_share else None
+        if _bucket(routing_key) < self.candidate_share:
+            return candidate, None
+        return live, None
+
+    async def shadow_predict(self, shadow: ModelVersion, contents: bytes, served_scores):
+        """Run the shadow model on a request and compare with the served answer."""
+        if not shadow.engine.has_capacity():
+            shadow.shadow_skipped += 1
+            return
+        try:
+            scores = await shadow.predict(contents, role="shadow")
+        except Exception:
+            return
+        shadow.shadow_compared += 1
+        if int(np.argmax(scores)) == int(np.argmax(served_scores)):
+            shadow.shadow_agreed += 1
+
+    def versions(self, include_stats: bool = True) -> List[Dict]:
+        """Loaded versions with their role and (optionally) statistics."""
+        live, candidate = self._live, self._candidate
+        entries = []
+        for version in list(self._versions.values()):
+            entry = version.info()
+            if version is live:
+                entry["role"] = "live"
+            elif version is candidate:
+                entry["role"] = self.candidate_mode
+                entry["traffic_share"] = self.candidate_share
+            else:
+                entry["role"] = "standby"
+            if include_stats:
+                entry["stats"] = version.get_stats()
+            entries.append(entry)
+        return entries
+
+    def get_stats(self) -> Dict:
+        candidate = self._candidate
+        return {
+            "live": self._live.id if self._live else None,
+            "candidate": {
+                "id": candidate.id,
+                "mode": self.candidate_mode,
+                "traffic_share": self.candidate_share,
+            } if candidate else None,
+            "swaps": self.swaps,
+            "versions": self.versions(),
+        }
+
+    async def shutdown(self):
+        for version in list(self._versions.values()):
+            await version.engine.shutdown()
+
+
+def _bucket(routing_key: str) -> float:
+    """Map a hex digest (or any string) to [0, 1)."""
+    digest = routing_key.rsplit(":", 1)[-1]
+    try:
+        return int(digest[:8], 16) / 0x100000000
+    except ValueError:
+        return (hash(routing_key) & 0xFFFFFFFF) / 0x100000000
+
+
+class ModelFileWatcher:
+    """
+    Polls a model file and hot-swaps to it once it has changed and stayed
+    unchanged for one poll interval (so half-written files are never loaded).
+    """
+
+    def __init__(self, registry: ModelRegistry, path: str, backend: str, interval: float = 10.0):
+        self.registry = registry
+        self.path = path
+        self.backend = backend
+        self.interval = interval
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name="model-watcher", daemon=True)
+
+    def start(self):
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+
+    def _signature(self):
+        try:
+            stat = os.stat(self.path)
+        except FileNotFoundError:
+            return None
+        return stat.st_mtime_ns, stat.st_size
+
+    def _run(self):
+        seen = self._signature()
+        pending = None
+        while not self._stop.wait(self.interval):
+            current = self._signature()
+            if current is None or current == seen:
+                pending = None
+                continue
+            if current != pending:
+                # Changed since the last poll: wait until the writer is done
+                pending = current
+                continue
+            try:
+                version = self.registry.load(self.path, self.backend)
+                self.registry.promote(version.id)
+            except Exception as e:
+                print(f"Hot reload of {self.path} failed: {e}")
+            seen, pending = current, None
@@ -0,0 +1,131 @@
+"""
+Model architecture summary.
+Per-layer output shapes, parameter counts, MACs/FLOPs and activation memory,
+computed once from the Keras model (export_model.py stores the same layer
+table in the sidecar JSON so the ONNX/TFLite runtimes can report it too).
+"""
+
+from typing import Dict, List, Optional
+
+import numpy as np
+
+# Layers that only apply an element-wise function to their input
+ELEMENTWISE_LAYERS = ("Activation", "ReLU", "LeakyReLU", "PReLU", "ELU", "Softmax", "Add", "Multiply")
+
+
+def _shape(tensor_or_shape) -> List[Optional[int]]:
+    if isinstance(tensor_or_shape, list) and tensor_or_shape and not isinstance(tensor_or_shape[0], (int, type(None))):
+        tensor_or_shape = tensor_or_shape[0]
+    shape = getattr(tensor_or_shape, "shape", tensor_or_shape)
+    return [None if dim is None else int(dim) for dim in tuple(shape)]
+
+
+def _layer_shape(layer, attr: str) -> List[Optional[int]]:
+    """Shape of a layer's input or output without the batch dimension."""
+    try:
+        # Keras 2 exposes input_shape/output_shape; Keras 3 only the tensors
+        shape = _shape(getattr(layer, f"{attr}_shape"))
+    except (AttributeError, RuntimeError):
+        shape = _shape(getattr(layer, attr))
+    return shape[1:]
+
+
+def _elements(shape: List[Optional[int]]) -> int:
+    return int(np.prod([dim or 1 for dim in shape])) if shape else 1
+
+
+def _weight_size(layer, attr: str) -> int:
+    weight = getattr(layer, attr, None)
+    return int(np.prod(tuple(weight.shape))) if weight is not None else 0
+
+
+def layer_costs(layer) -> Dict:
+    """Output shape, parameters, MACs and FLOPs of one layer for a single image."""
+    output_shape = _layer_shape(layer, "output")
+    output_elements = _elements(output_shape)
+    # Convolutions and Dense layers apply their kernel at every spatial position
+    positions = _elements(output_shape[:-1])
+    layer_type = type(layer).__name__
+
+    macs = sum(
+        positions * _weight_size(layer, attr)
+        for attr in ("depthwise_kernel", "pointwise_kernel", "kernel")
+    )
+    flops = 2 * macs
+    if macs:
+        if getattr(layer, "use_bias", False):
+            flops += output_elements
+        activation = getattr(getattr(layer, "activation", None), "__name__", "linear")
+        if activation != "linear":
+            flops += output_elements
+    elif "Pooling" in layer_type:
+        pool_size = getattr(layer, "pool_size", None)
+        if pool_size is not None:
+            flops = output_elements * int(np.prod(pool_size))
+        else:
+            # Global pooling reads every input element once
+            flops = _elements(_layer_shape(layer, "input"))
+    elif layer_type in ("BatchNormalization", "LayerNormalization"):
+        flops = 2 * output_elements
+    elif layer_type in ELEMENTWISE_LAYERS:
+        flops = output_elements
+
+    return {
+        "name": layer.name,
+        "type": layer_type,
+        "output_shape": output_shape,
+        "params": int(layer.count_params()),
+        "macs": int(macs),
+        "flops": int(flops),
+        "output_elements": output_elements,
+    }
+
+
+def keras_layer_table(keras_model) -> List[Dict]:
+    """Per-layer costs of a Keras model (the `layers` entry of the sidecar JSON)."""
+    return [layer_costs(layer) for layer in keras_model.layers]
+
+
+def summarize(
+    layers: List[Dict],
+    input_shape: List[int],
+    batch_size: int = 1,
+    bytes_per_element: int = 4
+) -> Dict:
+    """
+    Totals and per-layer costs for a batch.
+
+    Activation memory is reported two ways: `activation_bytes` keeps every
+    layer output (what training needs), `peak_activation_bytes` is the
+    largest input + output pair alive at once during sequential inference.
+    """
+    batch_bytes = batch_size * bytes_per_element
+    previous = _elements(input_shape)
+    peak = 0
+    entries = []
+    for layer in layers:
+        output_bytes = layer["output_elements"] * batch_bytes
+        peak = max(peak, (previous + layer["output_elements"]) * batch_bytes)
+        previous = layer["output_elements"]
+        entries.append({
+            "name": layer["name"],
+            "type": layer["type"],
+            "output_shape": layer["output_shape"],
+            "params": layer["params"],
+            "macs": layer["macs"] * batch_size,
+            "flops": layer["flops"] * batch_size,
+            "activation_bytes": output_bytes,
+        })
+
+    return {
+        "batch_size": batch_size,
+        "input_shape": list(input_shape),
+        "output_shape": layers[-1]["output_shape"] if layers else None,
+        "params": sum(layer["params"] for layer in layers),
+        "macs": sum(entry["macs"] for entry in entries),
+        "flops": sum(entry["flops"] for entry in entries),
+        "input_bytes": _elements(input_shape) * batch_bytes,
+        "activation_bytes": sum(entry["activation_bytes"] for entry in entries),
+        "peak_activation_bytes": peak,
+        "layers": entries,
+    }
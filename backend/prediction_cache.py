@@ -0,0 +1,247 @@
+"""
+Content-addressed cache for prediction results.
+Keys are a hash of the uploaded bytes plus the model version, with an in-memory
+LRU tier and an optional SQLite tier that survives restarts. The SQLite tier
+never runs on the event loop: async lookups read it in the default executor
+and writes go through a background writer thread.
+"""
+
+import asyncio
+import hashlib
+import json
+import os
+import queue
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from typing import Dict, List, Optional
+
+
+def model_fingerprint(model_path: str) -> str:
+    """Hash the model file so cached results are tied to the exact weights."""
+    digest = hashlib.sha256()
+    with open(model_path, "rb") as f:
+        for block in iter(lambda: f.read(1024 * 1024), b""):
+            digest.update(block)
+    return digest.hexdigest()[:16]
+
+
+class PredictionCache:
+    """Two-tier (memory LRU + optional SQLite) cache of model score vectors."""
+
+    def __init__(
+        self,
+        model_version: str,
+        max_entries: int = 1024,
+        ttl_seconds: float = 3600.0,
+        db_path: Optional[str] = None
+    ):
+        """
+        Args:
+            model_version: Identifier of the loaded model (part of every key)
+            max_entries: Maximum entries kept in the in-memory tier
+            ttl_seconds: Lifetime of an entry in either tier (0 disables expiry)
+            db_path: SQLite file for the persistent tier (None disables it)
+        """
+        self.model_version = model_version
+        self.max_entries = max(0, int(max_entries))
+        self.ttl = float(ttl_seconds)
+        self.db_path = db_path
+
+        self._entries = OrderedDict()
+        # Memory tier and counters; the connection has its own lock so the
+        # event loop never waits behind disk I/O
+        self._lock = threading.Lock()
+        self._db_lock = threading.Lock()
+        self._db = None
+        self._writes = None
+        self._writer = None
+
+        self.hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+        self.dropped_writes = 0
+
+        if db_path:
+            os.makedirs(os.path.dirname(os.path.abspath(db_path)), exist_ok=True)
+            self._db = sqlite3.connect(db_path, check_same_thread=False)
+            self._db.execute(
+                "CREATE TABLE IF NOT EXISTS predictions ("
+                "key TEXT PRIMARY KEY, model_version TEXT NOT NULL, "
+                "scores TEXT NOT NULL, created_at REAL NOT NULL)"
+            )
+            # Results from other model versions can never be served again
+            self._db.execute("DELETE FROM predictions WHERE model_version != ?", (model_version,))
+            self._db.commit()
+            self._writes = queue.Queue(maxsize=10000)
+            self._writer = threading.Thread(target=self._run_writer, name="prediction-cache-writer", daemon=True)
+            self._writer.start()
+
+    def key_for(self, contents: bytes, model_version: Optional[str] = None) -> str:
+        """Build the cache key for uploaded image bytes under a model version (default: the live one)."""
+        return f"{model_version or self.model_version}:{hashlib.sha256(contents).hexdigest()}"
+
+    def _expired(self, created_at: float) -> bool:
+        return self.ttl > 0 and time.time() - created_at > self.ttl
+
+    def _get_memory(self, key: str) -> Optional[List[float]]:
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            scores, created_at = entry
+            if not self._expired(created_at):
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return scores
+            del self._entries[key]
+            self.expirations += 1
+            return None
+
+    def _get_disk(self, keys: List[str]) -> List[Optional[List[float]]]:
+        """Blocking: look keys up in the SQLite tier (promoting hits to memory) and count misses."""
+        results = []
+        for key in keys:
+            row = None
+            if self._db is not None:
+                with self._db_lock:
+                    row = self._db.execute(
+                        "SELECT scores, created_at FROM predictions WHERE key = ?", (key,)
+                    ).fetchone()
+            scores = None
+            with self._lock:
+                if row is not None and not self._expired(row[1]):
+                    scores = json.loads(row[0])
+                    self._store_memory(key, scores, row[1])
+                    self.disk_hits += 1
+                else:
+                    if row is not None:
+                        self.expirations += 1
+                    self.misses += 1
+            if row is not None and scores is None:
+                self._write("DELETE FROM predictions WHERE key = ?", (key,))
+            results.append(scores)
+        return results
+
+    def get(self, key: str) -> Optional[List[float]]:
+        """Return cached scores for `key`, or None on a miss (blocking; see lookup())."""
+        scores = self._get_memory(key)
+        return scores if scores is not None else self._get_disk([key])[0]
+
+    async def lookup(self, keys: List[str]) -> List[Optional[List[float]]]:
+        """
+        Cached scores (or None) for each key. The memory tier is checked on the
+        event loop; misses go to the SQLite tier in one executor call.
+        """
+        results = [self._get_memory(key) for key in keys]
+        missing = [i for i, scores in enumerate(results) if scores is None]
+        if not missing:
+            return results
+        if self._db is None:
+            with self._lock:
+                self.misses += len(missing)
+            return results
+        loop = asyncio.get_running_loop()
+        found = await loop.run_in_executor(None, self._get_disk, [keys[i] for i in missing])
+        for i, scores in zip(missing, found):
+            results[i] = scores
+        return results
+
+    def put(self, key: str, scores: List[float]):
+        """Store scores for `key` in memory now and in SQLite from the writer thread."""
+        created_at = time.time()
+        with self._lock:
+            self._store_memory(key, scores, created_at)
+        self._write(
+            "INSERT OR REPLACE INTO predictions (key, model_version, scores, created_at) VALUES (?, ?, ?, ?)",
+            (key, key.rpartition(":")[0], json.dumps(scores), created_at)
+        )
+
+    def _write(self, sql: str, params: tuple = ()):
+        if self._writes is None:
+            return
+        try:
+            self._writes.put_nowait((sql, params))
+        except queue.Full:
+            # The disk tier is best effort; the memory tier already has the entry
+            self.dropped_writes += 1
+
+    def _run_writer(self):
+        while True:
+            batch = [self._writes.get()]
+            while len(batch) < 256:
+                try:
+                    batch.append(self._writes.get_nowait())
+                except queue.Empty:
+                    break
+            stop = None in batch
+            with self._db_lock:
+                if self._db is None:
+                    return
+                try:
+                    for write in batch:
+                        if write is not None:
+                            self._db.execute(*write)
+                    self._db.commit()
+                except sqlite3.Error as e:
+                    print(f"Prediction cache write failed: {e}")
+            if stop:
+                return
+
+    def _store_memory(self, key: str, scores: List[float], created_at: float):
+        if self.max_entries == 0:
+            return
+        self._entries[key] = (scores, created_at)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+            self.evictions += 1
+
+    def invalidate(self, model_version: Optional[str] = None):
+        """
+        Drop every cached result. If a new model version is given, future keys
+        are built with it and persisted results of older versions are purged.
+        """
+        with self._lock:
+            if model_version is not None:
+                self.model_version = model_version
+            self._entries.clear()
+        # Queued after any pending inserts, so those are purged too
+        self._write("DELETE FROM predictions")
+
+    def close(self):
+        """Flush pending writes and close the SQLite tier."""
+        if self._writer is not None:
+            self._writes.put(None)
+            self._writer.join(timeout=10)
+            self._writer = None
+        with self._db_lock:
+            if self._db is not None:
+                self._db.close()
+                self._db = None
+
+    def get_stats(self) -> Dict:
+        """Return hit/miss/eviction counters and tier sizes."""
+        disk_entries = None
+        with self._db_lock:
+            if self._db is not None:
+                disk_entries = self._db.execute("SELECT COUNT(*) FROM predictions").fetchone()[0]
+        with self._lock:
+            lookups = self.hits + self.disk_hits + self.misses
+            return {
+                "model_version": self.model_version,
+                "memory_entries": len(self._entries),
+                "max_entries": self.max_entries,
+                "ttl_seconds": self.ttl,
+                "disk_entries": disk_entries,
+                "hits": self.hits,
+                "disk_hits": self.disk_hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "expirations": self.expirations,
+                "dropped_writes": self.dropped_writes,
+                "hit_rate": round((self.hits + self.disk_hits) / lookups, 4) if lookups else 0.0,
+            }
@@ -0,0 +1,225 @@
+"""
+Shared image preprocessing for the API, the training script and the Gradio demo.
+Decodes uploads to the model's BGR uint8 input, using reduced-resolution JPEG
+decoding where possible and writing straight into caller-provided buffers.
+"""
+
+import io
+import os
+import struct
+import threading
+from typing import List, Optional, Tuple
+
+import cv2
+import numpy as np
+
+try:
+    import pydicom
+except ImportError:
+    pydicom = None
+
+# Upload limits, enforced before any full-resolution decode
+MAX_UPLOAD_BYTES = int(os.getenv("MAX_UPLOAD_BYTES", str(20 * 1024 * 1024)))
+MAX_IMAGE_PIXELS = int(os.getenv("MAX_IMAGE_PIXELS", str(50_000_000)))
+
+# Decode JPEGs at 1/2, 1/4 or 1/8 scale (DCT scaling) when still larger than the target
+REDUCED_DECODE = os.getenv("PREPROCESS_REDUCED_DECODE", "1") != "0"
+
+_PNG_SIGNATURE = b"\x89PNG\r\n\x1a\n"
+_JPEG_SOF_MARKERS = {0xC0, 0xC1, 0xC2, 0xC3, 0xC5, 0xC6, 0xC7, 0xC9, 0xCA, 0xCB, 0xCD, 0xCE, 0xCF}
+_REDUCED_COLOR = {2: cv2.IMREAD_REDUCED_COLOR_2, 4: cv2.IMREAD_REDUCED_COLOR_4, 8: cv2.IMREAD_REDUCED_COLOR_8}
+_REDUCED_GRAY = {2: cv2.IMREAD_REDUCED_GRAYSCALE_2, 4: cv2.IMREAD_REDUCED_GRAYSCALE_4, 8: cv2.IMREAD_REDUCED_GRAYSCALE_8}
+
+
+class ImageTooLargeError(ValueError):
+    """Raised when an upload exceeds the byte or pixel limits."""
+
+
+def read_image_header(contents: bytes) -> Optional[Tuple[str, int, int, int]]:
+    """
+    Read the format and dimensions of a PNG or JPEG without decoding it.
+
+    Returns:
+        (format, width, height, channels) or None for other/unknown formats.
+        For PNG, channels is negative when the image is 16-bit.
+    """
+    if contents[:8] == _PNG_SIGNATURE and len(contents) >= 26:
+        width, height = struct.unpack(">II", contents[16:24])
+        bit_depth, color_type = contents[24], contents[25]
+        channels = {0: 1, 2: 3, 3: 3, 4: 2, 6: 4}.get(color_type, 3)
+        return "png", width, height, -channels if bit_depth == 16 else channels
+
+    if contents[:2] == b"\xff\xd8":
+        pos = 2
+        while pos + 4 <= len(contents):
+            if contents[pos] != 0xFF:
+                pos += 1
+                continue
+            marker = contents[pos + 1]
+            if marker == 0xFF:
+                pos += 1
+                continue
+            if marker in (0xD8, 0x01) or 0xD0 <= marker <= 0xD7:
+                pos += 2
+                continue
+            length = struct.unpack(">H", contents[pos + 2:pos + 4])[0]
+            if marker in _JPEG_SOF_MARKERS and pos + 10 <= len(contents):
+                height, width = struct.unpack(">HH", contents[pos + 5:pos + 9])
+                return "jpeg", width, height, contents[pos + 9]
+            pos += 2 + length
+    return None
+
+
+def is_dicom(contents: bytes) -> bool:
+    return contents[128:132] == b"DICM"
+
+
+def _check_pixels(width: int, height: int):
+    if width * height > MAX_IMAGE_PIXELS:
+        raise ImageTooLargeError(f"Image is {width}x{height}, above the {MAX_IMAGE_PIXELS} pixel limit")
+
+
+def _to_uint8(img: np.ndarray) -> np.ndarray:
+    """Min-max scale 16-bit/float scanner intensities to uint8."""
+    if img.dtype == np.uint8:
+        return img
+    img = img.astype(np.float32, copy=False)
+    low, high = float(img.min()), float(img.max())
+    scale = 255.0 / (high - low) if high > low else 0.0
+    return cv2.convertScaleAbs(img, alpha=scale, beta=-low * scale)
+
+
+def _decode_dicom(contents: bytes) -> np.ndarray:
+    if pydicom is None:
+        raise ValueError("DICOM uploads require the pydicom package")
+    dataset = pydicom.dcmread(io.BytesIO(contents))
+    pixels = dataset.pixel_array
+    if pixels.ndim == 4 or (pixels.ndim == 3 and pixels.shape[-1] not in (3, 4)):
+        pixels = pixels[0]  # first frame of a multi-frame series
+    if pixels.ndim == 3:
+        pixels = cv2.cvtColor(_to_uint8(pixels), cv2.COLOR_RGB2BGR)
+    return pixels
+
+
+def decode_image(contents: bytes, image_size: int) -> np.ndarray:
+    """Decode bytes to a uint8 image with 1, 3 or 4 channels, as small as allowed."""
+    if len(contents) > MAX_UPLOAD_BYTES:
+        raise ImageTooLargeError(f"Upload is {len(contents)} bytes, above the {MAX_UPLOAD_BYTES} byte limit")
+
+    if is_dicom(contents):
+        img = _decode_dicom(contents)
+        _check_pixels(img.shape[1], img.shape[0])
+        return _to_uint8(img)
+
+    nparr = np.frombuffer(contents, np.uint8)
+    header = read_image_header(contents)
+    if header is not None:
+        fmt, width, height, channels = header
+        _check_pixels(width, height)
+        if fmt == "jpeg":
+            factor = 1
+            if REDUCED_DECODE:
+                for candidate in (8, 4, 2):
+                    if min(width, height) // candidate >= image_size:
+                        factor = candidate
+                        break
+            gray = channels == 1
+            if factor == 1:
+                flag = cv2.IMREAD_GRAYSCALE if gray else cv2.IMREAD_COLOR
+            else:
+                flag = (_REDUCED_GRAY if gray else _REDUCED_COLOR)[factor]
+            img = cv2.imdecode(nparr, flag)
+        elif channels in (1, 2, 3):
+            # 8-bit gray/BGR PNGs decode directly, without expanding gray to 3 channels
+            img = cv2.imdecode(nparr, cv2.IMREAD_COLOR if channels == 3 else cv2.IMREAD_GRAYSCALE)
+        else:
+            img = cv2.imdecode(nparr, cv2.IMREAD_UNCHANGED)
+    else:
+        img = cv2.imdecode(nparr, cv2.IMREAD_UNCHANGED)
+        if img is not None:
+            _check_pixels(img.shape[1], img.shape[0])
+
+    if img is None:
+        raise ValueError("Could not decode image data")
+    return _to_uint8(img)
+
+
+def preprocess_array(img: np.ndarray, image_size: int, out: Optional[np.ndarray] = None) -> np.ndarray:
+    """
+    Resize an already decoded BGR/grayscale image to the model input.
+
+    Args:
+        img: Decoded image (H, W), (H, W, 1), (H, W, 3) or (H, W, 4); any depth
+        image_size: Square output size
+        out: Optional (image_size, image_size, 3) uint8 array to write into
+
+    Returns:
+        The (image_size, image_size, 3) uint8 BGR image (`out` if given)
+    """
+    if out is None:
+        out = np.empty((image_size, image_size, 3), dtype=np.uint8)
+    img = _to_uint8(img)
+    if img.ndim == 3 and img.shape[2] in (1, 2):
+        img = img[:, :, 0]
+
+    if img.ndim == 2:
+        # Resize the single channel, then expand to BGR in place
+        resized = cv2.resize(img, (image_size, image_size))
+        cv2.cvtColor(resized, cv2.COLOR_GRAY2BGR, dst=out)
+    elif img.shape[2] == 4:
+        resized = cv2.resize(img, (image_size, image_size))
+        cv2.cvtColor(resized, cv2.COLOR_BGRA2BGR, dst=out)
+    else:
+        cv2.resize(img, (image_size, image_size), dst=out)
+    return out
+
+
+def preprocess_image(contents: bytes, image_size: int, out: Optional[np.ndarray] = None) -> np.ndarray:
+    """
+    Decode uploaded bytes (JPEG, PNG, TIFF, DICOM, ...) to the model input.
+
+    Args:
+        contents: Raw file bytes
+        image_size: Square output size
+        out: Optional (image_size, image_size, 3) uint8 array to write into,
+             e.g. a row of a preallocated batch buffer
+
+    Returns:
+        The (image_size, image_size, 3) uint8 BGR image (`out` if given)
+
+    Raises:
+        ImageTooLargeError: If the upload exceeds MAX_UPLOAD_BYTES or MAX_IMAGE_PIXELS
+        ValueError: If the bytes cannot be decoded
+    """
+    return preprocess_array(decode_image(contents, image_size), image_size, out=out)
+
+
+def preprocess_file(path: str, image_size: int, out: Optional[np.ndarray] = None) -> np.ndarray:
+    """Read and preprocess an image file from disk."""
+    with open(path, "rb") as f:
+        return preprocess_image(f.read(), image_size, out=out)
+
+
+class BatchBuffers:
+    """
+    Pool of preallocated (max_batch_size, size, size, 3) uint8 batch buffers,
+    reused across requests instead of allocating a new batch array per call.
+    """
+
+    def __init__(self, max_batch_size: int, image_size: int, count: int = 1):
+        self.shape = (max_batch_size, image_size, image_size, 3)
+        self._free: List[np.ndarray] = [np.empty(self.shape, dtype=np.uint8) for _ in range(count)]
+        self._lock = threading.Lock()
+        self.allocated = count
+
+    def acquire(self) -> np.ndarray:
+        """Take a free buffer, allocating a new one if all are in use."""
+        with self._lock:
+            if self._free:
+                return self._free.pop()
+            self.allocated += 1
+        return np.empty(self.shape, dtype=np.uint8)
+
+    def release(self, buffer: np.ndarray):
+        with self._lock:
+            self._free.append(buffer)
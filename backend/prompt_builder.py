@@ -0,0 +1,244 @@
+"""
+Token-budgeted prompt assembly for the chatbot.
+Counts tokens locally, keeps the system + scan-context prefix byte-identical
+(and cached) per prediction so upstream prompt caching can reuse it, and fits
+the conversation history into what is left of the input budget, replacing the
+oldest turns with a short summary when they no longer fit.
+"""
+
+import math
+import re
+from collections import OrderedDict
+from typing import Callable, Dict, List, Optional, Tuple
+
+try:
+    import tiktoken
+except ImportError:
+    tiktoken = None
+
+# Chat formatting overhead per message (role markers, separators)
+MESSAGE_OVERHEAD = 4
+
+_PIECES = re.compile(r"\d+|[^\W\d]+|[^\w\s]+", re.UNICODE)
+
+
+def _estimate_piece(piece: str) -> int:
+    """BPE-like cost of one piece: digits in threes, words per 8 characters, symbols in pairs."""
+    if piece[0].isdigit():
+        return math.ceil(len(piece) / 3)
+    if piece[0].isalpha() or piece[0] == "_":
+        return 1 + (len(piece) - 1) // 8
+    return math.ceil(len(piece) / 2)
+
+
+class Tokenizer:
+    """
+    Local token counter. Uses tiktoken's cl100k_base when installed (close to
+    Llama 3's BPE), else a heuristic that errs slightly high for English text.
+    """
+
+    def __init__(self, kind: str = "auto"):
+        self.encoding = None
+        if kind in ("auto", "tiktoken") and tiktoken is not None:
+            self.encoding = tiktoken.get_encoding("cl100k_base")
+        elif kind == "tiktoken":
+            raise ImportError("CHAT_TOKENIZER=tiktoken requires tiktoken (pip install tiktoken)")
+        self.name = "tiktoken:cl100k_base" if self.encoding is not None else "heuristic"
+
+    def count(self, text: str) -> int:
+        if self.encoding is not None:
+            return len(self.encoding.encode(text, disallowed_special=()))
+        return sum(_estimate_piece(piece) for piece in _PIECES.findall(text))
+
+    def count_messages(self, messages: List[Dict]) -> int:
+        return sum(self.count(message["content"]) + MESSAGE_OVERHEAD for message in messages)
+
+    def truncate(self, text: str, max_tokens: int) -> str:
+        """Cut text to at most `max_tokens`, keeping the beginning."""
+        if self.count(text) <= max_tokens:
+            return text
+        if self.encoding is not None:
+            return self.encoding.decode(self.encoding.encode(text, disallowed_special=())[:max_tokens])
+        # Binary search on characters for the heuristic counter
+        low, high = 0, len(text)
+        while low < high:
+            middle = (low + high + 1) // 2
+            if self.count(text[:middle]) <= max_tokens:
+                low = middle
+            else:
+                high = middle - 1
+        return text[:low]
+
+
+def _first_sentence(text: str, limit: int = 120) -> str:
+    sentence = re.split(r"(?<=[.?!])\s", text.strip(), maxsplit=1)[0]
+    return sentence if len(sentence) <= limit else sentence[:limit].rstrip() + "..."
+
+
+class PromptBuilder:
+    """Builds Groq chat messages within a token budget."""
+
+    def __init__(
+        self,
+        system_prompt: str,
+        context_prompt: Callable[[Optional[Dict]], str],
+        tokenizer: Tokenizer,
+        input_budget: int = 3000,
+        max_user_tokens: int = 1000,
+        summary_tokens: int = 150,
+        max_history_messages: int = 20,
+        prefix_cache_size: int = 256
+    ):
+        """
+        Args:
+            system_prompt: Static instructions, always sent first
+            context_prompt: Renders the scan context into a system message
+            tokenizer: Local token counter
+            input_budget: Maximum input tokens per request (prefix + history + user message)
+            max_user_tokens: Longer user messages are truncated
+            summary_tokens: Budget for the summary of dropped turns (0 just drops them)
+            max_history_messages: History messages considered at most
+            prefix_cache_size: Cached prefixes (one per distinct scan context)
+        """
+        self.system_prompt = system_prompt
+        self.context_prompt = context_prompt
+        self.tokenizer = tokenizer
+        self.input_budget = input_budget
+        self.max_user_tokens = max_user_tokens
+        self.summary_tokens = summary_tokens
+        self.max_history_messages = max_history_messages
+        self.prefix_cache_size = prefix_cache_size
+        self._prefixes = OrderedDict()
+        self.prefix_hits = 0
+        self.prefix_misses = 0
+
+    @staticmethod
+    def _context_key(context: Optional[Dict]) -> Tuple:
+        if not context:
+            return ()
+        return (
+            context.get("prediction", ""),
+            context.get("confidence", 0),
+            tuple(context.get("all_scores") or ()),
+        )
+
+    def prefix(self, context: Optional[Dict]) -> Tuple[List[Dict], str, int]:
+        """
+        System + context messages for a scan context, built once per distinct
+        context: (messages, context prompt text, token count).
+        """
+        key = self._context_key(context)
+        cached = self._prefixes.get(key)
+        if cached is not None:
+            self._prefixes.move_to_end(key)
+            self.prefix_hits += 1
+            return cached
+
+        self.prefix_misses += 1
+        messages = [{"role": "system", "content": self.system_prompt}]
+        context_text = self.context_prompt(context) if context else ""
+        if context_text:
+            messages.append({"role": "system", "content": context_text})
+        cached = (messages, context_text, self.tokenizer.count_messages(messages))
+        self._prefixes[key] = cached
+        while len(self._prefixes) > self.prefix_cache_size:
+            self._prefixes.popitem(last=False)
+        return cached
+
+    def _summarize(self, dropped: List[Dict], budget: int) -> Optional[Dict]:
+        """
+        Extractive summary of dropped turns: the first sentence of each user
+        question, the most recent ones first to go in when the budget is short.
+        """
+        lead = "Earlier in this conversation the user asked: "
+        remaining = budget - MESSAGE_OVERHEAD - self.tokenizer.count(lead)
+        questions = []
+        for message in reversed(dropped):
+            if message["role"] != "user":
+                continue
+            question = _first_sentence(message["content"])
+            tokens = self.tokenizer.count(question) + 1
+            if tokens > remaining:
+                break
+            questions.append(question)
+            remaining -= tokens
+        if not questions:
+            return None
+        return {"role": "system", "content": lead + " | ".join(reversed(questions))}
+
+    def build(
+        self,
+        user_message: str,
+        context: Optional[Dict] = None,
+        conversation_history: Optional[List[Dict]] = None
+    ) -> Tuple[List[Dict], Dict]:
+        """
+        Assemble the messages for one request.
+
+        Returns:
+            (messages, token stats: prefix/history/summary/user/input tokens,
+             kept and dropped history messages, whether the user message was truncated)
+        """
+        prefix_messages, _, prefix_tokens = self.prefix(context)
+
+        # The question always fits: capped by the setting and by what the prefix leaves
+        max_user_tokens = max(1, min(self.max_user_tokens, self.input_budget - prefix_tokens - MESSAGE_OVERHEAD))
+        user_tokens = self.tokenizer.count(user_message)
+        truncated = user_tokens > max_user_tokens
+        if truncated:
+            user_message = self.tokenizer.truncate(user_message, max_user_tokens)
+            user_tokens = self.tokenizer.count(user_message)
+        user_tokens += MESSAGE_OVERHEAD
+
+        # Newest turns first, while they fit in what the prefix and question leave
+        history = [
+            {"role": message["role"], "content": message["content"]}
+            for message in conversation_history or []
+        ]
+        cutoff = max(0, len(history) - self.max_history_messages)
+        dropped, history = history[:cutoff], history[cutoff:]
+        available = self.input_budget - prefix_tokens - user_tokens
+        kept: List[Dict] = []
+        history_tokens = 0
+        for index in range(len(history) - 1, -1, -1):
+            tokens = self.tokenizer.count(history[index]["content"]) + MESSAGE_OVERHEAD
+            if history_tokens + tokens > available - (self.summary_tokens if index > 0 else 0):
+                dropped = dropped + history[:index + 1]
+                break
+            kept.append(history[index])
+            history_tokens += tokens
+        kept.reverse()
+        # Never start the kept history with an orphaned assistant reply
+        if kept and kept[0]["role"] == "assistant":
+            dropped.append(kept.pop(0))
+            history_tokens -= self.tokenizer.count(dropped[-1]["content"]) + MESSAGE_OVERHEAD
+
+        summary = self._summarize(dropped, min(self.summary_tokens, available - history_tokens))
+        summary_tokens = self.tokenizer.count_messages([summary]) if summary else 0
+
+        messages = list(prefix_messages)
+        if summary:
+            messages.append(summary)
+        messages.extend(kept)
+        messages.append({"role": "user", "content": user_message})
+
+        return messages, {
+            "tokenizer": self.tokenizer.name,
+            "prefix_tokens": prefix_tokens,
+            "summary_tokens": summary_tokens,
+            "history_tokens": history_tokens,
+            "user_tokens": user_tokens,
+            "input_tokens": prefix_tokens + summary_tokens + history_tokens + user_tokens,
+            "history_kept": len(kept),
+            "history_dropped": len(dropped),
+            "user_truncated": truncated,
+        }
+
+    def get_stats(self) -> Dict:
+        return {
+            "tokenizer": self.tokenizer.name,
+            "input_budget": self.input_budget,
+            "cached_prefixes": len(self._prefixes),
+            "prefix_hits": self.prefix_hits,
+            "prefix_misses": self.prefix_misses,
+        }
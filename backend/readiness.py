@@ -0,0 +1,65 @@
+"""
+Model readiness tracking.
+Records the progress and timings of background model loading and warm-up
+so lightweight endpoints can be served while the model is still starting.
+"""
+
+import threading
+import time
+from typing import Dict, Optional
+
+# Lifecycle states, in order
+STATES = ("pending", "loading", "warming", "ready")
+
+
+class ModelStatus:
+    """Thread-safe load/warm-up progress for the readiness endpoint."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._started_at = time.perf_counter()
+        self.state = "pending"
+        self.error: Optional[str] = None
+        self.timings: Dict[str, float] = {}
+        self.warmup: Dict[str, float] = {}
+        self.warmup_total = 0
+
+    @property
+    def is_ready(self) -> bool:
+        return self.state == "ready"
+
+    def _elapsed(self) -> float:
+        return round(time.perf_counter() - self._started_at, 3)
+
+    def set_state(self, state: str):
+        with self._lock:
+            self.state = state
+            self.timings[f"{state}_at_s"] = self._elapsed()
+
+    def record(self, stage: str, seconds: float):
+        """Record how long a loading stage took."""
+        with self._lock:
+            self.timings[f"{stage}_s"] = round(seconds, 3)
+
+    def record_warmup(self, batch_size: int, seconds: float):
+        with self._lock:
+            self.warmup[str(batch_size)] = round(seconds, 3)
+
+    def fail(self, state: str, error: str):
+        """Mark loading as finished without a usable model ("missing" or "failed")."""
+        with self._lock:
+            self.state = state
+            self.error = error
+            self.timings[f"{state}_at_s"] = self._elapsed()
+
+    def to_dict(self) -> Dict:
+        with self._lock:
+            return {
+                "ready": self.state == "ready",
+                "state": self.state,
+                "error": self.error,
+                "warmup_progress": f"{len(self.warmup)}/{self.warmup_total}",
+                "warmup_s": dict(self.warmup),
+                "timings": dict(self.timings),
+                "uptime_s": self._elapsed(),
+            }
@@ -0,0 +1,125 @@
+"""
+Chatbot response cache.
+Caches LLM answers by normalized question plus scan context prompt, with
+TTL/size eviction and single-flight coalescing of identical in-flight requests.
+"""
+
+import asyncio
+import hashlib
+import re
+import time
+from collections import OrderedDict
+from typing import Awaitable, Callable, Dict, Optional
+
+_WHITESPACE = re.compile(r"\s+")
+_TRAILING_PUNCTUATION = re.compile(r"[\s?!.]+$")
+
+
+def normalize_message(message: str) -> str:
+    """Case-fold, collapse whitespace and drop trailing punctuation."""
+    message = _WHITESPACE.sub(" ", message.strip().lower())
+    return _TRAILING_PUNCTUATION.sub("", message)
+
+
+def make_cache_key(message: str, context_prompt: str) -> str:
+    digest = hashlib.sha256()
+    digest.update(normalize_message(message).encode("utf-8"))
+    digest.update(b"\0")
+    digest.update(context_prompt.encode("utf-8"))
+    return digest.hexdigest()
+
+
+class ChatResponseCache:
+    """LRU + TTL cache of chatbot answers with single-flight upstream calls."""
+
+    def __init__(self, max_entries: int = 512, ttl_seconds: float = 86400.0):
+        self.max_entries = max_entries
+        self.ttl = ttl_seconds
+        self._entries = OrderedDict()
+        self._in_flight: Dict[str, asyncio.Future] = {}
+
+        self.hits = 0
+        self.misses = 0
+        self.coalesced = 0
+        self.evictions = 0
+        self.expirations = 0
+
+    def get(self, key: str) -> Optional[str]:
+        entry = self._entries.get(key)
+        if entry is None:
+            return None
+        response, created_at = entry
+        if self.ttl > 0 and time.time() - created_at > self.ttl:
+            del self._entries[key]
+            self.expirations += 1
+            return None
+        self._entries.move_to_end(key)
+        return response
+
+    def lookup(self, key: str) -> Optional[str]:
+        """Like get(), but counted in the hit/miss statistics."""
+        response = self.get(key)
+        if response is None:
+            self.misses += 1
+        else:
+            self.hits += 1
+        return response
+
+    def put(self, key: str, response: str):
+        if self.max_entries <= 0:
+            return
+        self._entries[key] = (response, time.time())
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+            self.evictions += 1
+
+    async def get_or_compute(self, key: str, compute: Callable[[], Awaitable[str]]) -> str:
+        """
+        Return the cached answer for `key`, or run `compute` once for all
+        concurrent callers with the same key. Failures are not cached.
+        """
+        response = self.get(key)
+        if response is not None:
+            self.hits += 1
+            return response
+
+        in_flight = self._in_flight.get(key)
+        if in_flight is not None:
+            self.coalesced += 1
+            return await asyncio.shield(in_flight)
+
+        self.misses += 1
+        future = asyncio.get_running_loop().create_future()
+        self._in_flight[key] = future
+        try:
+            response = await compute()
+        except asyncio.CancelledError:
+            future.cancel()
+            raise
+        except Exception as e:
+            future.set_exception(e)
+            # Mark the exception as retrieved when nobody else was waiting
+            future.exception()
+            raise
+        else:
+            self.put(key, response)
+            future.set_result(response)
+            return response
+        finally:
+            self._in_flight.pop(key, None)
+
+    def get_stats(self) -> Dict:
+        lookups = self.hits + self.misses + self.coalesced
+        return {
+            "entries": len(self._entries),
+            "max_entries": self.max_entries,
+            "ttl_seconds": self.ttl,
+            "in_flight": len(self._in_flight),
+            "hits": self.hits,
+            "misses": self.misses,
+            "coalesced": self.coalesced,
+            "evictions": self.evictions,
+            "expirations": self.expirations,
+            "hit_rate": round((self.hits + self.coalesced) / lookups, 4) if lookups else 0.0,
+        }
@@ -0,0 +1,218 @@
+"""
+Pluggable model runtimes.
+Wraps the Keras model, an exported ONNX model or a TFLite model behind the same
+`predict_on_batch` interface so the API can pick its inference engine at startup.
+"""
+
+import json
+import os
+import threading
+from typing import Dict, List, Optional
+
+import numpy as np
+
+RUNTIME_BACKENDS = ("tensorflow", "onnx", "tflite")
+
+
+def metadata_path(model_path: str) -> str:
+    """Sidecar JSON written by export_model.py next to an exported model."""
+    return os.path.splitext(model_path)[0] + ".json"
+
+
+def _load_metadata(model_path: str) -> Dict:
+    path = metadata_path(model_path)
+    if os.path.exists(path):
+        with open(path) as f:
+            return json.load(f)
+    return {}
+
+
+class KerasRuntime:
+    """Runs the original `.h5` model with TensorFlow/Keras."""
+
+    backend = "tensorflow"
+    # Gradients are only available through TensorFlow
+    supports_gradcam = True
+
+    def __init__(self, model_path: str):
+        from tensorflow.keras.models import load_model
+        self.path = model_path
+        self.keras_model = load_model(model_path)
+        self._gradcam = None
+        self._gradcam_lock = threading.Lock()
+
+    def predict_on_batch(self, batch: np.ndarray) -> np.ndarray:
+        return np.asarray(self.keras_model.predict_on_batch(batch))
+
+    def gradcam_on_batch(self, batch: np.ndarray, layer_name: Optional[str] = None):
+        """Scores and Grad-CAM maps for a batch from the same forward pass (see gradcam.py)."""
+        if self._gradcam is None:
+            with self._gradcam_lock:
+                if self._gradcam is None:
+                    from gradcam import GradCam
+                    self._gradcam = GradCam(self.keras_model, layer_name)
+        return self._gradcam(batch)
+
+    def layer_counts(self) -> Dict[str, int]:
+        counts = {}
+        for layer in self.keras_model.layers:
+            l_type = type(layer).__name__
+            counts[l_type] = counts.get(l_type, 0) + 1
+        return counts
+
+    def count_params(self) -> int:
+        return self.keras_model.count_params()
+
+    def layer_table(self) -> List[Dict]:
+        from model_summary import keras_layer_table
+        return keras_layer_table(self.keras_model)
+
+    def input_shape(self) -> List[int]:
+        return [int(dim) for dim in self.keras_model.inputs[0].shape[1:]]
+
+    def bytes_per_element(self) -> int:
+        return 4
+
+
+class OnnxRuntime:
+    """Runs an exported `.onnx` model with ONNX Runtime on the CPU."""
+
+    backend = "onnx"
+    supports_gradcam = False
+
+    def __init__(self, model_path: str, num_threads: int = 0):
+        try:
+            import onnxruntime as ort
+        except ImportError:
+            raise ImportError("The onnx backend requires onnxruntime (pip install onnxruntime)")
+
+        options = ort.SessionOptions()
+        options.graph_optimization_level = ort.GraphOptimizationLevel.ORT_ENABLE_ALL
+        if num_threads:
+            options.intra_op_num_threads = num_threads
+
+        self.path = model_path
+        self.session = ort.InferenceSession(model_path, sess_options=options, providers=["CPUExecutionProvider"])
+        self.input_name = self.session.get_inputs()[0].name
+        self.metadata = _load_metadata(model_path)
+
+    def predict_on_batch(self, batch: np.ndarray) -> np.ndarray:
+        inputs = np.ascontiguousarray(batch, dtype=np.float32)
+        return self.session.run(None, {self.input_name: inputs})[0]
+
+    def input_shape(self) -> List[int]:
+        return self.metadata.get("input_shape") or list(self.session.get_inputs()[0].shape[1:])
+
+    def bytes_per_element(self) -> int:
+        return 4
+
+    def layer_counts(self) -> Dict[str, int]:
+        return dict(self.metadata.get("layer_counts", {}))
+
+    def count_params(self) -> int:
+        return int(self.metadata.get("params", 0))
+
+    def layer_table(self) -> List[Dict]:
+        return list(self.metadata.get("layers", []))
+
+
+class TFLiteRuntime:
+    """
+    Runs a `.tflite` model (float32, float16 or int8 quantized) with the
+    standalone tflite_runtime interpreter when installed, else tf.lite.
+    """
+
+    backend = "tflite"
+    supports_gradcam = False
+
+    def __init__(self, model_path: str, num_threads: int = 0):
+        try:
+            from tflite_runtime.interpreter import Interpreter
+        except ImportError:
+            from tensorflow.lite import Interpreter
+
+        self.path = model_path
+        self.interpreter = Interpreter(model_path=model_path, num_threads=num_threads or None)
+        self.interpreter.allocate_tensors()
+        self.input_detail = self.interpreter.get_input_details()[0]
+        self.output_detail = self.interpreter.get_output_details()[0]
+        self.metadata = _load_metadata(model_path)
+        self._batch_size = int(self.input_detail["shape"][0])
+        # The interpreter holds per-invocation state and is not thread-safe
+        self._lock = threading.Lock()
+
+    def _quantize(self, batch: np.ndarray) -> np.ndarray:
+        dtype = self.input_detail["dtype"]
+        scale, zero_point = self.input_detail["quantization"]
+        if np.issubdtype(dtype, np.integer) and scale:
+            info = np.iinfo(dtype)
+            quantized = np.round(batch.astype(np.float32) / scale + zero_point)
+            return np.clip(quantized, info.min, info.max).astype(dtype)
+        return batch.astype(dtype, copy=False)
+
+    def _dequantize(self, output: np.ndarray) -> np.ndarray:
+        scale, zero_point = self.output_detail["quantization"]
+        if np.issubdtype(output.dtype, np.integer) and scale:
+            return (output.astype(np.float32) - zero_point) * scale
+        return output
+
+    def predict_on_batch(self, batch: np.ndarray) -> np.ndarray:
+        with self._lock:
+            if len(batch) != self._batch_size:
+                shape = [len(batch)] + list(self.input_detail["shape"][1:])
+                self.interpreter.resize_tensor_input(self.input_detail["index"], shape)
+                self.interpreter.allocate_tensors()
+                self.input_detail = self.interpreter.get_input_details()[0]
+                self.output_detail = self.interpreter.get_output_details()[0]
+                self._batch_size = len(batch)
+            self.interpreter.set_tensor(self.input_detail["index"], self._quantize(batch))
+            self.interpreter.invoke()
+            output = self.interpreter.get_tensor(self.output_detail["index"])
+        return self._dequantize(output)
+
+    def input_shape(self) -> List[int]:
+        return [int(dim) for dim in self.input_detail["shape"][1:]]
+
+    def bytes_per_element(self) -> int:
+        # Fully int8-quantized models keep int8 activations
+        return np.dtype(self.input_detail["dtype"]).itemsize
+
+    def layer_counts(self) -> Dict[str, int]:
+        return dict(self.metadata.get("layer_counts", {}))
+
+    def count_params(self) -> int:
+        return int(self.metadata.get("params", 0))
+
+    def layer_table(self) -> List[Dict]:
+        return list(self.metadata.get("layers", []))
+
+
+def load_runtime(backend: str, model_path: str, num_threads: int = 0):
+    """
+    Load a model with the requested runtime.
+
+    Args:
+        backend: One of "tensorflow", "onnx" or "tflite"
+        model_path: Path to the `.h5`, `.onnx` or `.tflite` file
+        num_threads: Intra-op threads for ONNX Runtime/TFLite (0 = runtime default)
+
+    Returns:
+        A runtime exposing predict_on_batch, layer_counts and count_params
+    """
+    if backend == "tensorflow":
+        return KerasRuntime(model_path)
+    if backend == "onnx":
+        return OnnxRuntime(model_path, num_threads=num_threads)
+    if backend == "tflite":
+        return TFLiteRuntime(model_path, num_threads=num_threads)
+    raise ValueError(f"Unknown model backend '{backend}', expected one of {RUNTIME_BACKENDS}")
+
+
+def default_runtime_path(backend: str, keras_path: str, variant: Optional[str] = None) -> str:
+    """Path of the exported artifact for `backend` next to the Keras model."""
+    base = os.path.splitext(keras_path)[0]
+    if backend == "onnx":
+        return base + ".onnx"
+    if backend == "tflite":
+        return base + (f"_{variant}" if variant else "") + ".tflite"
+    return keras_path
@@ -0,0 +1,334 @@
+"""
+Chat session storage.
+Bounded in-process LRU store with idle expiry, plus SQLite and Redis backends
+that let several uvicorn workers share conversation history.
+"""
+
+import json
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from typing import Dict, List, Optional
+
+try:
+    import redis
+except ImportError:
+    redis = None
+
+SESSION_BACKENDS = ("memory", "sqlite", "redis")
+
+
+def _message_bytes(messages: List[Dict]) -> int:
+    """Approximate memory footprint of a message list."""
+    return sum(len(m.get("content", "").encode("utf-8")) + len(m.get("role", "")) + 64 for m in messages)
+
+
+class MemorySessionStore:
+    """
+    In-process session store, evicting least recently used sessions beyond
+    `max_sessions` or `max_bytes`, and expiring sessions idle for `idle_ttl`.
+    """
+
+    backend = "memory"
+
+    def __init__(
+        self,
+        max_sessions: int = 10000,
+        max_bytes: int = 64 * 1024 * 1024,
+        idle_ttl: float = 3600.0,
+        max_messages: int = 20
+    ):
+        self.max_sessions = max_sessions
+        self.max_bytes = max_bytes
+        self.idle_ttl = idle_ttl
+        self.max_messages = max_messages
+
+        # session_id -> (messages, size in bytes, last access)
+        self._sessions = OrderedDict()
+        self._lock = threading.Lock()
+        self.total_bytes = 0
+        self.evictions = 0
+        self.expirations = 0
+
+    def _drop(self, session_id: str):
+        _, size, _ = self._sessions.pop(session_id)
+        self.total_bytes -= size
+
+    def _expire_idle(self, now: float):
+        # Sessions are kept in access order, so idle ones are at the front
+        while self._sessions and self.idle_ttl > 0:
+            session_id, (_, _, last_access) = next(iter(self._sessions.items()))
+            if now - last_access <= self.idle_ttl:
+                break
+            self._drop(session_id)
+            self.expirations += 1
+
+    def get(self, session_id: str) -> List[Dict]:
+        """Return a copy of the session's messages ([] for unknown sessions)."""
+        now = time.time()
+        with self._lock:
+            self._expire_idle(now)
+            entry = self._sessions.get(session_id)
+            if entry is None:
+                return []
+            messages, size, _ = entry
+            self._sessions[session_id] = (messages, size, now)
+            self._sessions.move_to_end(session_id)
+            return list(messages)
+
+    def append(self, session_id: str, messages: List[Dict]):
+        """Append messages to a session, keeping only the last `max_messages`."""
+        now = time.time()
+        with self._lock:
+            self._expire_idle(now)
+            history = []
+            if session_id in self._sessions:
+                history = self._sessions[session_id][0]
+                self._drop(session_id)
+            history = (history + list(messages))[-self.max_messages:]
+            size = _message_bytes(history)
+            self._sessions[session_id] = (history, size, now)
+            self.total_bytes += size
+
+            while self._sessions and (
+                len(self._sessions) > self.max_sessions or self.total_bytes > self.max_bytes
+            ):
+                oldest = next(iter(self._sessions))
+                if oldest == session_id and len(self._sessions) == 1:
+                    break
+                self._drop(oldest)
+                self.evictions += 1
+
+    def delete(self, session_id: str):
+        with self._lock:
+            if session_id in self._sessions:
+                self._drop(session_id)
+
+    def get_stats(self) -> Dict:
+        with self._lock:
+            self._expire_idle(time.time())
+            return {
+                "backend": self.backend,
+                "live_sessions": len(self._sessions),
+                "max_sessions": self.max_sessions,
+                "memory_bytes": self.total_bytes,
+                "max_bytes": self.max_bytes,
+                "idle_ttl_seconds": self.idle_ttl,
+                "evictions": self.evictions,
+                "expirations": self.expirations,
+            }
+
+
+class SQLiteSessionStore:
+    """Session store in a SQLite file, shared by every worker on the host."""
+
+    backend = "sqlite"
+
+    def __init__(self, db_path: str, max_sessions: int = 10000, idle_ttl: float = 3600.0, max_messages: int = 20):
+        self.db_path = db_path
+        self.max_sessions = max_sessions
+        self.idle_ttl = idle_ttl
+        self.max_messages = max_messages
+        self.evictions = 0
+        self.expirations = 0
+
+        os.makedirs(os.path.dirname(os.path.abspath(db_path)), exist_ok=True)
+        self._lock = threading.Lock()
+        # Autocommit mode; append() manages its own transaction
+        self._db = sqlite3.connect(db_path, check_same_thread=False, timeout=10, isolation_level=None)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute(
+            "CREATE TABLE IF NOT EXISTS chat_sessions ("
+            "session_id TEXT PRIMARY KEY, messages TEXT NOT NULL, "
+            "size INTEGER NOT NULL, last_access REAL NOT NULL)"
+        )
+        self._db.execute("CREATE INDEX IF NOT EXISTS chat_sessions_last_access ON chat_sessions (last_access)")
+
+    def _expire_idle(self, now: float):
+        if self.idle_ttl > 0:
+            cursor = self._db.execute("DELETE FROM chat_sessions WHERE last_access < ?", (now - self.idle_ttl,))
+            self.expirations += cursor.rowcount
+
+    def get(self, session_id: str) -> List[Dict]:
+        now = time.time()
+        with self._lock:
+            row = self._db.execute(
+                "SELECT messages, last_access FROM chat_sessions WHERE session_id = ?", (session_id,)
+            ).fetchone()
+            if row is None or (self.idle_ttl > 0 and now - row[1] > self.idle_ttl):
+                return []
+            self._db.execute("UPDATE chat_sessions SET last_access = ? WHERE session_id = ?", (now, session_id))
+            return json.loads(row[0])
+
+    def append(self, session_id: str, messages: List[Dict]):
+        now = time.time()
+        with self._lock:
+            # BEGIN IMMEDIATE serializes read-modify-write across worker processes
+            self._db.execute("BEGIN IMMEDIATE")
+            try:
+                row = self._db.execute(
+                    "SELECT messages FROM chat_sessions WHERE session_id = ?", (session_id,)
+                ).fetchone()
+                history = json.loads(row[0]) if row else []
+                history = (history + list(messages))[-self.max_messages:]
+                self._db.execute(
+                    "INSERT OR REPLACE INTO chat_sessions (session_id, messages, size, last_access) VALUES (?, ?, ?, ?)",
+                    (session_id, json.dumps(history), _message_bytes(history), now)
+                )
+                self._expire_idle(now)
+                cursor = self._db.execute(
+                    "DELETE FROM chat_sessions WHERE session_id IN ("
+                    "SELECT session_id FROM chat_sessions ORDER BY last_access DESC LIMIT -1 OFFSET ?)",
+                    (self.max_sessions,)
+                )
+                self.evictions += cursor.rowcount
+                self._db.execute("COMMIT")
+            except Exception:
+                self._db.execute("ROLLBACK")
+                raise
+
+    def delete(self, session_id: str):
+        with self._lock:
+            self._db.execute("DELETE FROM chat_sessions WHERE session_id = ?", (session_id,))
+
+    def get_stats(self) -> Dict:
+        with self._lock:
+            count, total = self._db.execute(
+                "SELECT COUNT(*), COALESCE(SUM(size), 0) FROM chat_sessions WHERE last_access >= ?",
+                (time.time() - self.idle_ttl if self.idle_ttl > 0 else 0,)
+            ).fetchone()
+            return {
+                "backend": self.backend,
+                "live_sessions": count,
+                "max_sessions": self.max_sessions,
+                "memory_bytes": total,
+                "idle_ttl_seconds": self.idle_ttl,
+                "evictions": self.evictions,
+                "expirations": self.expirations,
+            }
+
+
+class RedisSessionStore:
+    """
+    Session store in Redis, shared across hosts. Idle expiry uses key TTLs;
+    a sorted set of last access times bounds the session count and keeps
+    live/byte/eviction figures without scanning the keyspace.
+    Any redis-py compatible client works (e.g. fakeredis as a local stand-in).
+    """
+
+    backend = "redis"
+    KEY_PREFIX = "chat:session:"
+    INDEX_KEY = "chat:sessions:last_access"
+    SIZES_KEY = "chat:sessions:size"
+    BYTES_KEY = "chat:sessions:bytes"
+    EVICTIONS_KEY = "chat:sessions:evictions"
+    EXPIRATIONS_KEY = "chat:sessions:expirations"
+
+    def __init__(self, url: str = None, client=None, max_sessions: int = 10000, idle_ttl: float = 3600.0,
+                 max_messages: int = 20):
+        if client is None:
+            if redis is None:
+                raise ImportError("The redis session store requires the redis package (pip install redis)")
+            client = redis.Redis.from_url(url)
+        self.client = client
+        self.max_sessions = max_sessions
+        self.idle_ttl = idle_ttl
+        self.max_messages = max_messages
+
+    def _key(self, session_id: str) -> str:
+        return self.KEY_PREFIX + session_id
+
+    def _drop(self, session_ids: List, counter: Optional[str] = None):
+        for session_id in session_ids:
+            session_id = session_id.decode() if isinstance(session_id, bytes) else session_id
+            # Only the worker whose ZREM succeeds accounts for the session
+            if not self.client.zrem(self.INDEX_KEY, session_id):
+                continue
+            size = int(self.client.hget(self.SIZES_KEY, session_id) or 0)
+            pipe = self.client.pipeline()
+            pipe.delete(self._key(session_id))
+            pipe.hdel(self.SIZES_KEY, session_id)
+            pipe.decrby(self.BYTES_KEY, size)
+            if counter:
+                pipe.incr(counter)
+            pipe.execute()
+
+    def _expire_idle(self, now: float):
+        if self.idle_ttl > 0:
+            self._drop(self.client.zrangebyscore(self.INDEX_KEY, "-inf", now - self.idle_ttl), self.EXPIRATIONS_KEY)
+
+    def get(self, session_id: str) -> List[Dict]:
+        key = self._key(session_id)
+        raw = self.client.lrange(key, 0, -1)
+        if raw:
+            pipe = self.client.pipeline()
+            if self.idle_ttl > 0:
+                pipe.expire(key, int(self.idle_ttl))
+            pipe.zadd(self.INDEX_KEY, {session_id: time.time()})
+            pipe.execute()
+        return [json.loads(item) for item in raw]
+
+    def append(self, session_id: str, messages: List[Dict]):
+        key = self._key(session_id)
+        now = time.time()
+        pipe = self.client.pipeline()
+        pipe.rpush(key, *[json.dumps(m) for m in messages])
+        pipe.ltrim(key, -self.max_messages, -1)
+        if self.idle_ttl > 0:
+            pipe.expire(key, int(self.idle_ttl))
+        pipe.zadd(self.INDEX_KEY, {session_id: now})
+        pipe.lrange(key, 0, -1)
+        pipe.hget(self.SIZES_KEY, session_id)
+        results = pipe.execute()
+        size = _message_bytes([json.loads(item) for item in results[-2]])
+        pipe = self.client.pipeline()
+        pipe.hset(self.SIZES_KEY, session_id, size)
+        pipe.incrby(self.BYTES_KEY, size - int(results[-1] or 0))
+        pipe.execute()
+
+        self._expire_idle(now)
+        excess = self.client.zcard(self.INDEX_KEY) - self.max_sessions
+        if self.max_sessions > 0 and excess > 0:
+            self._drop(self.client.zrange(self.INDEX_KEY, 0, excess - 1), self.EVICTIONS_KEY)
+
+    def delete(self, session_id: str):
+        self._drop([session_id])
+
+    def get_stats(self) -> Dict:
+        self._expire_idle(time.time())
+        pipe = self.client.pipeline()
+        pipe.zcard(self.INDEX_KEY)
+        pipe.get(self.BYTES_KEY)
+        pipe.get(self.EVICTIONS_KEY)
+        pipe.get(self.EXPIRATIONS_KEY)
+        live, total, evictions, expirations = pipe.execute()
+        return {
+            "backend": self.backend,
+            "live_sessions": live,
+            "max_sessions": self.max_sessions,
+            "memory_bytes": int(total or 0),
+            "idle_ttl_seconds": self.idle_ttl,
+            "evictions": int(evictions or 0),
+            "expirations": int(expirations or 0),
+        }
+
+
+def create_session_store(
+    backend: str = "memory",
+    max_sessions: int = 10000,
+    max_bytes: int = 64 * 1024 * 1024,
+    idle_ttl: float = 3600.0,
+    max_messages: int = 20,
+    db_path: Optional[str] = None,
+    redis_url: Optional[str] = None
+):
+    """Build the session store for `backend` ("memory", "sqlite" or "redis")."""
+    if backend == "memory":
+        return MemorySessionStore(max_sessions, max_bytes, idle_ttl, max_messages)
+    if backend == "sqlite":
+        return SQLiteSessionStore(db_path, max_sessions, idle_ttl, max_messages)
+    if backend == "redis":
+        return RedisSessionStore(redis_url, max_sessions=max_sessions, idle_ttl=idle_ttl, max_messages=max_messages)
+    raise ValueError(f"Unknown session store '{backend}', expected one of {SESSION_BACKENDS}")
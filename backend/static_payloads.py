@@ -0,0 +1,66 @@
+"""
+Precomputed responses for content that never changes at runtime.
+Serializes a payload once, pre-compresses it with gzip (and brotli when
+installed), and serves it with strong ETags and conditional 304s.
+"""
+
+import gzip
+import hashlib
+import json
+from typing import Any, Dict
+
+from fastapi import Request
+from fastapi.responses import Response
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+
+def _accepts(accept_encoding: str, coding: str) -> bool:
+    for part in accept_encoding.split(","):
+        name, _, params = part.strip().partition(";")
+        if name.strip().lower() == coding:
+            return params.replace(" ", "") not in ("q=0", "q=0.0", "q=0.00", "q=0.000")
+    return False
+
+
+class StaticPayload:
+    """One JSON payload in every encoding, with an ETag per representation."""
+
+    def __init__(self, payload: Any, max_age: int = 3600):
+        body = json.dumps(payload, separators=(",", ":"), ensure_ascii=False).encode("utf-8")
+        digest = hashlib.sha256(body).hexdigest()[:32]
+        self.cache_control = f"public, max-age={max_age}"
+
+        # encoding -> (body, ETag); ordered by preference
+        self.representations: Dict[str, tuple] = {}
+        if brotli is not None:
+            self.representations["br"] = (brotli.compress(body, quality=11), f'"{digest}-br"')
+        self.representations["gzip"] = (gzip.compress(body, compresslevel=9, mtime=0), f'"{digest}-gz"')
+        self.representations["identity"] = (body, f'"{digest}"')
+        self._etags = {etag for _, etag in self.representations.values()}
+
+    def response(self, request: Request) -> Response:
+        accept_encoding = request.headers.get("accept-encoding", "")
+        encoding = next(
+            coding for coding in self.representations
+            if coding == "identity" or _accepts(accept_encoding, coding)
+        )
+        body, etag = self.representations[encoding]
+        headers = {"ETag": etag, "Cache-Control": self.cache_control, "Vary": "Accept-Encoding"}
+
+        if_none_match = request.headers.get("if-none-match")
+        if if_none_match and (
+            if_none_match.strip() == "*"
+            or any(tag.strip().removeprefix("W/") in self._etags for tag in if_none_match.split(","))
+        ):
+            return Response(status_code=304, headers=headers)
+
+        if encoding != "identity":
+            headers["Content-Encoding"] = encoding
+        return Response(content=body, media_type="application/json", headers=headers)
+
+    def get_stats(self) -> Dict:
+        return {coding: len(body) for coding, (body, _) in self.representations.items()}
@@ -0,0 +1,453 @@
+"""
+API instrumentation.
+Prometheus-style counters, gauges and latency histograms rendered by /metrics,
+plus optional OpenTelemetry-compatible spans (OTLP/JSON) exported to a local
+file or an OTLP/HTTP collector so slow requests can be traced stage by stage.
+
+Tracing is configured with TRACE_EXPORT:
+    (unset)                      tracing off
+    file:/path/to/spans.jsonl    one OTLP/JSON ExportTraceServiceRequest per line
+    otlp:http://collector:4318   POST to <url>/v1/traces
+"""
+
+import contextvars
+import json
+import os
+import queue
+import secrets
+import threading
+import time
+from contextlib import contextmanager
+from typing import Callable, Dict, List, Optional, Tuple
+
+try:
+    import httpx
+except ImportError:
+    httpx = None
+
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+TRACE_EXPORT = os.getenv("TRACE_EXPORT", "")
+TRACE_SERVICE_NAME = os.getenv("TRACE_SERVICE_NAME", "brain-tumour-api")
+
+
+def _escape(value: str) -> str:
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _format_labels(names: Tuple[str, ...], values: Tuple, extra: str = "") -> str:
+    parts = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    if extra:
+        parts.append(extra)
+    return "{" + ",".join(parts) + "}" if parts else ""
+
+
+class Counter:
+    """Monotonic counter with optional labels."""
+
+    kind = "counter"
+
+    def __init__(self, name: str, documentation: str, labelnames: Tuple[str, ...] = ()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._values: Dict[Tuple, float] = {}
+        self._lock = threading.Lock()
+
+    def inc(self, amount: float = 1.0, **labels):
+        key = tuple(labels.get(name, "") for name in self.labelnames)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0.0) + amount
+
+    def samples(self) -> List[str]:
+        with self._lock:
+            return [f"{self.name}{_format_labels(self.labelnames, key)} {value:g}" for key, value in self._values.items()]
+
+
+class Histogram:
+    """Cumulative-bucket histogram (Prometheus semantics) with optional labels."""
+
+    kind = "histogram"
+
+    def __init__(
+        self,
+        name: str,
+        documentation: str,
+        labelnames: Tuple[str, ...] = (),
+        buckets: Tuple[float, ...] = DEFAULT_BUCKETS
+    ):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self.buckets = tuple(sorted(buckets))
+        # labels -> [bucket counts..., sum, count]
+        self._values: Dict[Tuple, List[float]] = {}
+        self._lock = threading.Lock()
+
+    def observe(self, value: float, **labels):
+        key = tuple(labels.get(name, "") for name in self.labelnames)
+        with self._lock:
+            entry = self._values.get(key)
+            if entry is None:
+                entry = self._values[key] = [0] * len(self.buckets) + [0.0, 0]
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    entry[i] += 1
+                    break
+            entry[-2] += value
+            entry[-1] += 1
+
+    def samples(self) -> List[str]:
+        lines = []
+        with self._lock:
+            for key, entry in self._values.items():
+                cumulative = 0
+                for bound, count in zip(self.buckets, entry):
+                    cumulative += count
+                    le = 'le="%g"' % bound
+                    lines.append(f"{self.name}_bucket{_format_labels(self.labelnames, key, le)} {cumulative}")
+                le = 'le="+Inf"'
+                lines.append(f"{self.name}_bucket{_format_labels(self.labelnames, key, le)} {entry[-1]}")
+                lines.append(f"{self.name}_sum{_format_labels(self.labelnames, key)} {entry[-2]:.6f}")
+                lines.append(f"{self.name}_count{_format_labels(self.labelnames, key)} {entry[-1]}")
+        return lines
+
+
+class Gauge:
+    """Gauge read from a callback at scrape time; the callback returns a number,
+    {label value: number} for a single label, or None to skip."""
+
+    kind = "gauge"
+
+    def __init__(self, name: str, documentation: str, callback: Callable, labelnames: Tuple[str, ...] = ()):
+        self.name = name
+        self.documentation = documentation
+        self.callback = callback
+        self.labelnames = tuple(labelnames)
+
+    def samples(self) -> List[str]:
+        try:
+            value = self.callback()
+        except Exception:
+            return []
+        if value is None:
+            return []
+        if isinstance(value, dict):
+            return [f"{self.name}{_format_labels(self.labelnames, (key,))} {float(v):g}" for key, v in value.items()]
+        return [f"{self.name} {float(value):g}"]
+
+
+class MetricsRegistry:
+    def __init__(self):
+        self._metrics = {}
+
+    def register(self, metric):
+        self._metrics[metric.name] = metric
+        return metric
+
+    def counter(self, name: str, documentation: str, labelnames: Tuple[str, ...] = ()) -> Counter:
+        return self.register(Counter(name, documentation, labelnames))
+
+    def histogram(self, name: str, documentation: str, labelnames: Tuple[str, ...] = (),
+                  buckets: Tuple[float, ...] = DEFAULT_BUCKETS) -> Histogram:
+        return self.register(Histogram(name, documentation, labelnames, buckets))
+
+    def gauge(self, name: str, documentation: str, callback: Callable, labelnames: Tuple[str, ...] = ()) -> Gauge:
+        return self.register(Gauge(name, documentation, callback, labelnames))
+
+    def render(self) -> str:
+        """Prometheus text exposition format (version 0.0.4)."""
+        lines = []
+        for metric in self._metrics.values():
+            lines.append(f"# HELP {metric.name} {metric.documentation}")
+            lines.append(f"# TYPE {metric.name} {metric.kind}")
+            lines.extend(metric.samples())
+        return "\n".join(lines) + "\n"
+
+
+REGISTRY = MetricsRegistry()
+
+HTTP_REQUESTS = REGISTRY.counter(
+    "http_requests_total", "HTTP requests by method, route and status code", ("method", "route", "status"))
+HTTP_ERRORS = REGISTRY.counter(
+    "http_request_errors_total", "HTTP requests that failed with a 5xx status", ("method", "route"))
+HTTP_LATENCY = REGISTRY.histogram(
+    "http_request_duration_seconds", "Time until the last response byte was sent", ("method", "route"))
+HTTP_IN_FLIGHT = 0
+REGISTRY.gauge("http_requests_in_flight", "HTTP requests currently being served", lambda: HTTP_IN_FLIGHT)
+STAGE_LATENCY = REGISTRY.histogram(
+    "stage_duration_seconds", "Time spent in each processing stage of an endpoint", ("endpoint", "stage"),
+    buckets=(0.0005, 0.001, 0.0025) + DEFAULT_BUCKETS)
+CHAT_TOKENS = REGISTRY.counter("chat_tokens_total", "Tokens sent to and generated by the LLM", ("kind",))
+
+
+# Tracing (OTLP span kinds)
+SPAN_KIND_INTERNAL = 1
+SPAN_KIND_SERVER = 2
+
+_current_span = contextvars.ContextVar("current_span", default=None)
+
+
+class Span:
+    __slots__ = ("trace", "trace_id", "span_id", "parent_id", "name", "kind",
+                 "start_ns", "end_ns", "attributes", "error")
+
+    def __init__(self, trace, trace_id: str, parent_id: Optional[str], name: str, kind: int, start_ns: int):
+        self.trace = trace
+        self.trace_id = trace_id
+        self.span_id = secrets.token_hex(8)
+        self.parent_id = parent_id
+        self.name = name
+        self.kind = kind
+        self.start_ns = start_ns
+        self.end_ns = None
+        self.attributes = {}
+        self.error = None
+
+    def set_attribute(self, key: str, value):
+        self.attributes[key] = value
+
+
+def _otlp_value(value) -> Dict:
+    if isinstance(value, bool):
+        return {"boolValue": value}
+    if isinstance(value, int):
+        return {"intValue": str(value)}
+    if isinstance(value, float):
+        return {"doubleValue": value}
+    return {"stringValue": str(value)}
+
+
+def _otlp_span(span: Span) -> Dict:
+    encoded = {
+        "traceId": span.trace_id,
+        "spanId": span.span_id,
+        "name": span.name,
+        "kind": span.kind,
+        "startTimeUnixNano": str(span.start_ns),
+        "endTimeUnixNano": str(span.end_ns),
+        "attributes": [{"key": k, "value": _otlp_value(v)} for k, v in span.attributes.items()],
+        "status": {"code": 2, "message": span.error} if span.error else {"code": 0},
+    }
+    if span.parent_id:
+        encoded["parentSpanId"] = span.parent_id
+    return encoded
+
+
+def otlp_payload(spans: List[Span], service_name: str = TRACE_SERVICE_NAME) -> Dict:
+    """OTLP/JSON ExportTraceServiceRequest for a list of finished spans."""
+    return {"resourceSpans": [{
+        "resource": {"attributes": [{"key": "service.name", "value": {"stringValue": service_name}}]},
+        "scopeSpans": [{"scope": {"name": "telemetry"}, "spans": [_otlp_span(span) for span in spans]}],
+    }]}
+
+
+class SpanExporter:
+    """Exports finished traces from a background thread so requests never wait on I/O."""
+
+    def __init__(self, max_queue: int = 1000):
+        self._queue = queue.Queue(maxsize=max_queue)
+        self.dropped = 0
+        self._thread = threading.Thread(target=self._run, name="span-exporter", daemon=True)
+        self._thread.start()
+
+    def export(self, spans: List[Span]):
+        try:
+            self._queue.put_nowait(spans)
+        except queue.Full:
+            self.dropped += 1
+
+    def _run(self):
+        while True:
+            spans = self._queue.get()
+            batch = list(spans)
+            while len(batch) < 512:
+                try:
+                    batch.extend(self._queue.get_nowait())
+                except queue.Empty:
+                    break
+            try:
+                self.send(otlp_payload(batch))
+            except Exception as e:
+                print(f"Span export failed: {e}")
+
+    def send(self, payload: Dict):
+        raise NotImplementedError
+
+
+class FileSpanExporter(SpanExporter):
+    def __init__(self, path: str):
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        self.path = path
+        super().__init__()
+
+    def send(self, payload: Dict):
+        with open(self.path, "a") as f:
+            f.write(json.dumps(payload, separators=(",", ":")) + "\n")
+
+
+class OtlpHttpSpanExporter(SpanExporter):
+    def __init__(self, endpoint: str):
+        if httpx is None:
+            raise ImportError("OTLP export requires the httpx package")
+        self.url = endpoint.rstrip("/")
+        if not self.url.endswith("/v1/traces"):
+            self.url += "/v1/traces"
+        self.client = httpx.Client(timeout=5.0)
+        super().__init__()
+
+    def send(self, payload: Dict):
+        self.client.post(self.url, json=payload).raise_for_status()
+
+
+def create_exporter(spec: str) -> Optional[SpanExporter]:
+    if not spec:
+        return None
+    kind, _, target = spec.partition(":")
+    if kind == "file":
+        return FileSpanExporter(target)
+    if kind == "otlp":
+        return OtlpHttpSpanExporter(target)
+    raise ValueError(f"Unknown TRACE_EXPORT '{spec}', expected file:<path> or otlp:<url>")
+
+
+class Tracer:
+    """Minimal span tracker: the root span of a request collects its children
+    and the whole trace is exported when the root ends."""
+
+    def __init__(self, exporter: Optional[SpanExporter] = None):
+        self.exporter = exporter
+
+    @property
+    def enabled(self) -> bool:
+        return self.exporter is not None
+
+    def start_root(self, name: str, traceparent: Optional[str] = None) -> Optional[Span]:
+        """Start a server span, continuing a W3C `traceparent` when given."""
+        if not self.enabled:
+            return None
+        trace_id, parent_id = secrets.token_hex(16), None
+        if traceparent:
+            parts = traceparent.split("-")
+            if len(parts) == 4 and len(parts[1]) == 32 and len(parts[2]) == 16:
+                trace_id, parent_id = parts[1], parts[2]
+        span = Span([], trace_id, parent_id, name, SPAN_KIND_SERVER, time.time_ns())
+        span.trace.append(span)
+        return span
+
+    def start_child(self, name: str, start_ns: Optional[int] = None) -> Optional[Span]:
+        parent = _current_span.get()
+        if parent is None:
+            return None
+        span = Span(parent.trace, parent.trace_id, parent.span_id, name, SPAN_KIND_INTERNAL,
+                    start_ns or time.time_ns())
+        parent.trace.append(span)
+        return span
+
+    def end(self, span: Optional[Span], end_ns: Optional[int] = None):
+        if span is None:
+            return
+        span.end_ns = end_ns or time.time_ns()
+        if span.kind == SPAN_KIND_SERVER:
+            self.exporter.export([s for s in span.trace if s.end_ns is not None])
+
+
+tracer = Tracer(create_exporter(TRACE_EXPORT))
+
+
+def current_span() -> Optional[Span]:
+    return _current_span.get()
+
+
+@contextmanager
+def stage(endpoint: str, name: str, **attributes):
+    """Time a block as a stage of `endpoint`, as a metric and a child span."""
+    span = tracer.start_child(f"{endpoint}.{name}")
+    token = _current_span.set(span) if span is not None else None
+    start = time.perf_counter()
+    try:
+        yield span
+    except Exception as e:
+        if span is not None:
+            span.error = f"{type(e).__name__}: {e}"
+        raise
+    finally:
+        STAGE_LATENCY.observe(time.perf_counter() - start, endpoint=endpoint, stage=name)
+        if span is not None:
+            span.attributes.update(attributes)
+            _current_span.reset(token)
+            tracer.end(span)
+
+
+def record_stage(endpoint: str, name: str, seconds: float, **attributes):
+    """Record a stage timed elsewhere (e.g. on a worker thread) that just ended."""
+    STAGE_LATENCY.observe(seconds, endpoint=endpoint, stage=name)
+    end_ns = time.time_ns()
+    span = tracer.start_child(f"{endpoint}.{name}", start_ns=end_ns - int(seconds * 1e9))
+    if span is not None:
+        span.attributes.update(attributes)
+        tracer.end(span, end_ns)
+
+
+class InstrumentationMiddleware:
+    """
+    ASGI middleware recording per-route request counts, 5xx errors and latency
+    (until the last body byte, so streaming responses are timed in full), and
+    opening the request's root span.
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        global HTTP_IN_FLIGHT
+        method = scope["method"]
+        traceparent = None
+        for key, value in scope.get("headers", ()):
+            if key == b"traceparent":
+                traceparent = value.decode("latin-1")
+                break
+        span = tracer.start_root(f"{method} {scope['path']}", traceparent)
+        token = _current_span.set(span) if span is not None else None
+        status = 500
+
+        async def send_with_status(message):
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+            await send(message)
+
+        HTTP_IN_FLIGHT += 1
+        start = time.perf_counter()
+        try:
+            await self.app(scope, receive, send_with_status)
+        except Exception as e:
+            if span is not None:
+                span.error = f"{type(e).__name__}: {e}"
+            raise
+        finally:
+            HTTP_IN_FLIGHT -= 1
+            elapsed = time.perf_counter() - start
+            route = scope.get("route")
+            # Route templates keep label cardinality bounded (e.g. /educational-content/{tumor_type})
+            route_path = getattr(route, "path", None) or "unmatched"
+            HTTP_REQUESTS.inc(method=method, route=route_path, status=str(status))
+            HTTP_LATENCY.observe(elapsed, method=method, route=route_path)
+            if status >= 500:
+                HTTP_ERRORS.inc(method=method, route=route_path)
+            if span is not None:
+                span.name = f"{method} {route_path}"
+                span.attributes.update({
+                    "http.request.method": method,
+                    "http.route": route_path,
+                    "url.path": scope["path"],
+                    "http.response.status_code": status,
+                })
+                if status >= 500 and span.error is None:
+                    span.error = f"HTTP {status}"
+                _current_span.reset(token)
+                tracer.end(span)
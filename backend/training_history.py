@@ -0,0 +1,108 @@
+"""
+Training history storage for /stats.
+Reads the per-metric JSON history once, re-reading only when the file's
+mtime/size change, with precomputed summary, serialized body, ETag and
+downsampled variants.
+
+Convert a legacy pickle (trusted files only) with:
+    python training_history.py data/training_history.pkl data/training_history.json
+"""
+
+import hashlib
+import json
+import os
+import sys
+import threading
+from typing import Dict, List, Optional, Tuple
+
+
+def write_history(path: str, history: Dict[str, List[float]]):
+    """Atomically write a history dict ({metric: [value per epoch]}) as JSON."""
+    tmp_path = path + ".tmp"
+    with open(tmp_path, "w") as f:
+        json.dump({"history": {k: [float(v) for v in values] for k, values in history.items()}}, f)
+    os.replace(tmp_path, path)
+
+
+def summarize(history: Dict[str, List[float]]) -> Dict:
+    return {
+        "max_accuracy": round(max(history.get('accuracy', [0])) * 100, 2),
+        "max_val_accuracy": round(max(history.get('val_accuracy', [0])) * 100, 2),
+        "final_loss": round(history.get('loss', [0])[-1], 4),
+        "epochs": len(history.get('accuracy', []))
+    }
+
+
+def downsample_indices(length: int, points: int) -> List[int]:
+    """`points` evenly spaced indices over `length` epochs, always keeping the first and last."""
+    if points >= length or length == 0:
+        return list(range(length))
+    if points <= 1:
+        return [length - 1]
+    step = (length - 1) / (points - 1)
+    return sorted({round(i * step) for i in range(points)})
+
+
+class HistoryStore:
+    """Cached view of the training history file, invalidated by mtime/size."""
+
+    def __init__(self, path: str, max_variants: int = 16):
+        self.path = path
+        self.max_variants = max_variants
+        self._lock = threading.Lock()
+        self._signature = None
+        self._history = None
+        self._variants = {}
+
+    def _refresh(self) -> bool:
+        """Reload the file if it changed. Returns False when it does not exist."""
+        try:
+            stat = os.stat(self.path)
+        except FileNotFoundError:
+            self._signature, self._history, self._variants = None, None, {}
+            return False
+        signature = (stat.st_mtime_ns, stat.st_size)
+        if signature != self._signature:
+            with open(self.path) as f:
+                self._history = json.load(f)["history"]
+            self._signature = signature
+            self._variants = {}
+        return True
+
+    def _render(self, points: Optional[int]) -> Tuple[bytes, str]:
+        history = self._history
+        length = len(history.get('loss', []))
+        payload = {"summary": summarize(history)}
+        if points is None:
+            payload["history"] = history
+        else:
+            indices = downsample_indices(length, points)
+            payload["history"] = {k: [values[i] for i in indices] for k, values in history.items()}
+            payload["epochs"] = [i + 1 for i in indices]
+        body = json.dumps(payload, separators=(",", ":")).encode("utf-8")
+        return body, '"' + hashlib.sha256(body).hexdigest()[:32] + '"'
+
+    def get(self, points: Optional[int] = None) -> Optional[Tuple[bytes, str]]:
+        """
+        Return (JSON body, ETag) for the full history or a `points`-point
+        downsample, or None if there is no history file.
+        """
+        with self._lock:
+            if not self._refresh():
+                return None
+            if points is not None and points >= len(self._history.get('loss', [])):
+                points = None
+            if points not in self._variants:
+                if len(self._variants) >= self.max_variants:
+                    self._variants.pop(next(iter(self._variants)))
+                self._variants[points] = self._render(points)
+            return self._variants[points]
+
+
+if __name__ == "__main__":
+    import pickle
+
+    source, target = sys.argv[1], sys.argv[2]
+    with open(source, "rb") as f:
+        write_history(target, pickle.load(f))
+    print(f"Wrote {target}")
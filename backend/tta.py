@@ -0,0 +1,83 @@
+"""
+Test-time augmentation (TTA).
+Builds flipped/rotated views of one preprocessed image as a single batch and
+aggregates the model's scores over the views into averaged probabilities and
+an uncertainty estimate.
+"""
+
+from typing import Dict, List
+
+import numpy as np
+
+# View name -> transform of an (H, W, C) image (square, so rotations keep the shape)
+VIEWS = {
+    "identity": lambda image: image,
+    "hflip": lambda image: image[:, ::-1],
+    "vflip": lambda image: image[::-1],
+    "rot90": lambda image: np.rot90(image, 1),
+    "rot180": lambda image: np.rot90(image, 2),
+    "rot270": lambda image: np.rot90(image, 3),
+}
+
+# Shorthands accepted in ?tta=
+VIEW_GROUPS = {
+    "flips": ["hflip", "vflip"],
+    "rot": ["rot90", "rot180", "rot270"],
+}
+
+
+def parse_tta(spec: str) -> List[str]:
+    """
+    Parse a comma-separated TTA spec (e.g. "flips,rot") into view names.
+    The original image is always the first view.
+
+    Raises:
+        ValueError: On an unknown view or group name
+    """
+    views = ["identity"]
+    for token in spec.split(","):
+        token = token.strip().lower()
+        if not token:
+            continue
+        names = VIEW_GROUPS.get(token, [token])
+        for name in names:
+            if name not in VIEWS:
+                known = ", ".join(list(VIEW_GROUPS) + list(VIEWS))
+                raise ValueError(f"Unknown TTA view '{token}', expected one of: {known}")
+            if name not in views:
+                views.append(name)
+    return views
+
+
+def build_views(image: np.ndarray, views: List[str]) -> np.ndarray:
+    """Stack every view of an (H, W, C) image into one (V, H, W, C) batch."""
+    batch = np.empty((len(views),) + image.shape, dtype=image.dtype)
+    for i, name in enumerate(views):
+        batch[i] = VIEWS[name](image)
+    return batch
+
+
+def aggregate(view_scores, views: List[str]) -> Dict:
+    """
+    Average the per-view probabilities and describe how much the views disagree.
+
+    Returns:
+        {"scores": mean probabilities, "tta": uncertainty summary}
+    """
+    view_scores = np.asarray(view_scores, dtype=np.float64)
+    mean = view_scores.mean(axis=0)
+    std = view_scores.std(axis=0)
+    top = int(np.argmax(mean))
+    # Entropy of the averaged prediction, normalized to [0, 1]
+    entropy = -np.sum(mean * np.log(np.clip(mean, 1e-12, None))) / np.log(len(mean))
+
+    return {
+        "scores": mean,
+        "tta": {
+            "views": views,
+            "variance": round(float(np.mean(view_scores.var(axis=0))), 6),
+            "std": [round(float(value), 6) for value in std],
+            "agreement": round(float(np.mean(np.argmax(view_scores, axis=1) == top)), 4),
+            "entropy": round(float(entropy), 4),
+        },
+    }
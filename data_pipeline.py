@@ -0,0 +1,215 @@
+"""
+Streaming, parallel training data pipeline.
+Decodes and resizes MRI scans on a pool of worker threads (OpenCV releases
+the GIL) and streams shuffled, optionally augmented batches with bounded
+prefetching, instead of loading the whole dataset into Python lists.
+"""
+
+import os
+import sys
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from typing import Iterator, List, Optional, Tuple
+
+import numpy as np
+
+# Shared preprocessing with the API (backend/preprocessing.py)
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), 'backend'))
+from preprocessing import preprocess_file
+
+LABELS = ['glioma_tumor', 'meningioma_tumor', 'no_tumor', 'pituitary_tumor']
+IMAGE_SIZE = 150
+
+
+def list_split(root: str, split: str, labels: List[str] = LABELS) -> Tuple[List[str], np.ndarray]:
+    """
+    List the images of one split laid out as <root>/<split>/<label>/<file>.
+
+    Returns:
+        (file paths, label indices)
+    """
+    paths, targets = [], []
+    for index, label in enumerate(labels):
+        folder = os.path.join(root, split, label)
+        for name in sorted(os.listdir(folder)):
+            if not name.startswith('.'):
+                paths.append(os.path.join(folder, name))
+                targets.append(index)
+    return paths, np.array(targets, dtype=np.int64)
+
+
+def _augment(batch: np.ndarray, rng: np.random.Generator) -> np.ndarray:
+    """Random horizontal flips and mild brightness jitter, in place."""
+    flips = rng.random(len(batch)) < 0.5
+    batch[flips] = batch[flips, :, ::-1]
+    gains = rng.uniform(0.9, 1.1, size=(len(batch), 1, 1, 1)).astype(np.float32)
+    batch[...] = np.clip(batch * gains, 0, 255)
+    return batch
+
+
+def _finish_batch(
+    images: np.ndarray,
+    targets: np.ndarray,
+    num_classes: int,
+    augment: bool,
+    seed: Optional[int]
+) -> Tuple[np.ndarray, np.ndarray]:
+    """Apply augmentation and build one-hot labels for a decoded batch."""
+    if augment:
+        images = _augment(images, np.random.default_rng(seed))
+    one_hot = np.zeros((len(targets), num_classes), dtype=np.float32)
+    one_hot[np.arange(len(targets)), targets] = 1.0
+    return images, one_hot
+
+
+class ParallelImageLoader:
+    """
+    Iterable over (images, one-hot labels) batches for one split.
+
+    Batches are decoded by a pool of worker threads; at most
+    `prefetch_batches` batches are in flight or buffered at any time, so peak
+    memory is bounded by the batch size rather than the dataset size.
+    """
+
+    def __init__(
+        self,
+        paths: List[str],
+        targets: np.ndarray,
+        batch_size: int = 32,
+        image_size: int = IMAGE_SIZE,
+        num_classes: int = len(LABELS),
+        shuffle: bool = True,
+        augment: bool = False,
+        workers: Optional[int] = None,
+        prefetch_batches: int = 8,
+        seed: Optional[int] = None
+    ):
+        self.paths = list(paths)
+        self.targets = np.asarray(targets)
+        self.batch_size = batch_size
+        self.image_size = image_size
+        self.num_classes = num_classes
+        self.shuffle = shuffle
+        self.augment = augment
+        self.workers = workers or os.cpu_count() or 1
+        self.prefetch_batches = max(1, prefetch_batches)
+        self._rng = np.random.default_rng(seed)
+        self._pool = None
+        # Indices of undecodable files, dropped from later epochs
+        self.skipped = set()
+
+    def __len__(self) -> int:
+        return (len(self.targets) + self.batch_size - 1) // self.batch_size
+
+    def _load(self, indices: np.ndarray, seed: Optional[int]) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        Worker task: decode one batch into a single uint8 array plus one-hot labels.
+        Unreadable files are logged and left out of the batch, as build_cache does.
+        """
+        images = np.empty((len(indices), self.image_size, self.image_size, 3), dtype=np.uint8)
+        keep = []
+        for i in indices:
+            try:
+                preprocess_file(self.paths[i], self.image_size, out=images[len(keep)])
+            except ValueError as e:
+                print(f"Skipping unreadable image {self.paths[i]}: {e}")
+                self.skipped.add(int(i))
+                continue
+            keep.append(i)
+        return _finish_batch(images[:len(keep)], self.targets[keep], self.num_classes, self.augment, seed)
+
+    def _get_pool(self):
+        if self._pool is None:
+            self._pool = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix="decode")
+        return self._pool
+
+    def __iter__(self) -> Iterator[Tuple[np.ndarray, np.ndarray]]:
+        count = len(self.targets)
+        order = self._rng.permutation(count) if self.shuffle else np.arange(count)
+        if self.skipped:
+            order = order[~np.isin(order, list(self.skipped))]
+        pool = self._get_pool()
+        pending = deque()
+
+        def submit(start: int):
+            indices = order[start:start + self.batch_size]
+            seed = int(self._rng.integers(2 ** 31)) if self.augment else None
+            pending.append(pool.submit(self._load, indices, seed))
+
+        starts = iter(range(0, len(order), self.batch_size))
+        for start in starts:
+            submit(start)
+            if len(pending) >= self.prefetch_batches:
+                break
+        while pending:
+            batch = pending.popleft().result()
+            next_start = next(starts, None)
+            if next_start is not None:
+                submit(next_start)
+            if len(batch[0]):
+                yield batch
+
+    def as_tf_dataset(self):
+        """
+        Wrap the loader in a tf.data pipeline that prefetches batches in the
+        background, overlapping decoding/augmentation with model compute.
+        """
+        import tensorflow as tf
+
+        signature = (
+            tf.TensorSpec((None, self.image_size, self.image_size, 3), tf.uint8),
+            tf.TensorSpec((None, self.num_classes), tf.float32)
+        )
+        return tf.data.Dataset.from_generator(lambda: iter(self), output_signature=signature).prefetch(tf.data.AUTOTUNE)
+
+    def close(self):
+        if self._pool is not None:
+            self._pool.shutdown(wait=False, cancel_futures=True)
+            self._pool = None
+
+
+def train_val_test_loaders(
+    root: str,
+    batch_size: int = 32,
+    val_fraction: float = 0.1,
+    augment: bool = False,
+    workers: Optional[int] = None,
+    seed: int = 101,
+    cache_dir: Optional[str] = None
+) -> Tuple[ParallelImageLoader, ParallelImageLoader, ParallelImageLoader]:
+    """
+    Build loaders where validation is a stratified split of <root>/Training and
+    <root>/Testing is kept strictly for final evaluation.
+
+    With `cache_dir`, both splits are first built/refreshed as memory-mapped
+    caches (dataset_cache.py) and batches are gathered from them.
+    """
+    from sklearn.model_selection import train_test_split
+
+    if cache_dir:
+        from dataset_cache import CachedDataset, build_cache
+
+        for split in ('Training', 'Testing'):
+            stats = build_cache(root, split, cache_dir, workers=workers)
+            print(f"Dataset cache {split}: {stats['reused']} reused, {stats['decoded']} decoded")
+        training, testing = CachedDataset(cache_dir, 'Training'), CachedDataset(cache_dir, 'Testing')
+        train_rows, val_rows = train_test_split(
+            np.arange(len(training)), test_size=val_fraction, random_state=seed, stratify=training.targets
+        )
+        return (
+            training.loader(train_rows, batch_size=batch_size, shuffle=True, augment=augment, workers=workers, seed=seed),
+            training.loader(val_rows, batch_size=batch_size, shuffle=False, workers=workers),
+            testing.loader(batch_size=batch_size, shuffle=False, workers=workers),
+        )
+
+    paths, targets = list_split(root, 'Training')
+    train_paths, val_paths, train_targets, val_targets = train_test_split(
+        paths, targets, test_size=val_fraction, random_state=seed, stratify=targets
+    )
+    test_paths, test_targets = list_split(root, 'Testing')
+
+    train = ParallelImageLoader(train_paths, train_targets, batch_size, shuffle=True,
+                                augment=augment, workers=workers, seed=seed)
+    val = ParallelImageLoader(val_paths, val_targets, batch_size, shuffle=False, workers=workers)
+    test = ParallelImageLoader(test_paths, test_targets, batch_size, shuffle=False, workers=workers)
+    return train, val, test
@@ -0,0 +1,219 @@
+"""
+Preprocessed dataset cache.
+Stores resized uint8 scans for one split in a memory-mapped .npy file with a
+JSON manifest (source path, content hash, label) so retraining skips JPEG
+decoding. Rebuilds only decode files whose content hash changed.
+
+Usage:
+    python dataset_cache.py /archive --cache-dir dataset_cache
+"""
+
+import argparse
+import hashlib
+import json
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+
+from data_pipeline import LABELS, IMAGE_SIZE, ParallelImageLoader, _finish_batch, list_split
+from preprocessing import REDUCED_DECODE, preprocess_file
+
+# Bump when the on-disk layout or the preprocessing output changes
+CACHE_FORMAT_VERSION = 1
+
+
+def _hash_file(path: str) -> str:
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(1 << 20), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def _cache_paths(cache_dir: str, split: str) -> Dict[str, str]:
+    base = os.path.join(cache_dir, split.lower())
+    return {
+        'images': base + '_images.npy',
+        'labels': base + '_labels.npy',
+        'manifest': base + '_manifest.json',
+    }
+
+
+def _cache_signature(image_size: int, labels: List[str]) -> Dict:
+    return {
+        'version': CACHE_FORMAT_VERSION,
+        'image_size': image_size,
+        'labels': list(labels),
+        'reduced_decode': REDUCED_DECODE,
+    }
+
+
+def build_cache(
+    root: str,
+    split: str,
+    cache_dir: str,
+    image_size: int = IMAGE_SIZE,
+    labels: List[str] = LABELS,
+    workers: Optional[int] = None
+) -> Dict:
+    """
+    Build or refresh the cache for <root>/<split>.
+
+    Rows whose source file hash is unchanged are copied from the previous
+    cache; only new or modified files are decoded. The new files are written
+    beside the old ones and swapped in with os.replace, so readers never see a
+    half-written cache.
+
+    Returns:
+        Build statistics (images, reused, decoded, skipped, seconds)
+    """
+    start = time.perf_counter()
+    os.makedirs(cache_dir, exist_ok=True)
+    files = _cache_paths(cache_dir, split)
+    signature = _cache_signature(image_size, labels)
+    paths, targets = list_split(root, split, labels)
+
+    # Previous cache rows, reusable only if it was built the same way
+    previous_rows, previous_images = {}, None
+    if os.path.exists(files['manifest']):
+        with open(files['manifest']) as f:
+            previous = json.load(f)
+        if {k: previous.get(k) for k in signature} == signature and os.path.exists(files['images']):
+            previous_images = np.load(files['images'], mmap_mode='r')
+            previous_rows = {entry['sha256']: entry['index'] for entry in previous['entries']}
+
+    workers = workers or os.cpu_count() or 1
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        digests = list(pool.map(_hash_file, paths))
+
+        tmp_images = files['images'] + '.tmp'
+        images = np.lib.format.open_memmap(tmp_images, mode='w+', dtype=np.uint8,
+                                           shape=(len(paths), image_size, image_size, 3))
+
+        def fill(row: int) -> bool:
+            if digests[row] in previous_rows:
+                images[row] = previous_images[previous_rows[digests[row]]]
+                return True
+            preprocess_file(paths[row], image_size, out=images[row])
+            return False
+
+        reused, decoded, skipped, keep = 0, 0, 0, []
+        futures = [pool.submit(fill, row) for row in range(len(paths))]
+        for row, future in enumerate(futures):
+            try:
+                was_reused = future.result()
+            except ValueError as e:
+                print(f"Skipping unreadable image {paths[row]}: {e}")
+                skipped += 1
+                continue
+            reused += was_reused
+            decoded += not was_reused
+            keep.append(row)
+
+    if skipped:
+        # Compact the rows of skipped files out of the memmap
+        compacted = np.lib.format.open_memmap(tmp_images + '2', mode='w+', dtype=np.uint8,
+                                              shape=(len(keep), image_size, image_size, 3))
+        for new_row, row in enumerate(keep):
+            compacted[new_row] = images[row]
+        del images
+        os.replace(tmp_images + '2', tmp_images)
+        images = compacted
+
+    entries = []
+    for new_row, row in enumerate(keep):
+        entries.append({
+            'index': new_row,
+            'path': os.path.relpath(paths[row], root),
+            'sha256': digests[row],
+            'label': labels[targets[row]],
+        })
+
+    images.flush()
+    del images, previous_images
+    np.save(files['labels'] + '.tmp.npy', targets[keep])
+    manifest = {**signature, 'split': split, 'count': len(entries), 'created': time.time(), 'entries': entries}
+    with open(files['manifest'] + '.tmp', 'w') as f:
+        json.dump(manifest, f)
+
+    os.replace(tmp_images, files['images'])
+    os.replace(files['labels'] + '.tmp.npy', files['labels'])
+    os.replace(files['manifest'] + '.tmp', files['manifest'])
+
+    return {
+        'split': split,
+        'images': len(entries),
+        'reused': reused,
+        'decoded': decoded,
+        'skipped': skipped,
+        'seconds': round(time.perf_counter() - start, 2),
+    }
+
+
+class CachedDataset:
+    """Zero-copy, read-only view of a cached split."""
+
+    def __init__(self, cache_dir: str, split: str):
+        files = _cache_paths(cache_dir, split)
+        with open(files['manifest']) as f:
+            self.manifest = json.load(f)
+        if self.manifest.get('version') != CACHE_FORMAT_VERSION:
+            raise ValueError(f"Dataset cache {files['manifest']} has format version "
+                             f"{self.manifest.get('version')}, expected {CACHE_FORMAT_VERSION}; rebuild it")
+        self.images = np.load(files['images'], mmap_mode='r')
+        self.targets = np.load(files['labels'])
+        self.labels = self.manifest['labels']
+        self.image_size = self.manifest['image_size']
+
+    def __len__(self) -> int:
+        return len(self.targets)
+
+    def get_batch(self, indices: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        Random-access batch: copies only the requested rows out of the memmap.
+        Indices are sorted first for sequential disk access.
+        """
+        indices = np.sort(np.asarray(indices))
+        return self.images[indices], self.targets[indices]
+
+    def loader(self, indices: Optional[np.ndarray] = None, **kwargs) -> 'CachedImageLoader':
+        """Batch loader over all rows, or the given subset of rows."""
+        return CachedImageLoader(self, np.arange(len(self)) if indices is None else np.asarray(indices), **kwargs)
+
+
+class CachedImageLoader(ParallelImageLoader):
+    """ParallelImageLoader that gathers batches from a CachedDataset instead of decoding."""
+
+    def __init__(self, dataset: CachedDataset, rows: np.ndarray, **kwargs):
+        kwargs.setdefault('image_size', dataset.image_size)
+        kwargs.setdefault('num_classes', len(dataset.labels))
+        super().__init__([], dataset.targets[rows], **kwargs)
+        self.dataset = dataset
+        self.rows = rows
+
+    def _load(self, indices: np.ndarray, seed: Optional[int]) -> Tuple[np.ndarray, np.ndarray]:
+        rows = self.rows[indices]
+        images = self.dataset.images[rows]
+        return _finish_batch(images, self.targets[indices], self.num_classes, self.augment, seed)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Build the preprocessed dataset cache.")
+    parser.add_argument("root", help="Dataset root containing Training/ and Testing/")
+    parser.add_argument("--cache-dir", default="dataset_cache")
+    parser.add_argument("--splits", nargs="+", default=["Training", "Testing"])
+    parser.add_argument("--image-size", type=int, default=IMAGE_SIZE)
+    parser.add_argument("--workers", type=int, default=None)
+    args = parser.parse_args()
+
+    for split in args.splits:
+        stats = build_cache(args.root, split, args.cache_dir, args.image_size, workers=args.workers)
+        print(f"{split}: {stats['images']} images ({stats['reused']} reused, {stats['decoded']} decoded, "
+              f"{stats['skipped']} skipped) in {stats['seconds']}s")
+
+
+if __name__ == "__main__":
+    main()
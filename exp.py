@@ -14,79 +14,33 @@ import tqdm
 from sklearn.model_selection import train_test_split
 from sklearn.utils import shuffle
 import os
+import sys
+
+# Shared preprocessing with the API (backend/preprocessing.py)
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), 'backend'))
+from preprocessing import preprocess_file
 for dirname, _, filenames in os.walk('/archive'):
     for filename in filenames:
         print(os.path.join(dirname, filename))
 
 
 
-# Train test split
-X_train = []
-Y_train = []
+# Streaming train/validation/test pipeline (data_pipeline.py). Validation is a
+# stratified split of Training; Testing is held out for the final evaluation.
+from data_pipeline import LABELS, train_val_test_loaders
+
 image_size = 150
-labels = ['glioma_tumor', 'meningioma_tumor', 'no_tumor', 'pituitary_tumor']
-for i in labels:
-    folderPath = os.path.join('/archive/Testing', i)
-    for j in os.listdir(folderPath):
-        img = cv2.imread(os.path.join(folderPath, j))
-        img = cv2.resize(img, (image_size, image_size))
-        X_train.append(img)
-        Y_train.append(i)
-
-for i in labels:
-    folderPath = os.path.join('/archive/Training', i)
-    for j in os.listdir(folderPath):
-        img = cv2.imread(os.path.join(folderPath, j))
-        img = cv2.resize(img, (image_size, image_size))
-        X_train.append(img)
-        Y_train.append(i)
-
-X_train = np.array(X_train)
-Y_train = np.array(Y_train)
-
-X_train, Y_train = shuffle(X_train, Y_train, random_state=101)
-X_train.shape
-
-# # train test split
-X_train, X_test, y_train, y_test = train_test_split(X_train, Y_train, test_size=0.1, random_state=101)
-
-y_train_new = []
-for i in y_train:
-    y_train_new.append(labels.index(i))
-y_train = y_train_new
-y_train = tf.keras.utils.to_categorical(y_train)
-
-y_test_new = []
-for i in y_test:
-    y_test_new.append(labels.index(i))
-y_test = y_test_new
-y_test = tf.keras.utils.to_categorical(y_test)
-
-# # Convolutional Neural Network
-model = Sequential()
-model.add(Conv2D(32, (3, 3), activation='relu', input_shape=(150, 150, 3)))
-model.add(Conv2D(64, (3, 3), activation='relu'))
-model.add(MaxPooling2D(2, 2))
-model.add(Dropout(0.3))
-model.add(Conv2D(64, (3, 3), activation='relu'))
-model.add(Conv2D(64, (3, 3), activation='relu'))
-model.add(Dropout(0.3))
-model.add(MaxPooling2D(2, 2))
-model.add(Dropout(0.3))
-model.add(Conv2D(128, (3, 3), activation='relu'))
-model.add(Conv2D(128, (3, 3), activation='relu'))
-model.add(Conv2D(128, (3, 3), activation='relu'))
-model.add(MaxPooling2D(2, 2))
-model.add(Dropout(0.3))
-model.add(Conv2D(256, (3, 3), activation='relu'))
-model.add(Conv2D(256, (3, 3), activation='relu'))
-model.add(MaxPooling2D(2, 2))
-model.add(Dropout(0.3))
-model.add(Flatten())
-model.add(Dense(512, activation='relu'))
-model.add(Dense(512, activation='relu'))
-model.add(Dropout(0.3))
-model.add(Dense(4, activation='softmax'))
+labels = LABELS
+train_loader, val_loader, test_loader = train_val_test_loaders('/archive', batch_size=32, val_fraction=0.1, augment=True,
+                                                               cache_dir='dataset_cache')
+train_ds = train_loader.as_tf_dataset()
+val_ds = val_loader.as_tf_dataset()
+test_ds = test_loader.as_tf_dataset()
+
+# # Convolutional Neural Network (same architecture as train.py)
+from train import build_model
+
+model = build_model(image_size)
 
 model.summary()
 #
@@ -97,16 +51,18 @@ from keras.callbacks import History
 # Create a History callback
 history_callback = History()
 
-history = model.fit(X_train, y_train, epochs=20, validation_split=0.1)
+history = model.fit(train_ds, validation_data=val_ds, epochs=20)
+test_loss, test_acc = model.evaluate(test_ds)
+print(f"Held-out test accuracy: {test_acc:.4f}")
 
 train_loss = history.history['loss']
 val_loss = history.history['val_loss']
 train_acc = history.history['accuracy']
 val_acc = history.history['val_accuracy']
-import pickle
+from training_history import write_history
 
-with open('training_history.pkl', 'wb') as file:
-    pickle.dump(history.history, file)
+# Served by /stats from backend/data/training_history.json
+write_history('training_history.json', history.history)
 
 import matplotlib.pyplot as plt
 import seaborn as sns
@@ -141,9 +97,7 @@ with open('model.pkl', 'rb') as model_file:
     loaded_model = pickle.load(model_file)
 
 # PREDICTION
-img = cv2.imread('/Users/siddharthkms/PycharmProjects/pythonProject4/archive/Testing/glioma_tumor/image(3).jpg')
-img = cv2.resize(img,(150,150))
-img_array = np.array(img)
+img_array = preprocess_file('/Users/siddharthkms/PycharmProjects/pythonProject4/archive/Testing/glioma_tumor/image(3).jpg', 150)
 img_array.shape
 
 img_array = img_array.reshape(1,150,150,3)
@@ -176,7 +176,7 @@ async function loadStats() {
     if (chartsCreated) return;
 
     try {
-        const response = await fetch(`${API_BASE}/stats`);
+        const response = await fetch(`${API_BASE}/stats?points=200`);
         const data = await response.json();
         const history = data.history;
         const summary = data.summary;
@@ -186,7 +186,7 @@ async function loadStats() {
         document.getElementById('statValAcc').innerText = summary.max_val_accuracy + '%';
         document.getElementById('statLoss').innerText = summary.final_loss;
 
-        const labels = Array.from({ length: history.accuracy.length }, (_, i) => i + 1);
+        const labels = data.epochs || Array.from({ length: history.accuracy.length }, (_, i) => i + 1);
 
         new Chart(document.getElementById('accuracyChart'), {
             type: 'line',
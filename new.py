@@ -1,5 +1,6 @@
 from keras.models import load_model
 import os
+import sys
 import numpy as np
 import matplotlib.pyplot as plt
 
@@ -9,13 +10,13 @@ import gradio as gr
 model_path = '/Users/siddharthkms/PycharmProjects/pythonProject4/braintumour.h5'
 model = load_model(model_path)
 
-import cv2
+# Shared preprocessing with the API (backend/preprocessing.py)
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), 'backend'))
+from preprocessing import preprocess_file
 
-def predict_image(image):
-    # Preprocess the image
-    img_array = cv2.resize(image, (150, 150))
-    img_array = np.array(img_array)
-    img_array = img_array.reshape(1, 150, 150, 3)
+def predict_image(image_path):
+    # Preprocess the uploaded file exactly like the API does
+    img_array = preprocess_file(image_path, 150)[np.newaxis]
     a = model.predict(img_array)
     indices = a.argmax(axis=1)
     if (indices == 0):
@@ -32,7 +33,7 @@ def predict_image(image):
 
 iface = gr.Interface(
     fn=predict_image,
-    inputs=gr.inputs.Image(label="Upload MRI scan here"),
+    inputs=gr.inputs.Image(type="filepath", label="Upload MRI scan here"),
     outputs=gr.outputs.Textbox(label="Prediction: "),
     title="Brain Tumor Detection",
     description="Upload a preprocessed MRI scan to get the tumor classification.",
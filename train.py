@@ -0,0 +1,215 @@
+"""
+Training entry point for the brain tumour CNN.
+Tunes CPU threading, uses bfloat16 mixed precision where the CPU supports it,
+checkpoints every epoch so interrupted runs resume, stops early on plateaued
+validation loss, and rewrites the training history after every epoch so /stats
+can show a run in progress.
+
+Usage:
+    python train.py /archive --epochs 20 --cache-dir dataset_cache
+    python train.py /archive --resume
+"""
+
+import argparse
+import json
+import os
+
+from data_pipeline import IMAGE_SIZE, LABELS, train_val_test_loaders
+from training_history import write_history
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+DEFAULT_HISTORY_PATH = os.path.join(BASE_DIR, 'backend', 'data', 'training_history.json')
+PRECISIONS = ('auto', 'float32', 'bfloat16')
+
+
+def cpu_supports_bfloat16() -> bool:
+    """True if the CPU has native bfloat16 instructions (AVX512-BF16 or AMX)."""
+    try:
+        with open('/proc/cpuinfo') as f:
+            flags = f.read()
+    except OSError:
+        return False
+    return 'avx512_bf16' in flags or 'amx_bf16' in flags
+
+
+def build_model(image_size: int = IMAGE_SIZE, num_classes: int = len(LABELS)):
+    """The CNN served by the API (models/braintumourN.h5)."""
+    from keras.models import Sequential
+    from keras.layers import Conv2D, Flatten, Dense, MaxPooling2D, Dropout
+
+    model = Sequential()
+    model.add(Conv2D(32, (3, 3), activation='relu', input_shape=(image_size, image_size, 3)))
+    model.add(Conv2D(64, (3, 3), activation='relu'))
+    model.add(MaxPooling2D(2, 2))
+    model.add(Dropout(0.3))
+    model.add(Conv2D(64, (3, 3), activation='relu'))
+    model.add(Conv2D(64, (3, 3), activation='relu'))
+    model.add(Dropout(0.3))
+    model.add(MaxPooling2D(2, 2))
+    model.add(Dropout(0.3))
+    model.add(Conv2D(128, (3, 3), activation='relu'))
+    model.add(Conv2D(128, (3, 3), activation='relu'))
+    model.add(Conv2D(128, (3, 3), activation='relu'))
+    model.add(MaxPooling2D(2, 2))
+    model.add(Dropout(0.3))
+    model.add(Conv2D(256, (3, 3), activation='relu'))
+    model.add(Conv2D(256, (3, 3), activation='relu'))
+    model.add(MaxPooling2D(2, 2))
+    model.add(Dropout(0.3))
+    model.add(Flatten())
+    model.add(Dense(512, activation='relu'))
+    model.add(Dense(512, activation='relu'))
+    model.add(Dropout(0.3))
+    # Softmax stays float32 under mixed precision for numerically stable probabilities
+    model.add(Dense(num_classes, activation='softmax', dtype='float32'))
+    return model
+
+
+def _atomic_write(path: str, data: bytes):
+    tmp_path = path + '.tmp'
+    with open(tmp_path, 'wb') as f:
+        f.write(data)
+    os.replace(tmp_path, path)
+
+
+def make_callbacks(args, history, state_path, best_wait=None):
+    """Checkpointing, early stopping and live history callbacks."""
+    from keras.callbacks import Callback, EarlyStopping, ModelCheckpoint
+
+    last_path = os.path.join(args.checkpoint_dir, 'last.h5')
+    best_path = os.path.join(args.checkpoint_dir, 'best.h5')
+
+    class ResumableEarlyStopping(EarlyStopping):
+        """EarlyStopping that carries its patience counter across resumes."""
+
+        def on_train_begin(self, logs=None):
+            super().on_train_begin(logs)
+            if best_wait:
+                self.best, self.wait = best_wait
+
+    early_stopping = ResumableEarlyStopping(monitor='val_loss', patience=args.patience, min_delta=args.min_delta)
+
+    class TrainingState(Callback):
+        """Writes history (JSON + per-epoch JSON lines log) and resume state after every epoch."""
+
+        def on_train_begin(self, logs=None):
+            # Rewrite the log from the restored history so it never has stale epochs
+            with open(args.history_log, 'w') as f:
+                for epoch in range(len(history.get('loss', []))):
+                    f.write(json.dumps({'epoch': epoch + 1, **{k: v[epoch] for k, v in history.items()}}) + '\n')
+
+        def on_epoch_end(self, epoch, logs=None):
+            logs = {k: float(v) for k, v in (logs or {}).items()}
+            for key, value in logs.items():
+                history.setdefault(key, []).append(value)
+            write_history(args.history, history)
+            with open(args.history_log, 'a') as f:
+                f.write(json.dumps({'epoch': epoch + 1, **logs}) + '\n')
+            state = {
+                'epoch': epoch + 1,
+                'history': history,
+                'early_stopping': [float(early_stopping.best), int(early_stopping.wait)],
+            }
+            _atomic_write(state_path, json.dumps(state).encode('utf-8'))
+
+    return [
+        ModelCheckpoint(last_path),
+        ModelCheckpoint(best_path, monitor='val_loss', save_best_only=True,
+                        initial_value_threshold=best_wait[0] if best_wait else None),
+        early_stopping,
+        TrainingState(),
+    ]
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Train the brain tumour CNN on CPU.")
+    parser.add_argument("root", help="Dataset root containing Training/ and Testing/")
+    parser.add_argument("--epochs", type=int, default=20)
+    parser.add_argument("--batch-size", type=int, default=32)
+    parser.add_argument("--val-fraction", type=float, default=0.1)
+    parser.add_argument("--augment", action="store_true")
+    parser.add_argument("--cache-dir", help="Train from a memory-mapped dataset cache (dataset_cache.py)")
+    parser.add_argument("--data-workers", type=int, default=None, help="Decode threads (default: CPU count)")
+    parser.add_argument("--intra-op-threads", type=int, default=0, help="Threads per op (0: TensorFlow decides)")
+    parser.add_argument("--inter-op-threads", type=int, default=0, help="Ops run in parallel (0: TensorFlow decides)")
+    parser.add_argument("--precision", choices=PRECISIONS, default="auto",
+                        help="auto uses bfloat16 when the CPU supports it natively")
+    parser.add_argument("--patience", type=int, default=4, help="Early stopping patience in epochs")
+    parser.add_argument("--min-delta", type=float, default=1e-3)
+    parser.add_argument("--checkpoint-dir", default="checkpoints")
+    parser.add_argument("--resume", action="store_true", help="Continue from the last checkpoint")
+    parser.add_argument("--history", default=DEFAULT_HISTORY_PATH, help="Training history JSON read by /stats")
+    parser.add_argument("--history-log", help="Per-epoch JSON lines log (default: next to --history)")
+    parser.add_argument("--output", default="braintumourN.h5", help="Where to save the best model")
+    args = parser.parse_args()
+    args.history_log = args.history_log or os.path.splitext(args.history)[0] + '.jsonl'
+
+    import tensorflow as tf
+
+    # Threading must be configured before TensorFlow creates its thread pools
+    tf.config.threading.set_intra_op_parallelism_threads(args.intra_op_threads)
+    tf.config.threading.set_inter_op_parallelism_threads(args.inter_op_threads)
+
+    precision = args.precision
+    if precision == 'auto':
+        precision = 'bfloat16' if cpu_supports_bfloat16() else 'float32'
+    if precision == 'bfloat16':
+        tf.keras.mixed_precision.set_global_policy('mixed_bfloat16')
+    print(f"Precision: {precision}, intra-op threads: {args.intra_op_threads or 'auto'}, "
+          f"inter-op threads: {args.inter_op_threads or 'auto'}")
+
+    os.makedirs(args.checkpoint_dir, exist_ok=True)
+    os.makedirs(os.path.dirname(os.path.abspath(args.history)), exist_ok=True)
+    state_path = os.path.join(args.checkpoint_dir, 'state.json')
+    last_path = os.path.join(args.checkpoint_dir, 'last.h5')
+
+    history, initial_epoch, best_wait = {}, 0, None
+    if args.resume and os.path.exists(state_path) and os.path.exists(last_path):
+        with open(state_path) as f:
+            state = json.load(f)
+        model = tf.keras.models.load_model(last_path)
+        history, initial_epoch = state['history'], state['epoch']
+        best_wait = tuple(state['early_stopping'])
+        print(f"Resuming from epoch {initial_epoch}")
+    else:
+        # A fresh run must not pick up best.h5 from an earlier run
+        for path in (state_path, last_path, os.path.join(args.checkpoint_dir, 'best.h5')):
+            if os.path.exists(path):
+                os.remove(path)
+        model = build_model()
+        model.compile(loss='categorical_crossentropy', optimizer='Adam', metrics=['accuracy'])
+
+    train_loader, val_loader, test_loader = train_val_test_loaders(
+        args.root, batch_size=args.batch_size, val_fraction=args.val_fraction,
+        augment=args.augment, workers=args.data_workers, cache_dir=args.cache_dir
+    )
+    try:
+        model.fit(
+            train_loader.as_tf_dataset(),
+            validation_data=val_loader.as_tf_dataset(),
+            epochs=args.epochs,
+            initial_epoch=initial_epoch,
+            callbacks=make_callbacks(args, history, state_path, best_wait)
+        )
+
+        best_path = os.path.join(args.checkpoint_dir, 'best.h5')
+        if os.path.exists(best_path):
+            model.load_weights(best_path)
+        test_loss, test_acc = model.evaluate(test_loader.as_tf_dataset())
+        print(f"Held-out test accuracy: {test_acc:.4f} (loss {test_loss:.4f})")
+        if precision == 'bfloat16':
+            # Serve a float32 copy: the API may run on CPUs without bfloat16
+            tf.keras.mixed_precision.set_global_policy('float32')
+            served = build_model()
+            served.set_weights(model.get_weights())
+            served.compile(loss='categorical_crossentropy', optimizer='Adam', metrics=['accuracy'])
+            model = served
+        model.save(args.output)
+        print(f"Saved model to {args.output}")
+    finally:
+        for loader in (train_loader, val_loader, test_loader):
+            loader.close()
+
+
+if __name__ == "__main__":
+    main()